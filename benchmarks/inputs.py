@@ -0,0 +1,85 @@
+# inputs.py
+"""
+Benchmark inputs: the versioned corpus of realistic model outputs plus
+generated adversarial cases aimed at regex backtracking and quadratic paths
+"""
+
+import os, random
+
+CORPUS_VERSION = 'v1'
+corpus_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus', CORPUS_VERSION)
+
+def load_corpus() -> dict:
+    corpus = {}
+    for file_name in sorted(os.listdir(corpus_dir)):
+        if file_name.endswith('.md'):
+            with open(os.path.join(corpus_dir, file_name), 'r', encoding='utf-8') as f:
+                corpus[file_name[:-3]] = f.read()
+    return corpus
+
+def generated_table(rows:int, columns:int=6, seed:int=0) -> str:
+    rng = random.Random(seed)
+    words = ('alpha', 'beta', '**gamma**', '*delta*', 'epsilon', '`zeta`', 'eta', 'theta_2', 'x^2', '[link](https://example.com)')
+    lines = [
+        '| {} |'.format(' | '.join('Column {}'.format(i) for i in range(columns))),
+        '|{}|'.format('|'.join((':---', '---:', ':---:', '---')[i % 4] for i in range(columns)))
+    ]
+    for _ in range(rows):
+        lines.append('| {} |'.format(' | '.join(rng.choice(words) if rng.random() > 0.3 else str(rng.randint(0, 100000)) for _ in range(columns))))
+    return '\n'.join(lines) + '\n'
+
+def realistic_inputs() -> dict:
+    corpus = load_corpus()
+    inputs = dict(corpus)
+    everything = '\n\n'.join(corpus.values())
+    inputs['long_mixed_x25'] = '\n\n'.join([everything] * 25)
+    inputs['table_5000_rows'] = 'Here are the results:\n\n' + generated_table(5000) + '\nLet me know if you need more.'
+    return inputs
+
+def adversarial_inputs() -> dict:
+    return {
+        'unbalanced_dollars': '$a and ' * 20000,
+        'dollar_then_long_line': '$' + 'x' * 100000,
+        'many_dollar_pairs': 'costs $5 or $10 ' * 10000,
+        'open_display_math': '$$' + 'x + ' * 30000,
+        'open_bracket_math': '\\[' + 'y \\cdot ' * 20000,
+        'nested_fences': '```\n' * 5000,
+        'nested_language_fences': ''.join('````markdown\n```python\n' for _ in range(2000)),
+        'unclosed_fence_long': '```python\n' + 'print("hello")\n' * 20000,
+        'huge_table': generated_table(20000, columns=10, seed=1),
+        'table_without_separator': '| a | b |\n' * 20000,
+        'unbalanced_bold': '**a ' * 50000,
+        'unbalanced_italic': '*a ' * 50000,
+        'open_subscripts': '_(' * 50000,
+        'open_links': '[' * 20000 + '](' * 20000,
+        'open_image': '![' + 'x' * 50000,
+        'dashes': '-' * 100000,
+        'dash_lines': '---\n' * 20000,
+        'long_single_line': 'word ' * 100000,
+    }
+
+def url_inputs() -> dict:
+    return {
+        'youtube_watch': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+        'youtube_short': 'https://youtu.be/dQw4w9WgXcQ',
+        'website': 'https://github.com/Jeffser/Alpaca/blob/main/README.md',
+        'long_url': 'https://example.com/' + 'a/' * 50000,
+        'long_query': 'https://example.com/search?' + '&'.join('k{}=v'.format(i) for i in range(20000)),
+        'youtube_many_v': 'https://www.youtube.com/' + 'x?v=' * 20000,
+        'plain_text_paste': 'Lorem ipsum dolor sit amet ' * 10000,
+        'almost_url': 'http:' + '/' * 50000,
+        'percent_escapes': 'https://example.com/' + '%2' * 50000,
+    }
+
+def stream_tokens(text:str, seed:int=0) -> list:
+    """
+    Splits text into chunks shaped like streamed model tokens (1-8 characters)
+    """
+    rng = random.Random(seed)
+    tokens = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 8)
+        tokens.append(text[i:i+size])
+        i += size
+    return tokens
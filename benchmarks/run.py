@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# run.py
+"""
+Headless microbenchmarks for the message parser, the Pango markup converter,
+the streaming block splitter and the pasted URL regexes.
+
+Only needs PyGObject's GLib (no display), the modules are loaded straight from
+their files so no widget is ever imported.
+
+    python3 benchmarks/run.py [--filter NAME] [--budget SECONDS] [--json PATH]
+"""
+
+import argparse, importlib.util, json, os, signal, statistics, sys, time, gettext
+import inputs
+
+gettext.install('alpaca') # constants.py uses _() like the rest of the app
+
+source_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+def load_module(name:str, path:str):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(source_dir, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+parser = load_module('alpaca_parser', os.path.join('widgets', 'blocks', 'parser.py'))
+constants = load_module('alpaca_constants', 'constants.py')
+
+class CaseTimeout(Exception):
+    pass
+
+def on_alarm(signum, frame):
+    raise CaseTimeout()
+
+def url_check(text:str) -> None:
+    if not constants.YOUTUBE_URL_REGEX.match(text):
+        constants.URL_REGEX.match(text)
+
+def large_block_policy(text:str) -> None:
+    if parser.is_large_block(text):
+        parser.split_preview(text)
+
+def measure(function, argument, budget:float, max_runs:int=50) -> list:
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_runs and (len(timings) < 3 or time.perf_counter() - started < budget):
+        start = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - start)
+        if timings[-1] > budget:
+            break # too slow to repeat, one run is enough to show it
+    return timings
+
+def measure_stream(text:str, budget:float) -> tuple:
+    """
+    Mirrors GeneratingText.append_content / process_content and the
+    BlockContainer.add_content parse that follows a completed block.
+    Returns the total per run and the worst single token latency.
+    """
+    tokens = inputs.stream_tokens(text)
+    totals = []
+    worst_token = 0
+    started = time.perf_counter()
+    while len(totals) < 3 or time.perf_counter() - started < budget:
+        current_text = ''
+        total = 0
+        for token in tokens:
+            start = time.perf_counter()
+            current_text += token
+            if token.endswith('\n') and parser.is_generation_block_complete(current_text):
+                parser.parse_content(current_text)
+                current_text = ''
+            elapsed = time.perf_counter() - start
+            worst_token = max(worst_token, elapsed)
+            total += elapsed
+        totals.append(total)
+        if total > budget:
+            break
+    return totals, worst_token
+
+def format_row(columns:list, widths:list) -> str:
+    return '  '.join(str(c).ljust(w) if i < 2 else str(c).rjust(w) for i, (c, w) in enumerate(zip(columns, widths)))
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Alpaca parser and markup microbenchmarks')
+    argument_parser.add_argument('--filter', default='', help='only run cases whose function or input name contains this')
+    argument_parser.add_argument('--budget', type=float, default=0.5, help='seconds spent repeating each case')
+    argument_parser.add_argument('--timeout', type=int, default=10, help='seconds before a single case is reported as a timeout')
+    argument_parser.add_argument('--json', default=None, help='also write the results to this file')
+    args = argument_parser.parse_args()
+    signal.signal(signal.SIGALRM, on_alarm)
+
+    text_inputs = {**inputs.realistic_inputs(), **inputs.adversarial_inputs()}
+    table_inputs = {k: v for k, v in text_inputs.items() if 'table' in k}
+    cases = [
+        ('parse_content', parser.parse_content, text_inputs),
+        ('markdown_to_pango', parser.markdown_to_pango, text_inputs),
+        ('parse_markdown_table', parser.parse_markdown_table, table_inputs),
+        ('url_regexes', url_check, inputs.url_inputs()),
+        ('large_block_policy', large_block_policy, text_inputs),
+        ('stream', None, text_inputs)
+    ]
+
+    widths = [22, 28, 10, 12, 12, 12]
+    print('corpus {}'.format(inputs.CORPUS_VERSION))
+    print(format_row(['function', 'input', 'size', 'MB/s', 'median ms', 'worst ms'], widths), flush=True)
+    results = []
+    for function_name, function, case_inputs in cases:
+        for input_name, text in case_inputs.items():
+            if args.filter and args.filter not in function_name and args.filter not in input_name:
+                continue
+            signal.alarm(args.timeout)
+            try:
+                if function_name == 'stream':
+                    timings, worst = measure_stream(text, args.budget)
+                else:
+                    timings = measure(function, text, args.budget)
+                    worst = max(timings)
+            except CaseTimeout:
+                # Most likely catastrophic backtracking or a quadratic path
+                results.append({
+                    'function': function_name,
+                    'input': input_name,
+                    'size': len(text),
+                    'timeout_s': args.timeout
+                })
+                print(format_row([function_name, input_name, len(text), '-', '-', 'TIMEOUT >{}s'.format(args.timeout)], widths), flush=True)
+                continue
+            finally:
+                signal.alarm(0)
+            median = statistics.median(timings)
+            result = {
+                'function': function_name,
+                'input': input_name,
+                'size': len(text),
+                'runs': len(timings),
+                'throughput_mb_s': len(text.encode('utf-8')) / median / 1e6 if median else float('inf'),
+                'median_ms': median * 1000,
+                'worst_ms': worst * 1000
+            }
+            results.append(result)
+            print(format_row([
+                function_name,
+                input_name,
+                result['size'],
+                '{:.2f}'.format(result['throughput_mb_s']),
+                '{:.3f}'.format(result['median_ms']),
+                '{:.3f}'.format(result['worst_ms'])
+            ], widths), flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'corpus': inputs.CORPUS_VERSION, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,7 +3,7 @@
 Holds a few constant values that can be re-used all over the application.
 """
 
-import os, shutil, platform
+import os, shutil, platform, re
 
 # Big thanks to everyone contributing translations.
 # These translators will be shown inside of the app under
@@ -394,6 +394,23 @@ TITLE_GENERATION_PROMPT_OPENAI = (
     "message from a user. If you want to, you can add a single emoji."
 )
 MAX_TOKENS_TITLE_GENERATION = 31
+SUMMARY_GENERATION_PROMPT = (
+    "You keep the memory of a long conversation. Update the summary with the new messages, "
+    "keep names, facts, decisions, preferences and open questions, drop small talk. "
+    "Answer only with the updated summary as short paragraphs or bullet points."
+)
+
+# Used to detect links pasted in the message entry
+YOUTUBE_URL_REGEX = re.compile(
+    r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/'
+    r'(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})')
+URL_REGEX = re.compile(
+    r'http[s]?://'
+    r'(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|'
+    r'(?:%[0-9a-fA-F][0-9a-fA-F]))+'
+    r'(?:\\:[0-9]{1,5})?'
+    r'(?:/[^\\s]*)?'
+)
 
 LEGAL_NOTICE = """Alpaca is an independent client interface designed to connect to various third-party AI services.
 All underlying AI models and instances are the intellectual property of their respective providers.
@@ -12,8 +12,6 @@ from .sql_manager import generate_uuid, Instance as SQL
 
 from datetime import datetime
 
-import threading
-
 @Gtk.Template(resource_path='/com/jeffser/Alpaca/quick_ask.ui')
 class QuickAskWindow(Adw.ApplicationWindow):
 
@@ -100,9 +98,9 @@ class QuickAskWindow(Adw.ApplicationWindow):
             self.chat.add_message(m_element_bot)
             self.chat.busy=True
             if len(available_tools) > 0:
-                GLib.idle_add(threading.Thread(target=self.get_current_instance().use_tools, args=(m_element_bot, current_model, available_tools), daemon=True).start)
+                GLib.idle_add(self.get_current_instance().use_tools, m_element_bot, current_model, available_tools)
             else:
-                GLib.idle_add(threading.Thread(target=self.get_current_instance().generate_message, args=(m_element_bot, current_model), daemon=True).start)
+                GLib.idle_add(self.get_current_instance().generate_message, m_element_bot, current_model)
 
     def write_and_send_message(self, message:str):
         buffer = self.global_footer.get_buffer()
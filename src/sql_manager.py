@@ -13,11 +13,21 @@ import os
 import shutil
 import json
 import sys
+import time
 
 from . import widgets as Widgets
 from .constants import data_dir
 from gi.repository import Gio, GLib
 
+BLOCK_CACHE_LIMIT = 50000
+TELEMETRY_LIMIT = 10000 # Requests kept, older ones are removed
+RESPONSE_CACHE_LIMIT = 32 * 1024 * 1024 # Bytes of cached responses, least recently used ones are removed
+TELEMETRY_COLUMNS = (
+    'instance_id', 'instance_type', 'model', 'kind', 'state', 'started_at', 'queue_wait',
+    'ttft', 'itl_p50', 'itl_p90', 'itl_p99', 'tokens_per_second', 'total_duration',
+    'load_duration', 'prompt_eval_duration', 'prompt_tokens', 'completion_tokens', 'details'
+)
+
 def format_datetime(dt:datetime.datetime) -> str:
     date = GLib.DateTime.new(
         GLib.DateTime.new_now_local().get_timezone(),
@@ -69,6 +79,10 @@ def dict_to_metadata_string(data:dict) -> str:
         metadata_parameters[_('Prompt Eval Duration')] = nanoseconds_to_timestamp(data.get('prompt_eval_duration'))
         prompt_eval_rate = data.get('prompt_eval_count') / (data.get('prompt_eval_duration') / (10**9))
         metadata_parameters[_('Prompt Eval Rate')] = _('{} tokens/s').format(round(prompt_eval_rate, 2))
+    if data.get('shared_prefix'):
+        metadata_parameters[_('Reused Prompt Prefix')] = '{}%'.format(round(data.get('shared_prefix') * 100))
+    if data.get('prompt_eval_saved'):
+        metadata_parameters[_('Prompt Eval Saved')] = '~{}'.format(nanoseconds_to_timestamp(data.get('prompt_eval_saved')))
     if data.get('eval_count') and data.get('eval_duration'):
         metadata_parameters[_('Eval Count')] = _('{} tokens').format(data.get('eval_count'))
         metadata_parameters[_('Eval Duration')] = nanoseconds_to_timestamp(data.get('eval_duration'))
@@ -210,12 +224,61 @@ class Instance:
                     "name": "TEXT NOT NULL",
                     "color": "TEXT",
                     "parent": "TEXT"
+                },
+                "block_cache": {
+                    "id": "TEXT NOT NULL PRIMARY KEY", # Hash of the message content
+                    "blocks": "TEXT NOT NULL" #JSON
+                },
+                "model_metadata": {
+                    "instance_id": "TEXT NOT NULL",
+                    "model": "TEXT NOT NULL",
+                    "digest": "TEXT NOT NULL",
+                    "data": "TEXT NOT NULL", #JSON
+                    "fetched_at": "REAL NOT NULL"
+                },
+                "telemetry": {
+                    "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+                    "instance_id": "TEXT NOT NULL",
+                    "instance_type": "TEXT NOT NULL",
+                    "model": "TEXT NOT NULL",
+                    "kind": "TEXT NOT NULL",
+                    "state": "TEXT NOT NULL",
+                    "started_at": "REAL NOT NULL",
+                    "queue_wait": "REAL",
+                    "ttft": "REAL",
+                    "itl_p50": "REAL",
+                    "itl_p90": "REAL",
+                    "itl_p99": "REAL",
+                    "tokens_per_second": "REAL",
+                    "total_duration": "REAL",
+                    "load_duration": "REAL",
+                    "prompt_eval_duration": "REAL",
+                    "prompt_tokens": "INTEGER",
+                    "completion_tokens": "INTEGER",
+                    "details": "TEXT" #JSON
+                },
+                "chat_summary": {
+                    "chat_id": "TEXT NOT NULL PRIMARY KEY",
+                    "last_message_id": "TEXT NOT NULL",
+                    "message_count": "INTEGER NOT NULL",
+                    "content": "TEXT NOT NULL",
+                    "updated_at": "REAL NOT NULL"
+                },
+                "response_cache": {
+                    "id": "TEXT NOT NULL PRIMARY KEY", # Hash of the request
+                    "instance_id": "TEXT NOT NULL",
+                    "response": "TEXT NOT NULL", #JSON
+                    "size": "INTEGER NOT NULL",
+                    "last_used": "REAL NOT NULL"
                 }
             }
 
             for table_name, columns in tables.items():
                 columns_def = ", ".join([f"{col_name} {col_def}" for col_name, col_def in columns.items()])
                 c.cursor.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({columns_def})")
+            c.cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS model_metadata_key ON model_metadata (instance_id, model)")
+            c.cursor.execute("CREATE INDEX IF NOT EXISTS telemetry_kind ON telemetry (kind, id)")
+            c.cursor.execute("CREATE INDEX IF NOT EXISTS response_cache_last_used ON response_cache (last_used)")
 
             c.cursor.execute("PRAGMA table_info(chat)")
             columns = [col[1] for col in c.cursor.fetchall()]
@@ -349,6 +412,20 @@ class Instance:
 
         return attachments
 
+    def get_chat_attachments(chat) -> dict:
+        """
+        Every attachment in the chat in a single query, grouped by message id
+        """
+        attachments = {}
+        with SQLiteConnection() as c:
+            for row in c.cursor.execute(
+                "SELECT a.message_id, a.id, a.type, a.name, a.content FROM attachment AS a JOIN message AS m ON a.message_id = m.id WHERE m.chat_id=?",
+                (chat.chat_id,),
+            ).fetchall():
+                attachments.setdefault(row[0], []).append(row[1:])
+
+        return attachments
+
     def export_db(chat, export_sql_path: str) -> None:
         with SQLiteConnection() as c:
             c.cursor.execute("ATTACH DATABASE ? AS export", (export_sql_path,))
@@ -406,6 +483,9 @@ class Instance:
             c.cursor.execute(
                 "DELETE FROM message WHERE chat_id=?", (chat.chat_id,)
             )
+            c.cursor.execute(
+                "DELETE FROM chat_summary WHERE chat_id=?", (chat.chat_id,)
+            )
 
     def factory_reset() -> None: # Deletes all chat folders and everything inside
         with SQLiteConnection() as c:
@@ -413,6 +493,7 @@ class Instance:
             c.cursor.execute("DELETE FROM chat")
             c.cursor.execute("DELETE FROM message")
             c.cursor.execute("DELETE FROM attachment")
+            c.cursor.execute("DELETE FROM chat_summary")
 
     def duplicate_chat(old_chat_id:str, new_chat) -> None:
         with SQLiteConnection() as c:
@@ -765,6 +846,15 @@ class Instance:
             c.cursor.execute(
                 "DELETE FROM instance WHERE id=?", (instance_id,)
             )
+            c.cursor.execute(
+                "DELETE FROM model_metadata WHERE instance_id=?", (instance_id,)
+            )
+            c.cursor.execute(
+                "DELETE FROM telemetry WHERE instance_id=?", (instance_id,)
+            )
+            c.cursor.execute(
+                "DELETE FROM response_cache WHERE instance_id=?", (instance_id,)
+            )
 
     ################################
     ## ONLINE INSTANCE MODEL LIST ##
@@ -817,6 +907,155 @@ class Instance:
                     (json.dumps(model_list), instance_id)
                 )
 
+    #################
+    ## BLOCK CACHE ##
+    #################
+
+    def get_block_cache(content_hashes:list) -> dict:
+        result = {}
+        with SQLiteConnection() as c:
+            for i in range(0, len(content_hashes), 500): # Stay under SQLite's variable limit
+                chunk = content_hashes[i:i+500]
+                rows = c.cursor.execute(
+                    "SELECT id, blocks FROM block_cache WHERE id IN ({})".format(', '.join('?' * len(chunk))),
+                    chunk
+                ).fetchall()
+                for row in rows:
+                    result[row[0]] = json.loads(row[1])
+        return result
+
+    def insert_block_cache(entries:dict) -> None:
+        if len(entries) == 0:
+            return
+        with SQLiteConnection() as c:
+            c.cursor.executemany(
+                "INSERT OR REPLACE INTO block_cache (id, blocks) VALUES (?, ?)",
+                [(content_hash, json.dumps(parsed)) for content_hash, parsed in entries.items()]
+            )
+            # Keep the cache bounded, INSERT OR REPLACE gives every stored entry the newest rowid
+            c.cursor.execute(
+                "DELETE FROM block_cache WHERE rowid <= (SELECT MAX(rowid) FROM block_cache) - ?",
+                (BLOCK_CACHE_LIMIT,)
+            )
+
+    ####################
+    ## MODEL METADATA ##
+    ####################
+
+    def get_model_metadata(instance_id:str, model_name:str) -> dict:
+        with SQLiteConnection() as c:
+            row = c.cursor.execute(
+                "SELECT digest, data, fetched_at FROM model_metadata WHERE instance_id=? AND model=?",
+                (instance_id, model_name)
+            ).fetchone()
+            if row:
+                return {
+                    'digest': row[0],
+                    'data': json.loads(row[1]),
+                    'fetched_at': row[2]
+                }
+
+    def insert_or_update_model_metadata(instance_id:str, model_name:str, entry:dict) -> None:
+        # Only the newest digest of a model is kept
+        with SQLiteConnection() as c:
+            c.cursor.execute(
+                "INSERT OR REPLACE INTO model_metadata (instance_id, model, digest, data, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (instance_id, model_name, entry.get('digest') or '', json.dumps(entry.get('data')), entry.get('fetched_at'))
+            )
+
+    def remove_model_metadata(instance_id:str, model_name:str=None) -> None:
+        with SQLiteConnection() as c:
+            if model_name:
+                c.cursor.execute("DELETE FROM model_metadata WHERE instance_id=? AND model=?", (instance_id, model_name))
+            else:
+                c.cursor.execute("DELETE FROM model_metadata WHERE instance_id=?", (instance_id,))
+
+    ###############
+    ## TELEMETRY ##
+    ###############
+
+    def insert_telemetry(metrics:dict) -> None:
+        values = [metrics.get(col) for col in TELEMETRY_COLUMNS[:-1]] + [json.dumps(metrics.get('details') or {})]
+        with SQLiteConnection() as c:
+            c.cursor.execute(
+                "INSERT INTO telemetry ({}) VALUES ({})".format(', '.join(TELEMETRY_COLUMNS), ', '.join('?' * len(values))),
+                values
+            )
+            c.cursor.execute("DELETE FROM telemetry WHERE id <= (SELECT MAX(id) FROM telemetry) - ?", (TELEMETRY_LIMIT,))
+
+    def get_telemetry(kind:str=None, limit:int=1000) -> list:
+        # Newest first
+        with SQLiteConnection() as c:
+            if kind:
+                rows = c.cursor.execute(
+                    "SELECT {} FROM telemetry WHERE kind=? ORDER BY id DESC LIMIT ?".format(', '.join(TELEMETRY_COLUMNS)),
+                    (kind, limit)
+                ).fetchall()
+            else:
+                rows = c.cursor.execute(
+                    "SELECT {} FROM telemetry ORDER BY id DESC LIMIT ?".format(', '.join(TELEMETRY_COLUMNS)),
+                    (limit,)
+                ).fetchall()
+        result = []
+        for row in rows:
+            entry = dict(zip(TELEMETRY_COLUMNS, row))
+            entry['details'] = json.loads(entry.get('details') or '{}')
+            result.append(entry)
+        return result
+
+    ####################
+    ## RESPONSE CACHE ##
+    ####################
+
+    def get_response_cache(key:str) -> dict:
+        with SQLiteConnection() as c:
+            row = c.cursor.execute("SELECT response FROM response_cache WHERE id=?", (key,)).fetchone()
+            if row:
+                c.cursor.execute("UPDATE response_cache SET last_used=? WHERE id=?", (time.time(), key))
+                return json.loads(row[0])
+
+    def insert_response_cache(key:str, instance_id:str, response:dict) -> None:
+        data = json.dumps(response)
+        with SQLiteConnection() as c:
+            c.cursor.execute(
+                "INSERT OR REPLACE INTO response_cache (id, instance_id, response, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, instance_id, data, len(data), time.time())
+            )
+            # Least recently used entries past the limit are removed
+            c.cursor.execute(
+                "DELETE FROM response_cache WHERE id IN (SELECT id FROM (SELECT id, SUM(size) OVER (ORDER BY last_used DESC) AS total FROM response_cache) WHERE total > ?)",
+                (RESPONSE_CACHE_LIMIT,)
+            )
+
+    ##################
+    ## CHAT SUMMARY ##
+    ##################
+
+    def get_chat_summary(chat_id:str) -> dict:
+        with SQLiteConnection() as c:
+            row = c.cursor.execute(
+                "SELECT last_message_id, message_count, content, updated_at FROM chat_summary WHERE chat_id=?",
+                (chat_id,)
+            ).fetchone()
+            if row:
+                return {
+                    'last_message_id': row[0],
+                    'message_count': row[1],
+                    'content': row[2],
+                    'updated_at': row[3]
+                }
+
+    def insert_or_update_chat_summary(chat_id:str, summary:dict) -> None:
+        with SQLiteConnection() as c:
+            c.cursor.execute(
+                "INSERT OR REPLACE INTO chat_summary (chat_id, last_message_id, message_count, content, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, summary.get('last_message_id'), summary.get('message_count'), summary.get('content'), summary.get('updated_at'))
+            )
+
+    def remove_chat_summary(chat_id:str) -> None:
+        with SQLiteConnection() as c:
+            c.cursor.execute("DELETE FROM chat_summary WHERE chat_id=?", (chat_id,))
+
     ##################
     ## CHAT FOLDERS ##
     ##################
@@ -217,15 +217,15 @@ class LiveChat(Adw.Bin):
             chat.busy = True
             current_instance = self.get_current_instance()
             if len(available_tools) > 0:
-                GLib.idle_add(threading.Thread(target=current_instance.use_tools, args=(m_element_bot, current_model, available_tools), daemon=True).start)
+                GLib.idle_add(current_instance.use_tools, m_element_bot, current_model, available_tools)
             else:
-                GLib.idle_add(threading.Thread(target=current_instance.generate_message, args=(m_element_bot, current_model), daemon=True).start)
+                GLib.idle_add(current_instance.generate_message, m_element_bot, current_model)
 
     def get_current_instance(self):
         return self.get_root().get_application().get_main_window().get_current_instance()
 
     def on_close(self):
-        self.chat.busy = False
+        self.chat.cancel_generation()
 
     def on_reload(self):
         pass
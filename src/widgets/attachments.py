@@ -12,12 +12,12 @@ from PIL import Image
 from PIL.PngImagePlugin import PngInfo
 from ..constants import cache_dir
 import numpy as np
-import requests, json, base64, tempfile, shutil, logging, threading, os, re, cairo
+import requests, json, base64, tempfile, shutil, logging, threading, os, re, cairo, concurrent.futures
 
 from urllib.robotparser import RobotFileParser
 from urllib.parse import urlparse
 
-from . import blocks, dialog, voice, activities
+from . import blocks, dialog, voice, activities, image_cache
 from ..sql_manager import Instance as SQL
 
 logger = logging.getLogger(__name__)
@@ -77,18 +77,47 @@ def extract_content(file_type:str, file_path:str) -> str:
         else:
             return "Fetching this URL is disallowed by robots.txt"
 
-def extract_online_image(image_url: str, max_size: int) -> str | None:
-    image_response = requests.get(url=image_url, headers={"User-Agent": "AlpacaBot"})
-    image_response.raise_for_status()
-    if image_response.status_code == 200:
-        image_data = None
-        image_path = os.path.join(cache_dir, 'image_web.jpg')
-        with open(image_path, 'wb') as handler:
-            handler.write(image_response.content)
-        image_data = extract_image(image_path, max_size)
-        #if os.path.isfile(image_path):
-            #os.remove(image_path)
-        return image_data
+image_cache_dir = os.path.join(cache_dir, 'images')
+image_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='image-load')
+# So the same URL is only downloaded once, and each size only resized once, at a time
+pending_downloads = {} # url -> Future
+pending_images = {} # (url, max_size) -> Future
+pending_images_lock = threading.Lock()
+
+def fetch_online_image(image_url:str) -> concurrent.futures.Future:
+    """
+    Downloads the image into the disk cache in the background, the future resolves to its path
+    """
+    with pending_images_lock:
+        future = pending_downloads.get(image_url)
+        if not future:
+            future = image_pool.submit(image_cache.download_online_image, image_url, image_cache_dir)
+            pending_downloads[image_url] = future
+            future.add_done_callback(lambda f: pending_downloads.pop(image_url, None))
+    return future
+
+def load_online_image(image_url:str, max_size:int) -> concurrent.futures.Future:
+    """
+    Fetches and resizes an image in the background, the future resolves to base64 PNG
+    """
+    key = (image_url, max_size)
+    with pending_images_lock:
+        future = pending_images.get(key)
+        if future:
+            return future
+        future = concurrent.futures.Future()
+        pending_images[key] = future
+    future.add_done_callback(lambda f: pending_images.pop(key, None))
+
+    def resize(download):
+        try:
+            future.set_result(extract_image(download.result(), max_size))
+        except Exception as e:
+            future.set_exception(e)
+
+    # Resized on a new task so no worker sits blocked waiting for a download
+    fetch_online_image(image_url).add_done_callback(lambda download: image_pool.submit(resize, download))
+    return future
 
 def extract_image(image_path:str, max_size:int) -> str:
     #Normal Image: 640, Profile Pictures: 128
@@ -1,9 +1,9 @@
 # __init__.py
 
-import re
-
+from .parser import PARSER_VERSION, get_content_hash, parse_content, is_large_block
 from .latex import LatexRenderer
 from .text import Text, GeneratingText, EditingText
+from .large_text import LargeText
 from .table import Table
 from .code import Code
 from .separator import Separator
@@ -13,85 +13,47 @@ from .inline_picture import InlinePicture
 from .. import attachments
 from ...sql_manager import generate_uuid, Instance as SQL
 
-patterns = [
-    r'(?P<online_picture>!\[(?P<label>[^\]]*)\]\((?P<url>.*?)\))',
-    r'(?P<code>```(?P<language>[a-zA-Z0-9_+\-]*)\n(?P<code_content>.*?)\n\s*```)',
-    r'(?P<latex>\\\[\s*(?P<latex_content1>.*?)\s*\\\]|\$\$\s*(?P<latex_content2>.*?)\s*\$\$|(?<!\$)\$(?P<latex_content3>[^\s$](?:[^$\n]*[^\s$])?)\$(?!\$))',
-    r'(?P<table>(?:^|(?<=\n))\|[^\n]*\|[\s\xa0]*\n\|[\s\xa0\-|:]*\|[\s\xa0]*\n(?:\|[^\n]*\|(?:[\s\xa0]*\n|$))+)',
-    r'(?P<line>^\s*-{3,}\s*$|\n-{3,}\n)'
-]
-master_regex = re.compile('|'.join(patterns), re.DOTALL | re.MULTILINE)
-
-
-def text_to_block_list(raw_content:str):
+def parsed_to_block_list(raw_content:str, parsed:list) -> list:
     blocks = []
-    last_idx = 0
 
-    for match in master_regex.finditer(raw_content):
-        if match.start() > last_idx:
-            content = raw_content[last_idx:match.start()]
-            if content:
-                if len(blocks) > 0 and isinstance(blocks[-1], Text):
-                    blocks[-1].append_content(content)
-                else:
-                    blocks.append(
-                        Text(content=content)
-                    )
+    for block_type, start, end, language in parsed:
+        content = raw_content[start:end]
 
-        kind = match.lastgroup
-
-        if kind == 'online_picture':
-            url = match.group('url')
-            # label = match.group('label')
-            if url:
+        if block_type == 'text':
+            if is_large_block(content):
                 blocks.append(
-                    InlinePicture(url=url)
+                    LargeText(content=content)
                 )
-
-        elif kind == 'code':
-            content = match.group('code_content')
-            language = match.group('language')
-            if content:
-                if language.lower() == 'latex':
-                    blocks.append(
-                        LatexRenderer(content=content)
-                    )
-                else:
-                    blocks.append(
-                        Code(content=content, language=language)
-                    )
-
-        elif kind == 'latex':
-            rawcontent = match.group('latex_content1') or match.group('latex_content2') or match.group('latex_content3') or ""
-            content = rawcontent.strip()
-            if content:
-                if '\\' in content:
-                    blocks.append(LatexRenderer(content=content))
-                else:
-                    if len(blocks) > 0 and isinstance(blocks[-1], Text):
-                        blocks[-1].append_content(content)
-                    else:
-                        blocks.append(
-                           Text(content=content)
-                        )
-
-        elif kind == 'table':
-            content = match.group(0)
-            if content:
-                blocks.append(Table(content=content))
-        elif kind == 'line':
-            blocks.append(Separator())
-
-        last_idx = match.end()
-
-    if last_idx < len(raw_content):
-        content = raw_content[last_idx:]
-        if len(blocks) > 0 and isinstance(blocks[-1], Text):
-            blocks[-1].append_content(content)
-        else:
+            elif len(blocks) > 0 and isinstance(blocks[-1], Text) and not is_large_block(blocks[-1].get_content() + content):
+                blocks[-1].append_content(content)
+            else:
+                blocks.append(
+                    Text(content=content)
+                )
+        elif block_type == 'picture':
+            blocks.append(
+                InlinePicture(url=content)
+            )
+        elif block_type == 'code':
+            blocks.append(
+                Code(content=content, language=language)
+            )
+        elif block_type == 'latex':
+            blocks.append(
+                LatexRenderer(content=content)
+            )
+        elif block_type == 'table':
+            blocks.append(
+                Table(content=content)
+            )
+        elif block_type == 'line':
             blocks.append(
-                Text(content=content)
+                Separator()
             )
 
     return blocks
 
+def text_to_block_list(raw_content:str, parsed:list=None) -> list:
+    if parsed is None:
+        parsed = parse_content(raw_content)
+    return parsed_to_block_list(raw_content, parsed)
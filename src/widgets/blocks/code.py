@@ -7,13 +7,39 @@ from gi.repository import Adw, Gtk, Gdk, GtkSource, GLib
 from .. import dialog, activities, message
 from ...sql_manager import generate_uuid
 from ...constants import CODE_LANGUAGE_FALLBACK, CODE_LANGUAGE_PROPERTIES
-import re, unicodedata
+from .parser import is_large_block, split_preview
+from .large_text import ChunkedInserter, get_expand_label
+import re, unicodedata, weakref
+
+language_properties_by_alias = {}
+for properties in reversed(CODE_LANGUAGE_PROPERTIES): # reversed so the first match wins, like the old linear scan
+    for alias in properties.get('aliases', []):
+        language_properties_by_alias[alias] = properties
+language_properties_by_id = {properties.get('id'): properties for properties in reversed(CODE_LANGUAGE_PROPERTIES)}
 
 def get_language_property(language:str) -> dict:
-    for properties in CODE_LANGUAGE_PROPERTIES:
-        if language.lower() in properties.get('aliases', []):
-            return properties
-    return {}
+    return language_properties_by_alias.get(language.lower(), {})
+
+highlighted_blocks = weakref.WeakSet()
+style_listener_connected = False
+
+def get_style_scheme() -> GtkSource.StyleScheme:
+    scheme_name = 'Adwaita'
+    if Adw.StyleManager.get_default().get_dark():
+        scheme_name += '-dark'
+    return GtkSource.StyleSchemeManager.get_default().get_scheme(scheme_name)
+
+def on_dark_changed(style_manager, gparam):
+    scheme = get_style_scheme()
+    for block in list(highlighted_blocks):
+        block.buffer.set_style_scheme(scheme)
+
+def connect_style_listener():
+    # A single listener for every code block instead of one per block
+    global style_listener_connected
+    if not style_listener_connected:
+        Adw.StyleManager.get_default().connect('notify::dark', on_dark_changed)
+        style_listener_connected = True
 
 @Gtk.Template(resource_path='/com/jeffser/Alpaca/widgets/blocks/code.ui')
 class Code(Gtk.Box):
@@ -24,12 +50,17 @@ class Code(Gtk.Box):
     edit_button = Gtk.Template.Child()
     run_button = Gtk.Template.Child()
     buffer = Gtk.Template.Child()
+    scrolled_window = Gtk.Template.Child()
+    expand_button = Gtk.Template.Child()
 
     def __init__(self, content:str=None, language:str=None):
         super().__init__()
 
         self.raw_language = language
         self.code_language = None
+        self.search_text = ""
+        self.inserter = ChunkedInserter(self.buffer)
+        self.hidden_code = ""
         if content:
             self.set_content(content)
         if self.raw_language:
@@ -38,17 +69,20 @@ class Code(Gtk.Box):
         self.activity_runner = None
         self.activity_edit = None
 
-        Adw.StyleManager.get_default().connect(
-            'notify::dark',
-            lambda sm, gp: self.update_scheme()
-        )
-        self.update_scheme()
-
-    def update_scheme(self):
-        scheme_name = 'Adwaita'
-        if Adw.StyleManager.get_default().get_dark():
-            scheme_name += '-dark'
-        self.buffer.set_style_scheme(GtkSource.StyleSchemeManager.get_default().get_scheme(scheme_name))
+        # Highlighting is attached the first time the block is actually shown
+        self.highlighted = False
+        self.buffer.set_highlight_syntax(False)
+        self.connect('map', lambda *_: self.enable_highlighting())
+
+    def enable_highlighting(self):
+        if self.highlighted:
+            return
+        self.highlighted = True
+        connect_style_listener()
+        highlighted_blocks.add(self)
+        self.buffer.set_style_scheme(get_style_scheme())
+        self.buffer.set_language(self.code_language)
+        self.buffer.set_highlight_syntax(True)
 
     @Gtk.Template.Callback()
     def begin_edit(self, button=None) -> None:
@@ -63,14 +97,13 @@ class Code(Gtk.Box):
             self.activity_edit = activities.show_activity(ce, self.get_root())
 
     def save_edit(self, code:str) -> None:
-        self.buffer.set_text(code, len(code.encode('utf-8')))
+        self.set_content(code)
         GLib.idle_add(self.get_ancestor(message.Message).save)
 
     @Gtk.Template.Callback()
     def copy_code(self, button=None) -> None:
         clipboard = Gdk.Display().get_default().get_clipboard()
-        text = self.buffer.get_text(self.buffer.get_start_iter(), self.buffer.get_end_iter(), False)
-        clipboard.set(text)
+        clipboard.set(self.get_code())
         dialog.show_toast(_("Code copied to the clipboard"), self.get_root())
 
     @Gtk.Template.Callback()
@@ -86,10 +119,7 @@ class Code(Gtk.Box):
                 )
 
         language = self.get_language()
-        filename = 'script'
-        for d in CODE_LANGUAGE_PROPERTIES:
-            if d.get('id') == language.lower():
-                filename = d.get('filename')
+        filename = language_properties_by_id.get(language.lower(), {}).get('filename', 'script')
 
         file_dialog = Gtk.FileDialog(initial_name=filename)
         file_dialog.save(
@@ -122,7 +152,8 @@ class Code(Gtk.Box):
             cr.run()
 
     def get_code(self) -> str:
-        return self.buffer.get_text(self.buffer.get_start_iter(), self.buffer.get_end_iter(), False)
+        # Includes whatever is still queued or collapsed in large blocks
+        return self.buffer.get_text(self.buffer.get_start_iter(), self.buffer.get_end_iter(), False) + self.inserter.get_pending() + self.hidden_code
 
     def get_language(self) -> str:
         if self.code_language:
@@ -134,7 +165,8 @@ class Code(Gtk.Box):
     def set_language(self, value:str) -> None:
         self.code_language = GtkSource.LanguageManager.get_default().get_language(CODE_LANGUAGE_FALLBACK.get(value.lower(), value))
         self.language_label.set_label(self.get_language().title())
-        self.buffer.set_language(self.code_language)
+        if self.highlighted:
+            self.buffer.set_language(self.code_language)
         self.run_button.set_visible(get_language_property(self.get_language()))
 
     def get_content(self) -> str:
@@ -150,4 +182,28 @@ class Code(Gtk.Box):
         return '\n'.join(lines)
 
     def set_content(self, value:str) -> None:
-        self.buffer.set_text(value, len(value.encode('utf-8')))
+        self.inserter.clear()
+        self.search_text = value.lower()
+        if is_large_block(value):
+            # Starts collapsed to a preview inside its own scrollbar
+            self.buffer.set_text('', 0)
+            preview, self.hidden_code = split_preview(value)
+            self.inserter.insert(preview)
+            self.scrolled_window.set_vscrollbar_policy(Gtk.PolicyType.AUTOMATIC)
+            self.scrolled_window.set_max_content_height(600)
+            self.scrolled_window.set_propagate_natural_height(True)
+        else:
+            self.hidden_code = ""
+            self.buffer.set_text(value, len(value.encode('utf-8')))
+            # Back to the defaults in case it used to be a large block
+            self.scrolled_window.set_vscrollbar_policy(Gtk.PolicyType.NEVER)
+            self.scrolled_window.set_max_content_height(-1)
+            self.scrolled_window.set_propagate_natural_height(False)
+        self.expand_button.set_label(get_expand_label(self.hidden_code))
+        self.expand_button.set_visible(bool(self.hidden_code))
+
+    @Gtk.Template.Callback()
+    def expand(self, button=None) -> None:
+        self.expand_button.set_visible(False)
+        self.inserter.insert(self.hidden_code)
+        self.hidden_code = ""
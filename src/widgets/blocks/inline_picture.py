@@ -19,20 +19,32 @@ class InlinePicture(Gtk.ScrolledWindow):
         self.texture = None
         self.content = None
 
+        self.missing_image = self.button.get_child()
+        self.button.set_child(Adw.Spinner(
+            width_request=240,
+            height_request=240
+        ))
+        attachments.load_online_image(self.url, 480).add_done_callback(self.on_image_loaded)
+
+    def on_image_loaded(self, future):
+        # Decoded here, in the loader thread, so the texture is ready for the main thread
         try:
-            self.content = attachments.extract_online_image(
-                image_url=self.url,
-                max_size=480
-            )
-            image_data = base64.b64decode(self.content)
-            self.texture = Gdk.Texture.new_from_bytes(GLib.Bytes.new(image_data))
-            image = Gtk.Picture.new_for_paintable(self.texture)
-            image.set_size_request(int((self.texture.get_width() * 240) / self.texture.get_height()), 240)
-            self.button.set_tooltip_text(_("Image"))
-            self.button.set_child(image)
-            self.button.set_sensitive(True)
+            content = future.result()
+            texture = Gdk.Texture.new_from_bytes(GLib.Bytes.new(base64.b64decode(content)))
         except Exception as e:
-            logger.exception(e)
+            logger.error('Could not load image {}: {}'.format(self.url, e))
+            GLib.idle_add(self.button.set_child, self.missing_image)
+            return
+        GLib.idle_add(self.show_image, content, texture)
+
+    def show_image(self, content:str, texture:Gdk.Texture):
+        self.content = content
+        self.texture = texture
+        image = Gtk.Picture.new_for_paintable(self.texture)
+        image.set_size_request(int((self.texture.get_width() * 240) / self.texture.get_height()), 240)
+        self.button.set_tooltip_text(_("Image"))
+        self.button.set_child(image)
+        self.button.set_sensitive(True)
 
     def get_content(self) -> str:
         return '![]({})'.format(self.url)
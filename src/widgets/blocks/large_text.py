@@ -0,0 +1,99 @@
+# large_text.py
+"""
+Degraded rendering for blocks too large to lay out at once
+"""
+
+import gi
+from gi.repository import GLib, Gtk
+
+import unicodedata
+from .parser import split_preview
+
+LARGE_BLOCK_CHUNK = 16384 # Characters inserted into a buffer per idle cycle
+
+class ChunkedInserter:
+    """
+    Appends text to a Gtk.TextBuffer a chunk per idle cycle so huge blocks never stall the main loop
+    """
+
+    def __init__(self, buffer:Gtk.TextBuffer):
+        self.buffer = buffer
+        self.pending = []
+        self.source_id = None
+
+    def insert(self, text:str) -> None:
+        self.pending.extend(text[i:i+LARGE_BLOCK_CHUNK] for i in range(0, len(text), LARGE_BLOCK_CHUNK))
+        if self.pending and not self.source_id:
+            self.source_id = GLib.idle_add(self.insert_next)
+
+    def insert_next(self) -> bool:
+        chunk = self.pending.pop(0)
+        self.buffer.insert(self.buffer.get_end_iter(), chunk, -1)
+        if self.pending:
+            return True
+        self.source_id = None
+        return False
+
+    def get_pending(self) -> str:
+        return ''.join(self.pending)
+
+    def clear(self) -> None:
+        if self.source_id:
+            GLib.source_remove(self.source_id)
+            self.source_id = None
+        self.pending = []
+
+def get_expand_label(hidden_text:str) -> str:
+    return _("Show All ({} More Lines)").format(hidden_text.count('\n'))
+
+@Gtk.Template(resource_path='/com/jeffser/Alpaca/widgets/blocks/large_text.ui')
+class LargeText(Gtk.Box):
+    """
+    Plain text stand-in for a Text block past the size limits, it starts as a
+    preview and the rest is only inserted when the user asks for it
+    """
+    __gtype_name__ = 'AlpacaLargeText'
+
+    textview = Gtk.Template.Child()
+    buffer = Gtk.Template.Child()
+    expand_button = Gtk.Template.Child()
+
+    def __init__(self, content:str=None):
+        super().__init__()
+        self.textview.remove_css_class('view')
+        self.inserter = ChunkedInserter(self.buffer)
+        self.raw_text = ""
+        self.search_text = ""
+        self.hidden_text = ""
+        if content:
+            self.set_content(content)
+
+    def set_content(self, value:str) -> None:
+        self.inserter.clear()
+        self.buffer.set_text('', 0)
+        self.raw_text = value.strip()
+        self.search_text = self.raw_text.lower()
+        preview, self.hidden_text = split_preview(self.raw_text)
+        self.inserter.insert(preview)
+        self.expand_button.set_label(get_expand_label(self.hidden_text))
+        self.expand_button.set_visible(bool(self.hidden_text))
+
+    @Gtk.Template.Callback()
+    def expand(self, button=None) -> None:
+        self.expand_button.set_visible(False)
+        self.inserter.insert(self.hidden_text)
+        self.hidden_text = ""
+
+    def get_content(self) -> str:
+        return self.raw_text
+
+    def get_content_for_dictation(self) -> str:
+        if self.raw_text:
+            allowed_characters = ('\n', ',', '.', ':', ';', '+', '/', '-', '(', ')', '[', ']', '=', '<', '>', '’', '\'', '"', '¿', '?', '¡', '!')
+            cleaned_text = ''.join(c for c in self.raw_text if unicodedata.category(c).startswith(('L', 'N', 'Zs')) or c in allowed_characters)
+            lines = []
+            for line in cleaned_text.split('\n'):
+                if line and line.strip() not in allowed_characters:
+                    lines.append(line)
+            return '\n'.join(lines)
+        return ''
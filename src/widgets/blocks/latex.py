@@ -5,55 +5,142 @@ Representation of Latex equations
 
 import gi
 from gi.repository import Gtk, Gdk, Adw, GLib, Gio
-
-from matplotlib.backends.backend_gtk4agg import FigureCanvasGTK4Agg as FigureCanvas
-from matplotlib.figure import Figure
+import os, io, hashlib, logging, threading, concurrent.futures
+from collections import OrderedDict
+from ...constants import cache_dir
 from .. import dialog, activities
 
-class LatexCanvas(FigureCanvas):
+logger = logging.getLogger(__name__)
+
+render_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='latex-render')
+render_lock = threading.Lock()
+memory_cache = OrderedDict() # key -> png bytes, least recently used first
+memory_cache_lock = threading.Lock()
+MEMORY_CACHE_SIZE = 256
+disk_cache_dir = os.path.join(cache_dir, 'latex')
+
+def render_equation(text:str, fontsize:int, color:str, scale:int) -> bytes:
+    """
+    Renders the equation to PNG bytes, checking the memory and disk caches first.
+    Call in a different thread.
+    """
+    key = hashlib.sha256('{}:{}:{}:{}'.format(text, fontsize, color, scale).encode('utf-8')).hexdigest()
+    with memory_cache_lock:
+        if key in memory_cache:
+            memory_cache.move_to_end(key)
+            return memory_cache[key]
+
+    cache_path = os.path.join(disk_cache_dir, '{}.png'.format(key))
+    if os.path.isfile(cache_path):
+        with open(cache_path, 'rb') as f:
+            png = f.read()
+    else:
+        # Imported here so chats without equations never load matplotlib
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        def draw(content:str, size:int) -> bytes:
+            fig = Figure(dpi=100 * scale)
+            FigureCanvasAgg(fig)
+            fig.text(0, 0, content, fontsize=size, color=color)
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format='png', bbox_inches='tight', pad_inches=0.02, transparent=True)
+            return buffer.getvalue()
+
+        # Mathtext's parser isn't safe to share between threads
+        with render_lock:
+            try:
+                png = draw(text, fontsize)
+            except ValueError as e:
+                png = draw(str(e), 12)
+
+        try:
+            os.makedirs(disk_cache_dir, exist_ok=True)
+            with open(cache_path, 'wb') as f:
+                f.write(png)
+        except OSError as e:
+            logger.error(e)
+
+    with memory_cache_lock:
+        memory_cache[key] = png
+        while len(memory_cache) > MEMORY_CACHE_SIZE:
+            memory_cache.popitem(last=False)
+    return png
+
+class LatexCanvas(Gtk.Stack):
     __gtype_name__ = 'AlpacaLatexCanvas'
 
     def __init__(self, eq=""):
-        self.fig = Figure(dpi=100)
-        self.fig.patch.set_alpha(0)
-        ax = self.fig.add_subplot()
-        ax.axis('off')
-        self.text = ax.text(0.5, 0.5, "", fontsize=24, ha='center', va='center')
-        super().__init__(self.fig)
+        super().__init__(
+            transition_type=1,
+            halign=3,
+            valign=3
+        )
+        self.text = ""
+        self.rendered_scale = None
+        self.picture = Gtk.Picture(can_shrink=False)
+        self.error_label = Gtk.Label(wrap=True, selectable=True, css_classes=['dim-label', 'monospace'])
+        self.add_named(Adw.Spinner(height_request=32, width_request=32), 'loading')
+        self.add_named(self.picture, 'content')
+        self.add_named(self.error_label, 'error')
         self.set_css_classes(['latex_renderer'])
 
+        # The real scale factor is only known once the canvas is realized
+        self.connect('realize', lambda *_: self.render())
+        self.connect('notify::scale-factor', lambda *_: self.render())
+
         if eq:
-            GLib.idle_add(self.set_text, eq)
+            self.set_text(eq)
 
     def set_text(self, text:str):
+        self.text = text
+        self.rendered_scale = None
+        self.render()
+
+    def render(self):
+        if not self.text:
+            self.picture.set_paintable(None)
+            self.set_visible_child_name('content')
+            return
+        if not self.get_realized():
+            return
+        scale = self.get_scale_factor()
+        if scale == self.rendered_scale:
+            return
+        self.rendered_scale = scale
+        self.set_visible_child_name('loading')
+        text = self.text
+        future = render_pool.submit(render_equation, text, 24, 'black', scale)
+        future.add_done_callback(lambda f: GLib.idle_add(self.show_render, text, scale, f))
+
+    def show_render(self, text:str, scale:int, future):
+        if text != self.text or scale != self.rendered_scale:
+            return # a newer equation or scale is being rendered
         try:
-            self.text.set_text(text)
-            self.text.set_fontsize(24)
-            self.fig.canvas.draw()
-        except ValueError as e:
-            self.text.set_text(str(e))
-            self.text.set_fontsize(12)
-            self.fig.canvas.draw()
-
-        bbox = self.text.get_window_extent()
-        self.set_content_width(bbox.width)
-        self.set_content_height(bbox.height)
-        self.set_halign(3)
-        self.set_valign(3)
+            texture = Gdk.Texture.new_from_bytes(GLib.Bytes.new(future.result()))
+        except Exception as e:
+            logger.error(e)
+            self.error_label.set_label(text)
+            self.set_visible_child_name('error')
+            return
+        self.picture.set_paintable(texture)
+        self.picture.set_size_request(texture.get_width() / scale, texture.get_height() / scale)
+        self.set_visible_child_name('content')
 
     def get_text(self) -> str:
-        return self.text.get_text()
+        return self.text
 
     def download_requested(self):
+        def save_render(path:str, text:str):
+            with open(path, 'wb') as f:
+                f.write(render_equation(text, 24, 'black', 1))
+            Gio.AppInfo.launch_default_for_uri('file://{}'.format(path))
+            GLib.idle_add(dialog.show_toast, _("Equation exported successfully"), self.get_root())
+
         def on_download(file_dialog, result, user_data):
             try:
                 file = file_dialog.save_finish(result)
-                path = file.get_path()
-                text = self.get_text()
-                self.fig.savefig(path, bbox_inches="tight", pad_inches=0)
-                Gio.AppInfo.launch_default_for_uri('file://{}'.format(path))
-                dialog.show_toast(_("Equation exported successfully"), self.get_root())
-                GLib.idle_add(self.set_text, text)
+                render_pool.submit(save_render, file.get_path(), self.get_text())
             except GLib.Error as e:
                 logger.error(e)
 
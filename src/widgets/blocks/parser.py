@@ -0,0 +1,165 @@
+# parser.py
+"""
+Pure text processing used by the message blocks, kept free of widgets so it
+can be used (and benchmarked) without a display
+"""
+
+from gi.repository import GLib
+import re, hashlib
+
+patterns = [
+    r'(?P<online_picture>!\[(?P<label>[^\]]*)\]\((?P<url>.*?)\))',
+    r'(?P<code>```(?P<language>[a-zA-Z0-9_+\-]*)\n(?P<code_content>.*?)\n\s*```)',
+    r'(?P<latex>\\\[\s*(?P<latex_content1>.*?)\s*\\\]|\$\$\s*(?P<latex_content2>.*?)\s*\$\$|(?<!\$)\$(?P<latex_content3>[^\s$](?:[^$\n]*[^\s$])?)\$(?!\$))',
+    r'(?P<table>(?:^|(?<=\n))\|[^\n]*\|[\s\xa0]*\n\|[\s\xa0\-|:]*\|[\s\xa0]*\n(?:\|[^\n]*\|(?:[\s\xa0]*\n|$))+)',
+    r'(?P<line>^\s*-{3,}\s*$|\n-{3,}\n)'
+]
+master_regex = re.compile('|'.join(patterns), re.DOTALL | re.MULTILINE)
+
+# Bump whenever the patterns or parse_content change so old cached parses are ignored
+PARSER_VERSION = 1
+
+# Blocks past either limit are shown as a plain preview and filled in chunks
+LARGE_BLOCK_CHARACTERS = 30000
+LARGE_BLOCK_LINES = 800
+LARGE_BLOCK_PREVIEW_CHARACTERS = 6000
+LARGE_BLOCK_PREVIEW_LINES = 80
+
+
+def get_content_hash(raw_content:str) -> str:
+    return hashlib.sha256('{}:{}'.format(PARSER_VERSION, raw_content).encode('utf-8')).hexdigest()
+
+def strip_span(raw_content:str, start:int, end:int) -> tuple:
+    while start < end and raw_content[start].isspace():
+        start += 1
+    while end > start and raw_content[end-1].isspace():
+        end -= 1
+    return start, end
+
+def parse_content(raw_content:str) -> list:
+    """
+    Tokenizes the raw markdown without creating any widget, each entry is
+    [type, start, end, language] pointing to a span of raw_content so it
+    can be stored in the block cache and rebuilt later
+    """
+    parsed = []
+    last_idx = 0
+
+    for match in master_regex.finditer(raw_content):
+        if match.start() > last_idx:
+            parsed.append(['text', last_idx, match.start(), None])
+
+        kind = match.lastgroup
+
+        if kind == 'online_picture':
+            if match.group('url'):
+                parsed.append(['picture', *match.span('url'), None])
+
+        elif kind == 'code':
+            if match.group('code_content'):
+                language = match.group('language')
+                if language.lower() == 'latex':
+                    parsed.append(['latex', *strip_span(raw_content, *match.span('code_content')), None])
+                else:
+                    parsed.append(['code', *match.span('code_content'), language])
+
+        elif kind == 'latex':
+            group_name = next((g for g in ('latex_content1', 'latex_content2', 'latex_content3') if match.group(g)), None)
+            if group_name:
+                start, end = strip_span(raw_content, *match.span(group_name))
+                if start < end:
+                    parsed.append(['latex' if '\\' in raw_content[start:end] else 'text', start, end, None])
+
+        elif kind == 'table':
+            parsed.append(['table', *match.span(), None])
+
+        elif kind == 'line':
+            parsed.append(['line', *match.span(), None])
+
+        last_idx = match.end()
+
+    if last_idx < len(raw_content):
+        parsed.append(['text', last_idx, len(raw_content), None])
+
+    return parsed
+
+def markdown_to_pango(text:str) -> str:
+    """Converts Markdown text to a limited version of PangoMarkup"""
+    text = GLib.markup_escape_text(text)
+    text = text.replace("\n* ", "\n• ").replace("\n- ", "\n• ")
+    text = text.replace("<|begin_of_solution|>", "")
+    text = text.replace("<|end_of_solution|>", "")
+    text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', text, flags=re.MULTILINE)
+    text = re.sub(r'\*(.*?)\*', r'<i>\1</i>', text, flags=re.MULTILINE)
+    text = re.sub(r'^####\s+(.*)', r'<span size="medium" weight="bold">\1</span>', text, flags=re.MULTILINE)
+    text = re.sub(r'^###\s+(.*)', r'<span size="large">\1</span>', text, flags=re.MULTILINE)
+    text = re.sub(r'^##\s+(.*)', r'<span size="x-large">\1</span>', text, flags=re.MULTILINE)
+    text = re.sub(r'^#\s+(.*)', r'<span size="xx-large">\1</span>', text, flags=re.MULTILINE)
+    # The groups can't contain their own opening character so an unclosed
+    # "_(" or "[" fails at the next one instead of scanning the rest of the line
+    text = re.sub(r'_(\(([^()\n]*)\)|\d+)', r'<sub>\2\1</sub>', text, flags=re.MULTILINE)
+    text = re.sub(r'\^(\(([^()\n]*)\)|\d+)', r'<sup>\2\1</sup>', text, flags=re.MULTILINE)
+    text = re.sub(r'\[([^\[\]\n]*)\]\(([^()\n]*)\)', r'<a href="\2">\1</a>', text, flags=re.MULTILINE)
+    return text
+
+def is_large_block(content:str) -> bool:
+    return len(content) > LARGE_BLOCK_CHARACTERS or content.count('\n') > LARGE_BLOCK_LINES
+
+def split_preview(content:str) -> tuple:
+    """
+    Splits a large block into (preview, rest) at a line break, joining both gives the content back
+    """
+    end = -1
+    for _ in range(LARGE_BLOCK_PREVIEW_LINES):
+        end = content.find('\n', end + 1, LARGE_BLOCK_PREVIEW_CHARACTERS)
+        if end == -1:
+            break
+    if end == -1:
+        end = content.rfind('\n', 0, LARGE_BLOCK_PREVIEW_CHARACTERS)
+    if end <= 0:
+        end = min(len(content), LARGE_BLOCK_PREVIEW_CHARACTERS)
+    return content[:end], content[end:]
+
+def is_generation_block_complete(current_text:str) -> bool:
+    """
+    Checks if the text being generated can be turned into blocks without
+    splitting an unfinished think, code or table block
+    """
+    stripped_text = current_text.strip()
+    think_block_complete = not stripped_text.startswith('<think>') or stripped_text.endswith('</think>')
+    think_block_complete_v2 = not stripped_text.startswith('<|begin_of_thought|>') or stripped_text.endswith('<|end_of_thought|>')
+    code_block_complete = not stripped_text.startswith('```') or (stripped_text.endswith('```') and len(stripped_text) > 3)
+    table_block_complete = not stripped_text.startswith('|') or '|\n\n' in current_text
+    return think_block_complete and think_block_complete_v2 and code_block_complete and table_block_complete
+
+def parse_alignment(separator:str) -> float:
+    if ':' in separator:
+        if separator.startswith('-') and separator.endswith(':'):
+            return 1
+        elif separator.startswith(':') and separator.endswith('-'):
+            return 0
+        return 0.5
+    return 0 # Default alignment is start
+
+def parse_markdown_table(markdown_text:str) -> tuple:
+    """
+    Single pass parser for markdown tables, returns (headers, alignments, rows)
+    """
+    headers = []
+    alignments = []
+    rows = []
+    lines = markdown_text.strip().split('\n')
+
+    if len(lines[0]) > 2 and lines[0].startswith('|') and lines[0].endswith('|'):
+        headers = [header.strip() for header in lines[0][1:-1].replace("*", "").split('|') if header.strip()]
+
+    if len(lines) > 1:
+        separator_columns = lines[1].replace(" ", "").split('|')[1:-1]
+        if lines[1].startswith('|') and lines[1].endswith('|') and len(separator_columns) > 0 and all(sep and sep.strip(':-') == '' for sep in separator_columns):
+            alignments = [parse_alignment(sep) for sep in separator_columns]
+
+    for line in lines[2:]:
+        if len(line) > 2 and line.startswith('|') and line.endswith('|'):
+            rows.append(line.split('|')[1:-1])
+
+    return headers, alignments, rows
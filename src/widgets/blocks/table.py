@@ -5,12 +5,12 @@ Handles the table widget shown in messages
 
 import gi
 from gi.repository import Gtk, Adw, GObject, Gio
-from .text import markdown_to_pango
+from .parser import markdown_to_pango, parse_markdown_table
 
-import re
-import pandas as pd
 from .. import dialog
 
+LARGE_TABLE_ROWS = 50 # Tables longer than this scroll on their own so only visible rows are built
+
 class MarkdownTable:
     def __init__(self):
         self.headers = []
@@ -29,20 +29,19 @@ class Row(GObject.GObject):
     def __init__(self, _values:list):
         super().__init__()
 
-        self.values = []
-        self.raw_values = []
-
-        for value in _values:
-            self.values.append(markdown_to_pango(value))
-            self.raw_values.append(value)
+        self.values = {} # Markup is rendered when a cell is first bound
+        self.raw_values = _values
 
     def get_column_value(self, index):
+        if index not in self.values:
+            self.values[index] = markdown_to_pango(self.raw_values[index]) if index < len(self.raw_values) else ''
         return self.values[index]
 
 @Gtk.Template(resource_path='/com/jeffser/Alpaca/widgets/blocks/table.ui')
 class Table(Gtk.Box):
     __gtype_name__ = 'AlpacaTable'
 
+    scrolled_window = Gtk.Template.Child()
     main_stack = Gtk.Template.Child()
     error_label = Gtk.Template.Child()
     columnview = Gtk.Template.Child()
@@ -59,44 +58,8 @@ class Table(Gtk.Box):
         return str(self.table)
 
     def parse_markdown_table(self, markdown_text:str):
-        # Define regex patterns for matching the table components
-        header_pattern = r'^\|(.+?)\|$'
-        separator_pattern = r'^\|(\s*[:-]+:?\s*\|)+$'
-        row_pattern = r'^\|(.+?)\|$'
-
-        # Split the text into lines
-        lines = markdown_text.strip().split('\n')
-
-        # Extract headers
-        header_match = re.match(header_pattern, lines[0], re.MULTILINE)
-        if header_match:
-            headers = [header.strip() for header in header_match.group(1).replace("*", "").split('|') if header.strip()]
-            self.table.headers = headers
-
-        # Extract alignments
-        separator_match = re.match(separator_pattern, lines[1], re.MULTILINE)
-        if separator_match:
-            alignments = []
-            separator_columns = lines[1].replace(" ", "").split('|')[1:-1]
-            for sep in separator_columns:
-                if ':' in sep:
-                    if sep.startswith('-') and sep.endswith(':'):
-                        alignments.append(1)
-                    elif sep.startswith(':') and sep.endswith('-'):
-                        alignments.append(0)
-                    else:
-                        alignments.append(0.5)
-                else:
-                    alignments.append(0)  # Default alignment is start
-            self.table.alignments = alignments
-
-        # Extract rows
-        for line in lines[2:]:
-            row_match = re.match(row_pattern, line, re.MULTILINE)
-            if row_match:
-                rows = line.split('|')[1:-1]
-                row = Row(rows)
-                self.table.rows.append(row)
+        self.table.headers, self.table.alignments, rows = parse_markdown_table(markdown_text)
+        self.table.rows.splice(0, 0, [Row(row) for row in rows])
 
     def make_table(self):
 
@@ -120,11 +83,17 @@ class Table(Gtk.Box):
         selection = Gtk.NoSelection.new(model=self.table.rows)
         self.columnview.set_model(model=selection)
 
+        if len(self.table.rows) > LARGE_TABLE_ROWS:
+            self.scrolled_window.set_vscrollbar_policy(Gtk.PolicyType.AUTOMATIC)
+            self.scrolled_window.set_max_content_height(600)
+            self.scrolled_window.set_propagate_natural_height(True)
+
     def get_content(self) -> str:
         return self.markdown
 
     def set_content(self, value:str) -> None:
         self.markdown = value
+        self.search_text = value.lower()
         try:
             self.parse_markdown_table(self.markdown)
             self.make_table()
@@ -145,6 +114,7 @@ class Table(Gtk.Box):
                     for value in row.raw_values:
                         rows[-1].append(value.strip())
 
+                import pandas as pd # Only needed for exporting
                 df = pd.DataFrame(rows, columns=headers)
                 df.to_excel(file.get_path(), index=False)
                 dialog.show_toast(
@@ -8,23 +8,7 @@ from gi.repository import GLib, Gtk, Gdk
 
 import re, unicodedata
 from ..message import Message
-
-def markdown_to_pango(text:str) -> str:
-    """Converts Markdown text to a limited version of PangoMarkup"""
-    text = GLib.markup_escape_text(text)
-    text = text.replace("\n* ", "\n• ").replace("\n- ", "\n• ")
-    text = text.replace("<|begin_of_solution|>", "")
-    text = text.replace("<|end_of_solution|>", "")
-    text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', text, flags=re.MULTILINE)
-    text = re.sub(r'\*(.*?)\*', r'<i>\1</i>', text, flags=re.MULTILINE)
-    text = re.sub(r'^####\s+(.*)', r'<span size="medium" weight="bold">\1</span>', text, flags=re.MULTILINE)
-    text = re.sub(r'^###\s+(.*)', r'<span size="large">\1</span>', text, flags=re.MULTILINE)
-    text = re.sub(r'^##\s+(.*)', r'<span size="x-large">\1</span>', text, flags=re.MULTILINE)
-    text = re.sub(r'^#\s+(.*)', r'<span size="xx-large">\1</span>', text, flags=re.MULTILINE)
-    text = re.sub(r'_(\((.*?)\)|\d+)', r'<sub>\2\1</sub>', text, flags=re.MULTILINE)
-    text = re.sub(r'\^(\((.*?)\)|\d+)', r'<sup>\2\1</sup>', text, flags=re.MULTILINE)
-    text = re.sub(r'\[(.*?)\]\((.*?)\)', r'<a href="\2">\1</a>', text, flags=re.MULTILINE)
-    return text
+from .parser import markdown_to_pango, is_generation_block_complete
 
 @Gtk.Template(resource_path='/com/jeffser/Alpaca/widgets/blocks/generating_text.ui')
 class GeneratingText(Gtk.Overlay):
@@ -40,14 +24,9 @@ class GeneratingText(Gtk.Overlay):
             self.set_content(content)
 
     def process_content(self, value:str) -> None:
-        current_text = self.get_content()
         if value.endswith('\n'):
-            think_block_complete = not current_text.strip().startswith('<think>') or current_text.strip().endswith('</think>')
-            think_block_complete_v2 = not current_text.strip().startswith('<|begin_of_thought|>') or current_text.strip().endswith('<|end_of_thought|>')
-            code_block_complete = not current_text.strip().startswith('```') or (current_text.strip().endswith('```') and len(current_text.strip()) > 3)
-            table_block_complete = not current_text.strip().startswith('|') or '|\n\n' in current_text
-
-            if think_block_complete and think_block_complete_v2 and code_block_complete and table_block_complete:
+            current_text = self.get_content()
+            if is_generation_block_complete(current_text):
                 self.set_content()
                 self.get_parent().add_content(current_text)
 
@@ -132,6 +111,8 @@ class Text(Gtk.Label):
             css_classes=['body']
         )
         self.raw_text=""
+        self.search_text=""
+        self.highlighted_query=None
         if content:
             self.set_content(content)
 
@@ -139,6 +120,23 @@ class Text(Gtk.Label):
         self.raw_text += value
         self.set_content(self.raw_text)
 
+    def set_highlight(self, query:str) -> bool:
+        """
+        Highlights the query in the block, returns whether it matched.
+        The markup is only rebuilt when the highlight changes.
+        """
+        matched = bool(query) and query.lower() in self.search_text
+        highlighted_query = query if matched else None
+        if highlighted_query != self.highlighted_query:
+            self.highlighted_query = highlighted_query
+            if highlighted_query:
+                query_escaped = re.escape(GLib.markup_escape_text(highlighted_query))
+                block_content = GLib.markup_escape_text(self.raw_text)
+                self.set_markup(re.sub(f"({query_escaped})", r"<span background='yellow' bgalpha='30%'>\1</span>", block_content, flags=re.IGNORECASE))
+            else:
+                self.set_markup(markdown_to_pango(self.raw_text))
+        return matched
+
     def get_content(self) -> str:
         return self.raw_text
 
@@ -155,5 +153,7 @@ class Text(Gtk.Label):
 
     def set_content(self, value:str) -> None:
         self.raw_text = value.strip()
+        self.search_text = self.raw_text.lower()
+        self.highlighted_query = None
         self.set_markup(markdown_to_pango(self.raw_text))
 
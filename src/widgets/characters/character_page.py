@@ -6,6 +6,7 @@ from ..message import ScrollableTextView
 from .. import dialog
 from ...constants import EMPTY_CHARA_CARD
 from ...sql_manager import Instance as SQL
+from ..instances import lore
 
 @Gtk.Template(resource_path='/com/jeffser/Alpaca/widgets/characters/greeting_row.ui')
 class CharacterGreetingRow(Adw.ExpanderRow):
@@ -192,6 +193,7 @@ class CharacterPage(Adw.NavigationPage):
         model_dialog = self.get_ancestor(Adw.Dialog)
         model_id = model_dialog.model.get_name()
         SQL.insert_or_update_model_character(model_id, self.character_dict)
+        lore.invalidate(model_id)
 
         navigation_view = self.get_ancestor(Adw.NavigationView)
         navigation_view.pop_to_tag('model')
@@ -6,6 +6,7 @@ from PIL.PngImagePlugin import PngInfo
 import getpass, time, json, io, base64
 from .. import dialog
 from ...sql_manager import Instance as SQL
+from ..instances import lore
 
 @Gtk.Template(resource_path='/com/jeffser/Alpaca/widgets/characters/export_page.ui')
 class CharacterExportPage(Adw.NavigationPage):
@@ -76,6 +77,7 @@ class CharacterExportPage(Adw.NavigationPage):
         character_dict['data']['modification_date'] = int(time.time() * 1000)
 
         SQL.insert_or_update_model_character(model_id, character_dict)
+        lore.invalidate(model_id)
 
         file_dialog = Gtk.FileDialog(
             initial_name='{}.png'.format(_("Character Card"))
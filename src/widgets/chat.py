@@ -5,7 +5,7 @@ Handles the chat widget
 
 import gi
 from gi.repository import Gtk, Gio, Adw, Gdk, GLib
-import logging, os, datetime, random, json, threading, re, importlib.util
+import logging, os, datetime, random, json, threading, re, importlib.util, concurrent.futures
 from ..constants import SAMPLE_PROMPTS, cache_dir
 from ..sql_manager import generate_uuid, prettify_model_name, generate_numbered_name, Instance as SQL
 from . import dialog, voice, models, blocks
@@ -13,6 +13,80 @@ from .message import Message
 
 logger = logging.getLogger(__name__)
 
+# Bounded so opening a long chat doesn't spawn a thread per message
+message_load_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='message-load')
+
+MESSAGE_WINDOW = 50 # Newest messages kept as widgets
+MESSAGE_PAGE = 20 # Older messages materialized when scrolling to the top
+
+loaded_chats = [] # Chats with built messages, most recently viewed last
+
+def when_futures_done(futures:list, callback:callable) -> None:
+    """
+    Calls the callback once every future is done, from the worker that finished last
+    """
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(future):
+        with lock:
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        if finished:
+            callback()
+
+    if len(futures) == 0:
+        callback()
+    for future in futures:
+        future.add_done_callback(on_done)
+
+def mark_chat_viewed(chat, limit:int) -> None:
+    """
+    Moves the chat to the end of the LRU and unloads the least recently viewed chats over the limit
+    """
+    if chat in loaded_chats:
+        loaded_chats.remove(chat)
+    loaded_chats.append(chat)
+
+    for old_chat in loaded_chats[:-max(1, limit)]:
+        if not old_chat.busy:
+            old_chat.unload_messages()
+            loaded_chats.remove(old_chat)
+
+def forget_chat(chat) -> None:
+    # For chats that were deleted or whose row was rebuilt
+    if chat in loaded_chats:
+        loaded_chats.remove(chat)
+
+class MessageRecord:
+    """
+    Lightweight stand-in for a message that isn't currently built as a widget
+    """
+
+    def __init__(self, message_id:str, mode:int, author:str, dt:datetime.datetime, content:str, attachments:list=None):
+        self.message_id = message_id
+        self.mode = mode
+        self.author = author
+        self.dt = dt
+        self.content = content
+        self.attachments = attachments or []
+        self.search_text = None
+
+    def get_content(self) -> str:
+        return self.content
+
+    def get_search_text(self) -> str:
+        if self.search_text is None:
+            self.search_text = self.content.lower()
+        return self.search_text
+
+    def get_model(self) -> str or None:
+        if self.mode == 1:
+            return self.author
+
+    def get_attachments(self) -> list:
+        return self.attachments
+
 
 @Gtk.Template(resource_path='/com/jeffser/Alpaca/widgets/chat/folder.ui')
 class Folder(Adw.NavigationPage):
@@ -83,8 +157,7 @@ class Folder(Adw.NavigationPage):
 
     def on_drop_chat(self, target, row, x, y):
         folder_page = self.get_root().chat_list_navigationview.get_previous_page(self)
-        row.chat.folder_id = folder_page.folder_id
-        SQL.insert_or_update_chat(row.chat)
+        row.move_to_folder(folder_page.folder_id)
         row.get_parent().remove(row)
         folder_page.chat_list_box.prepend(row)
         row.set_visible(True)
@@ -145,7 +218,9 @@ class Folder(Adw.NavigationPage):
             message_match = False
 
             if include_messages:
-                messages_str = '\n'.join([m.get('content') for m in row.chat.convert_to_ollama()]) or '\n'.join([m[4] for m in SQL.get_messages(row.chat)])
+                if row.loaded_chat:
+                    messages_str = '\n'.join([m.get_content() for m in row.loaded_chat.get_messages()])
+                messages_str = messages_str or '\n'.join([m[4] for m in SQL.get_messages(row)])
                 message_match = re.search(query, messages_str, re.IGNORECASE)
 
             row.set_visible(title_match or message_match)
@@ -161,6 +236,9 @@ class Folder(Adw.NavigationPage):
         self.update_visibility(True)
 
     def update(self):
+        for row in list(self.chat_list_box):
+            if row.loaded_chat:
+                forget_chat(row.loaded_chat)
         self.chat_list_box.remove_all()
         self.folder_list_box.remove_all()
         selected_chat = self.get_root().settings.get_value('default-chat').unpack()
@@ -193,37 +271,37 @@ class Folder(Adw.NavigationPage):
         self.update_visibility()
 
     def add_chat(self, chat_name:str, chat_id:str, is_template:bool, mode:int): #mode = 0: append, mode = 1: prepend
+        # Only the row is built here, the Chat itself is built the first time row.chat is used
         chat_name = chat_name.strip()
         if chat_name and mode in (0, 1):
             chat_name = generate_numbered_name(chat_name, [row.get_name() for row in list(self.chat_list_box)])
-            chat = Chat(
+            row = ChatRow(
                 chat_id=chat_id,
                 name=chat_name,
                 folder_id=self.folder_id,
                 is_template=is_template
             )
 
-            if chat:
-                if mode == 0:
-                    self.chat_list_box.append(chat.row)
-                else:
-                    self.chat_list_box.prepend(chat.row)
-                self.update_visibility()
-                return chat
+            if mode == 0:
+                self.chat_list_box.append(row)
+            else:
+                self.chat_list_box.prepend(row)
+            self.update_visibility()
+            return row
 
     def new_chat(self, chat_name:str=_('New Chat')):
         if not chat_name.strip():
             chat_name = _('New Chat')
-        chat = self.add_chat(
+        row = self.add_chat(
             chat_name=chat_name,
             chat_id=generate_uuid(),
             is_template=False,
             mode=1
         )
-        self.chat_list_box.select_row(chat.row)
-        if chat:
-            SQL.insert_or_update_chat(chat)
-            return chat
+        if row:
+            self.chat_list_box.select_row(row)
+            SQL.insert_or_update_chat(row)
+            return row.chat
 
     def new_folder(self, name:str, color:str):
         name = generate_numbered_name(name, [row.get_name() for row in list(self.folder_list_box)])
@@ -288,7 +366,7 @@ class Folder(Adw.NavigationPage):
         if listbox.get_root().chat_bin.get_child():
             last_chat_id = listbox.get_root().chat_bin.get_child().chat_id
 
-        if row and row.chat.chat_id != last_chat_id:
+        if row and row.chat_id != last_chat_id:
             if listbox.get_root().chat_bin.get_child():
                 list_box = listbox.get_root().chat_bin.get_child().row.get_parent()
                 if list_box and list_box != self.chat_list_box:
@@ -305,10 +383,12 @@ class Folder(Adw.NavigationPage):
 
             if len(list(new_chat.container)) == 0:
                 new_chat.load_messages()
+            mark_chat_viewed(new_chat, self.get_root().settings.get_value('max-loaded-chats').unpack())
 
             # Show New Stack Page
             root = self.get_root()
             root.chat_bin.set_child(new_chat)
+            root.global_footer.set_context_usage(new_chat.context_usage)
             chat_search_query = root.searchentry_messages.get_text()
             if chat_search_query:
                 GLib.idle_add(new_chat.on_search, chat_search_query)
@@ -468,15 +548,27 @@ class Chat(Gtk.Stack):
     use_template_button = Gtk.Template.Child()
     use_character_button = Gtk.Template.Child()
 
-    def __init__(self, chat_id:str=None, name:str=_("New Chat"), folder_id:str=None, is_template=False):
+    def __init__(self, chat_id:str=None, name:str=_("New Chat"), folder_id:str=None, is_template=False, row=None):
         super().__init__()
         self.set_name(name)
         self.busy = False
+        self.generation = None
+        self.context_usage = None
         self.chat_id = chat_id
         self.folder_id = folder_id
         self.is_template = is_template
-        self.row = ChatRow(self)
+        self.row = row or ChatRow(chat=self)
+        self.message_records = []
+        self.saved_scroll = None
+        self.search_query = ""
+        self.search_matches = []
+        self.search_match_index = -1
         self.use_template_button.set_visible(bool(self.chat_id))
+        self.scrolledwindow.connect('edge-reached', self.on_edge_reached)
+        # Only touched from the main thread, generation threads read it to decide whether to render
+        self.rendering_visible = False
+        self.connect('map', lambda *_: self.set_rendering_visible(True))
+        self.connect('unmap', lambda *_: self.set_rendering_visible(False))
         GLib.idle_add(self.update_prompts)
         GLib.idle_add(self.connect_model_selector)
         #self.connect('notify::root', lambda *_: self.connect_model_selector())
@@ -488,6 +580,14 @@ class Chat(Gtk.Stack):
                 global_footer.model_selector.selector.connect('notify::selected', lambda selector, ud: self.on_model_change(selector))
                 GLib.idle_add(self.on_model_change, global_footer.model_selector)
 
+    def set_rendering_visible(self, visible:bool):
+        self.rendering_visible = visible
+        if visible:
+            # Catch up on whatever was streamed while the chat was hidden
+            for message in list(self.container):
+                if message.pending_content or message.pending_thinking:
+                    GLib.idle_add(message.render_pending)
+
     def on_model_change(self, model_selector):
         char_dict = {}
         selected_item = model_selector.get_selected_item()
@@ -497,24 +597,52 @@ class Chat(Gtk.Stack):
         self.use_character_button.set_visible(use_character)
 
     def on_search(self, query:str):
-        query = re.escape(query)
+        self.search_query = query
+        query_lower = query.lower()
+        if query:
+            # Older messages are only built as far back as the oldest match,
+            # the search runs again once their blocks are loaded
+            oldest_match = next((i for i, record in enumerate(self.message_records) if query_lower in record.get_search_text()), None)
+            if oldest_match is not None:
+                self.load_older_messages(
+                    len(self.message_records) - oldest_match,
+                    lambda: GLib.idle_add(lambda: self.on_search(self.search_query))
+                )
+        self.search_matches = []
+        self.search_match_index = -1
         for m in list(self.container):
-            content = m.get_content()
-            if content:
-                string_search = re.search(query, content, re.IGNORECASE)
-                m.set_visible(string_search)
-                for block in list(m.block_container):
-                    if isinstance(block, blocks.text.Text):
-                        if query:
-                            query_escaped = GLib.markup_escape_text(query)
-                            block_content = GLib.markup_escape_text(block.get_content())
-                            highlighted_text = re.sub(f"({query_escaped})", r"<span background='yellow' bgalpha='30%'>\1</span>", block_content, flags=re.IGNORECASE)
-                            block.set_markup(highlighted_text)
-                        else:
-                            block.set_content(block.get_content())
+            message_match = not query
+            for block in list(m.block_container):
+                if isinstance(block, blocks.text.Text):
+                    block_match = block.set_highlight(query)
+                else:
+                    # Code and table blocks keep their lowercased text, the rest are short
+                    search_text = getattr(block, 'search_text', None)
+                    if search_text is None:
+                        search_text = block.get_content().lower()
+                    block_match = bool(query) and query_lower in search_text
+                if block_match:
+                    self.search_matches.append(block)
+                message_match = message_match or block_match
+
+            if m.get_content() and m.get_visible() != message_match:
+                m.set_visible(message_match)
 
         GLib.idle_add(self.update_visibility, True)
 
+    def navigate_search(self, step:int):
+        # Scrolls to the next (1) or previous (-1) block matching the search
+        self.search_matches = [block for block in self.search_matches if block.get_root()]
+        if len(self.search_matches) == 0:
+            return
+        self.search_match_index = (self.search_match_index + step) % len(self.search_matches)
+        block = self.search_matches[self.search_match_index]
+        # Measured against the container since the viewport's coordinates already include the scroll
+        success, rect = block.compute_bounds(self.container)
+        if success:
+            vadjustment = self.scrolledwindow.get_vadjustment()
+            vadjustment.set_value(rect.get_y() - vadjustment.get_page_size() / 3)
+
     def update_visibility(self, searching:bool=False):
         for m in list(self.container):
             if m.get_visible():
@@ -522,13 +650,26 @@ class Chat(Gtk.Stack):
                 return
         self.set_visible_child_name('no-results' if searching and len(list(self.container)) > 0 else 'welcome-screen')
 
-    def stop_message(self):
+    def cancel_generation(self):
         self.busy = False
+        if self.generation:
+            self.generation.cancel()
+
+    def show_context_usage(self):
+        # Only the footer showing this chat is updated
+        root = self.get_root()
+        if root and getattr(root, 'global_footer', None):
+            root.global_footer.set_context_usage(self.context_usage)
+
+    def stop_message(self):
+        self.cancel_generation()
         root = self.get_root() or self.row.get_root()
         if root:
             root.global_footer.toggle_action_button(True)
 
     def unload_messages(self):
+        self.saved_scroll = self.scrolledwindow.get_vadjustment().get_value()
+        self.message_records = []
         for widget in list(self.container):
             GLib.idle_add(widget.unparent)
             GLib.idle_add(widget.unrealize)
@@ -538,62 +679,156 @@ class Chat(Gtk.Stack):
         self.container.append(message)
         GLib.idle_add(self.update_visibility)
 
-    def load_messages(self):
-        def load_message(message_element, content):
-            attachments = SQL.get_attachments(message_element)
-            message_element.block_container.set_content(content)
+    def get_messages(self) -> list:
+        """
+        Every message in the chat, records for the ones that aren't built as widgets
+        """
+        return self.message_records + list(self.container)
+
+    def build_messages(self, records:list, on_loaded:callable=None) -> list:
+        def load_message(message_element, record, content_hash, parsed):
+            if parsed is None:
+                parsed = blocks.parse_content(record.content)
+                new_cache[content_hash] = parsed
+            message_element.block_container.set_content(record.content, parsed)
 
-            for attachment in attachments:
+            for attachment in record.get_attachments():
                 message_element.add_attachment(
-                    file_id=attachment[0],
-                    name=attachment[2],
-                    attachment_type=attachment[1],
-                    content=attachment[3]
+                    file_id=attachment.get('id'),
+                    name=attachment.get('name'),
+                    attachment_type=attachment.get('type'),
+                    content=attachment.get('content')
                 )
 
-        messages = SQL.get_messages(self)
-        for message in messages:
-            message_element = Message(
-                dt=datetime.datetime.strptime(message[3] + (":00" if message[3].count(":") == 1 else ""), '%Y/%m/%d %H:%M:%S'),
-                message_id=message[0],
-                mode=('user', 'assistant', 'system').index(message[1]),
-                author=message[2]
-            )
-            threading.Thread(target=load_message, args=(message_element, message[4])).start()
+        def finish_loading():
+            SQL.insert_block_cache(new_cache)
+            if on_loaded:
+                on_loaded()
+
+        content_hashes = [blocks.get_content_hash(record.content) for record in records]
+        cache = SQL.get_block_cache(list(set(content_hashes)))
+        new_cache = {}
+        message_elements = [Message(
+            dt=record.dt,
+            message_id=record.message_id,
+            mode=record.mode,
+            author=record.author
+        ) for record in records]
+
+        # Newest messages first since those are the ones visible when the chat opens
+        futures = []
+        for i in reversed(range(len(records))):
+            futures.append(message_load_pool.submit(load_message, message_elements[i], records[i], content_hashes[i], cache.get(content_hashes[i])))
+        when_futures_done(futures, finish_loading)
+        return message_elements
+
+    def load_messages(self):
+        attachments = SQL.get_chat_attachments(self)
+        records = [MessageRecord(
+            message_id=message[0],
+            mode=('user', 'assistant', 'system').index(message[1]),
+            author=message[2],
+            dt=datetime.datetime.strptime(message[3] + (":00" if message[3].count(":") == 1 else ""), '%Y/%m/%d %H:%M:%S'),
+            content=message[4],
+            attachments=[{
+                'id': attachment[0],
+                'name': attachment[2],
+                'type': attachment[1],
+                'content': attachment[3]
+            } for attachment in attachments.get(message[0], [])]
+        ) for message in SQL.get_messages(self)]
+
+        if self.saved_scroll is not None:
+            saved_scroll = self.saved_scroll
+            self.saved_scroll = None
+            self.hold_scroll(lambda adj: saved_scroll)
+
+        self.message_records = records[:-MESSAGE_WINDOW]
+        for message_element in self.build_messages(records[-MESSAGE_WINDOW:]):
             self.container.append(message_element)
         GLib.idle_add(self.update_visibility)
 
-    def convert_to_ollama(self) -> list:
+    def hold_scroll(self, get_value:callable):
+        # Reapplies the scroll position while messages are being laid out
+        vadjustment = self.scrolledwindow.get_vadjustment()
+        handler_id = vadjustment.connect('changed', lambda adj: adj.set_value(get_value(adj)))
+        GLib.timeout_add(1000, lambda: vadjustment.disconnect(handler_id))
+
+    def load_older_messages(self, count:int=MESSAGE_PAGE, on_loaded:callable=None):
+        if len(self.message_records) == 0 or count <= 0:
+            return
+        records = self.message_records[-count:]
+        self.message_records = self.message_records[:-count]
+
+        # Keep the same distance to the bottom while the new messages are laid out
+        vadjustment = self.scrolledwindow.get_vadjustment()
+        distance = vadjustment.get_upper() - vadjustment.get_value()
+        self.hold_scroll(lambda adj: adj.get_upper() - distance)
+
+        for message_element in reversed(self.build_messages(records, on_loaded)):
+            self.container.prepend(message_element)
+
+    def unload_older_messages(self):
+        message_elements = list(self.container)
+        for message_element in message_elements[:-MESSAGE_WINDOW]:
+            self.message_records.append(MessageRecord(
+                message_id=message_element.message_id,
+                mode=message_element.mode,
+                author=message_element.author,
+                dt=message_element.dt,
+                content=message_element.get_content(),
+                attachments=message_element.get_attachments()
+            ))
+            message_element.unparent()
+
+    def on_edge_reached(self, scrolledwindow, position):
+        if position == Gtk.PositionType.TOP:
+            self.load_older_messages()
+        elif position == Gtk.PositionType.BOTTOM:
+            searchentry = getattr(self.get_root(), 'searchentry_messages', None)
+            if not searchentry or not searchentry.get_text():
+                self.unload_older_messages()
+
+    def convert_attachment(self, attachment:dict, compact:bool) -> str:
+        # Compacted messages keep a note of the attachment so the model knows it existed
+        return '```{} ({})\n{}\n```\n\n'.format(attachment.get('name'), attachment.get('type'), '[omitted]' if compact else attachment.get('content'))
+
+    def convert_to_ollama(self, compact_before:int=0) -> list:
+        # Images and attachments of the first `compact_before` messages are left out
         messages = []
-        for message in list(self.container):
+        for message in self.get_messages():
             if message.get_content() and message.dt:
+                compact = len(messages) < compact_before
                 message_data = {
                     'role': ('user', 'assistant', 'system')[message.mode],
                     'content': ''
                 }
+                attachments = message.get_attachments()
 
-                for image in message.image_attachment_container.get_content():
+                for image in [a for a in attachments if a.get('type') == 'image' and not compact]:
                     if 'images' not in message_data:
                         message_data['images'] = []
 
                     message_data['images'].append(image['content'])
 
-                for attachment in message.attachment_container.get_content():
+                for attachment in [a for a in attachments if a.get('type') != 'image']:
                     if attachment.get('type') not in ('thought', 'metadata'):
-                        message_data['content'] += '```{} ({})\n{}\n```\n\n'.format(attachment.get('name'), attachment.get('type'), attachment.get('content'))
+                        message_data['content'] += self.convert_attachment(attachment, compact)
                 message_data['content'] += message.get_content()
                 messages.append(message_data)
         return messages
 
-    def convert_to_json(self, include_metadata:bool=False) -> list:
+    def convert_to_json(self, include_metadata:bool=False, compact_before:int=0) -> list:
         messages = []
-        for message in list(self.container):
+        for message in self.get_messages():
             if message.get_content() and message.dt:
+                compact = len(messages) < compact_before
                 message_data = {
                     'role': ('user', 'assistant', 'system')[message.mode],
                     'content': []
                 }
-                for image in message.image_attachment_container.get_content():
+                attachments = message.get_attachments()
+                for image in [a for a in attachments if a.get('type') == 'image' and not compact]:
                     message_data['content'].append({
                         'type': 'image_url',
                         'image_url': {
@@ -604,11 +839,11 @@ class Chat(Gtk.Stack):
                     'type': 'text',
                     'text': ''
                 })
-                for attachment in message.attachment_container.get_content():
+                for attachment in [a for a in attachments if a.get('type') != 'image']:
                     if attachment.get('type') == 'thought':
                         message_data['thinking'] = attachment.get('content')
                     elif attachment.get('type') != 'metadata':
-                        message_data['content'][0]['text'] += '```{} ({})\n{}\n```\n\n'.format(attachment.get('name'), attachment.get('type'), attachment.get('content'))
+                        message_data['content'][0]['text'] += self.convert_attachment(attachment, compact)
                 message_data['content'][0 if ("text" in message_data.get("content", [''])[0]) else 1]['text'] += message.get_content()
                 if include_metadata:
                     message_data['date'] = message.dt.strftime("%Y/%m/%d %H:%M:%S")
@@ -761,8 +996,7 @@ class FolderRow(Gtk.ListBoxRow):
             return True
 
     def on_drop_chat(self, target, row, x, y):
-        row.chat.folder_id = self.folder_id
-        SQL.insert_or_update_chat(row.chat)
+        row.move_to_folder(self.folder_id)
         row.get_parent().remove(row)
         folder_page = self.get_root().chat_list_navigationview.find_page(self.folder_id)
         if folder_page:
@@ -904,12 +1138,17 @@ class ChatRow(Gtk.ListBoxRow):
     spinner = Gtk.Template.Child()
     indicator = Gtk.Template.Child()
 
-    def __init__(self, chat:Chat):
+    def __init__(self, chat:Chat=None, chat_id:str=None, name:str=_("New Chat"), folder_id:str=None, is_template=False):
         super().__init__()
-        self.chat = chat
-        self.set_name(self.chat.get_name())
-        self.set_tooltip_text(self.chat.get_name())
-        self.label.set_label(self.chat.get_name())
+        self.loaded_chat = chat
+        if chat:
+            chat_id, name, folder_id, is_template = chat.chat_id, chat.get_name(), chat.folder_id, chat.is_template
+        self.chat_id = chat_id
+        self.folder_id = folder_id
+        self.is_template = is_template
+        self.set_name(name)
+        self.set_tooltip_text(name)
+        self.label.set_label(name)
 
         drag_source = Gtk.DragSource()
         drag_source.set_actions(Gdk.DragAction.MOVE)
@@ -919,6 +1158,18 @@ class ChatRow(Gtk.ListBoxRow):
         drag_source.connect("drag-end", lambda s,d,r: self.on_drag_end(s,d,r,self.get_ancestor(Adw.NavigationPage)))
         self.add_controller(drag_source)
 
+    @property
+    def chat(self) -> Chat:
+        if not self.loaded_chat:
+            self.loaded_chat = Chat(
+                chat_id=self.chat_id,
+                name=self.get_name(),
+                folder_id=self.folder_id,
+                is_template=self.is_template,
+                row=self
+            )
+        return self.loaded_chat
+
     def on_drag_begin(self, source, drag, page):
         page.top_indicator.set_visible(True)
         page.bottom_indicator.set_visible(True)
@@ -983,20 +1234,32 @@ class ChatRow(Gtk.ListBoxRow):
 
     # Call in different thread
     def update_profile_pictures(self):
-        for msg in list(self.chat.container):
+        if not self.loaded_chat:
+            return
+        for msg in list(self.loaded_chat.container):
             GLib.idle_add(msg.update_profile_picture)
 
+    def move_to_folder(self, folder_id:str):
+        self.folder_id = folder_id
+        if self.loaded_chat:
+            self.loaded_chat.folder_id = folder_id
+        SQL.insert_or_update_chat(self)
+
     def edit(self, new_name:str, is_template:bool):
+        # The row holds everything SQL needs, the Chat is only updated if it was built
         if not new_name:
             new_name = _('New Chat')
-        if new_name != self.chat.get_name():
+        if new_name != self.get_name():
             new_name = generate_numbered_name(new_name, [row.get_name() for row in list(self.get_parent())])
             self.label.set_label(new_name)
             self.label.set_tooltip_text(new_name)
-            self.chat.set_name(new_name)
             self.set_name(new_name)
-        self.chat.is_template = is_template
-        SQL.insert_or_update_chat(self.chat)
+            if self.loaded_chat:
+                self.loaded_chat.set_name(new_name)
+        self.is_template = is_template
+        if self.loaded_chat:
+            self.loaded_chat.is_template = is_template
+        SQL.insert_or_update_chat(self)
 
         if self.get_parent().get_selected_row() == self:
             self.get_root().chat_page.set_title(self.get_name())
@@ -1020,7 +1283,7 @@ class ChatRow(Gtk.ListBoxRow):
         )
         template_switch = Adw.SwitchRow(
             title=_('Use as Template'),
-            active=self.chat.is_template,
+            active=self.is_template,
             activatable=False
         )
 
@@ -1032,7 +1295,9 @@ class ChatRow(Gtk.ListBoxRow):
         window = self.get_root()
         list_box = self.get_parent()
         list_box.remove(self)
-        SQL.delete_chat(self.chat)
+        SQL.delete_chat(self)
+        if self.loaded_chat:
+            forget_chat(self.loaded_chat)
         if len(list(list_box)) == 0:
             chat_list_page = window.get_chat_list_page()
             if chat_list_page.folder_id:
@@ -1044,7 +1309,7 @@ class ChatRow(Gtk.ListBoxRow):
             chat_list_page.update_visibility()
         if not list_box.get_selected_row() or list_box.get_selected_row() == self:
             list_box.select_row(list_box.get_row_at_index(0))
-        if voice.message_dictated and voice.message_dictated.chat.chat_id == self.chat.chat_id:
+        if voice.message_dictated and voice.message_dictated.chat.chat_id == self.chat_id:
             voice.message_dictated.popup.tts_button.set_active(False)
 
     def prompt_delete(self):
@@ -1060,13 +1325,13 @@ class ChatRow(Gtk.ListBoxRow):
     def duplicate(self):
         new_chat_name = _("Copy of {}".format(self.get_name()))
         new_chat_id = generate_uuid()
-        new_chat = self.get_root().get_chat_list_page().add_chat(
+        new_row = self.get_root().get_chat_list_page().add_chat(
             chat_name=new_chat_name,
             chat_id=new_chat_id,
             is_template=False,
             mode=1
         )
-        SQL.duplicate_chat(self.chat.chat_id, new_chat)
+        SQL.duplicate_chat(self.chat_id, new_row)
 
     def on_export_successful(self, file, result):
         file.replace_contents_finish(result)
@@ -1088,7 +1353,7 @@ class ChatRow(Gtk.ListBoxRow):
     def export_md(self, obsidian:bool):
         logger.info("Exporting chat (MD)")
         markdown = []
-        for message_element in list(self.chat.container):
+        for message_element in self.chat.get_messages():
             if message_element.get_content() and message_element.dt:
                 message_author = _('User')
                 if message_element.get_model():
@@ -1098,7 +1363,8 @@ class ChatRow(Gtk.ListBoxRow):
 
                 markdown.append('### **{}** | {}'.format(message_author, message_element.dt.strftime("%Y/%m/%d %H:%M:%S")))
                 markdown.append(message_element.get_content())
-                for file in message_element.image_attachment_container.get_content():
+                attachments = message_element.get_attachments()
+                for file in [a for a in attachments if a.get('type') == 'image']:
                     markdown.append('![🖼️ {}](data:image/{};base64,{})'.format(file.get('name'), file.get('name').split('.')[1], file.get('content')))
                 emojis = {
                     'plain_text': '📃',
@@ -1108,7 +1374,7 @@ class ChatRow(Gtk.ListBoxRow):
                     'website': '🌐',
                     'thought': '🧠'
                 }
-                for file in message_element.attachment_container.get_content():
+                for file in [a for a in attachments if a.get('type') != 'image']:
                     if obsidian:
                         file_block = "> [!quote]- {}\n".format(file.get('name'))
                         for line in file.get('content').split("\n"):
@@ -1127,7 +1393,7 @@ class ChatRow(Gtk.ListBoxRow):
         logger.info("Exporting chat (DB)")
         if os.path.isfile(os.path.join(cache_dir, 'export.db')):
             os.remove(os.path.join(cache_dir, 'export.db'))
-        SQL.export_db(self.chat, os.path.join(cache_dir, 'export.db'))
+        SQL.export_db(self, os.path.join(cache_dir, 'export.db'))
         file_dialog = Gtk.FileDialog(initial_name=f"{self.get_name()}.db")
         file_dialog.save(parent=self.get_root(), cancellable=None, callback=lambda file_dialog, result, temp_path=os.path.join(cache_dir, 'export.db'): self.on_export_chat(file_dialog, result, temp_path))
 
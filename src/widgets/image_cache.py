@@ -0,0 +1,79 @@
+# image_cache.py
+"""
+Content addressed disk cache for online images, kept free of widgets so it
+can be tested without a display
+"""
+
+import requests, json, tempfile, logging, os, hashlib, time
+
+logger = logging.getLogger(__name__)
+
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+IMAGE_TIMEOUT = 20 # seconds for the whole download
+
+def write_atomically(path:str, data:bytes) -> None:
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+        f.write(data)
+    os.replace(f.name, path)
+
+def read_metadata(metadata_path:str) -> dict:
+    # An unreadable metadata file is treated as a cache miss and rewritten
+    try:
+        with open(metadata_path, 'r') as f:
+            metadata = json.load(f)
+        if isinstance(metadata, dict):
+            return metadata
+    except (OSError, ValueError):
+        pass
+    return {}
+
+def download_online_image(image_url:str, cache_directory:str) -> str:
+    """
+    Downloads an image into the content addressed cache and returns its path.
+    Cached copies are revalidated with ETag / Last-Modified.
+    """
+    os.makedirs(cache_directory, exist_ok=True)
+    url_hash = hashlib.sha256(image_url.encode('utf-8')).hexdigest()
+    metadata_path = os.path.join(cache_directory, '{}.json'.format(url_hash))
+    metadata = read_metadata(metadata_path)
+    cached_path = os.path.join(cache_directory, metadata.get('content', ''))
+    has_cache = bool(metadata.get('content')) and os.path.isfile(cached_path)
+
+    headers = {"User-Agent": "AlpacaBot"}
+    if has_cache:
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata.get('etag')
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata.get('last_modified')
+
+    try:
+        deadline = time.monotonic() + IMAGE_TIMEOUT
+        with requests.get(url=image_url, headers=headers, stream=True, timeout=(5, 10)) as response:
+            if response.status_code == 304 and has_cache:
+                return cached_path
+            response.raise_for_status()
+            if int(response.headers.get('Content-Length') or 0) > MAX_IMAGE_BYTES:
+                raise ValueError('Image is too large')
+            data = bytearray()
+            for chunk in response.iter_content(chunk_size=65536):
+                data.extend(chunk)
+                if len(data) > MAX_IMAGE_BYTES:
+                    raise ValueError('Image is too large')
+                if time.monotonic() > deadline:
+                    raise TimeoutError('Image took too long to download')
+    except Exception as e:
+        if has_cache:
+            logger.warning('Using cached image for {}: {}'.format(image_url, e))
+            return cached_path
+        raise
+
+    content_hash = hashlib.sha256(data).hexdigest()
+    content_path = os.path.join(cache_directory, content_hash)
+    if not os.path.isfile(content_path):
+        write_atomically(content_path, data)
+    write_atomically(metadata_path, json.dumps({
+        'content': content_hash,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified')
+    }).encode('utf-8'))
+    return content_path
@@ -2,9 +2,10 @@
 
 from gi.repository import Adw, Gtk, GLib, Gio
 
-import os, shutil, json, re, logging, importlib.util
+import os, shutil, json, re, logging, threading, importlib.util
 from ...sql_manager import generate_uuid, generate_numbered_name, prettify_model_name, Instance as SQL
 from .. import dialog
+from . import engine, model_cache, telemetry
 from .ollama_instances import BaseInstance as BaseOllama
 if os.getenv('ALPACA_OLLAMA_ONLY', '0') != '1' and importlib.util.find_spec('openai'):
     from .openai_instances import BaseInstance as BaseOpenAI
@@ -32,17 +33,23 @@ class InstancePreferencesDialog(Adw.Dialog):
     metadata_el = Gtk.Template.Child()
     self_signed_ssl_el = Gtk.Template.Child()
     max_tokens_el = Gtk.Template.Child()
+    num_parallel_el = Gtk.Template.Child()
+    summarize_context_el = Gtk.Template.Child()
+    context_turns_el = Gtk.Template.Child()
     vulkan_el = Gtk.Template.Child()
 
     parameters_group = Gtk.Template.Child()
     override_parameters_el = Gtk.Template.Child()
     temperature_el = Gtk.Template.Child()
     seed_el = Gtk.Template.Child()
+    cache_responses_el = Gtk.Template.Child()
     context_size_el = Gtk.Template.Child()
+    fit_context_el = Gtk.Template.Child()
 
     keep_alive_group = Gtk.Template.Child()
     keep_alive_selector_el = Gtk.Template.Child()
     keep_alive_minutes_el = Gtk.Template.Child()
+    adaptive_keep_alive_el = Gtk.Template.Child()
 
     overrides_group = Gtk.Template.Child()
     override_0_el = Gtk.Template.Child()
@@ -108,15 +115,24 @@ class InstancePreferencesDialog(Adw.Dialog):
         self.set_simple_element_value(self.metadata_el)
         self.set_simple_element_value(self.self_signed_ssl_el)
         self.set_simple_element_value(self.max_tokens_el)
+        self.set_simple_element_value(self.num_parallel_el)
+        self.set_simple_element_value(self.summarize_context_el)
+        self.set_simple_element_value(self.context_turns_el)
 
         # PARAMETERS GROUP
         self.set_simple_element_value(self.override_parameters_el)
         self.set_simple_element_value(self.temperature_el)
         self.set_simple_element_value(self.seed_el)
+        self.set_simple_element_value(self.cache_responses_el)
+        if 'seed' not in self.instance.properties:
+            # Responses can't be repeated without a seed
+            self.cache_responses_el.set_visible(False)
         self.set_simple_element_value(self.context_size_el)
+        self.set_simple_element_value(self.fit_context_el)
 
         # KEEP ALIVE GROUP
         if 'keep_alive' in self.instance.properties:
+            self.set_simple_element_value(self.adaptive_keep_alive_el)
             val = self.instance.properties.get('keep_alive', -1)
             if val > 0:
                 selected_index = 0
@@ -212,6 +228,9 @@ class InstancePreferencesDialog(Adw.Dialog):
             return self.model_list[index - 1].get('name')
         elif el.get_name() == 'model_directory':
             return el.get_subtitle()
+        elif el.get_name() == 'keep_alive':
+            # Shown in minutes, stored in seconds
+            return int(el.get_value() * 60) if el.get_value() > 0 else int(el.get_value())
         elif el.get_name() == 'override:OLLAMA_VULKAN':
             return '1' if el.get_active() else ''
         elif isinstance(el, Adw.PasswordEntryRow):
@@ -246,6 +265,10 @@ class InstancePreferencesDialog(Adw.Dialog):
 
         if not self.instance.instance_id:
             self.instance.instance_id = generate_uuid()
+        else:
+            # The connection might point somewhere else now
+            model_cache.invalidate_local_models(self.instance)
+            model_cache.invalidate(self.instance)
 
         SQL.insert_or_update_instance(
             instance_id=self.instance.instance_id,
@@ -277,6 +300,7 @@ class InstancePreferencesDialog(Adw.Dialog):
     def keep_alive_preset_changed(self, combo, gparam=None):
         index = combo.get_selected()
         self.keep_alive_minutes_el.set_visible(index == 0)
+        self.adaptive_keep_alive_el.set_visible(index == 0 and 'adaptive_keep_alive' in self.instance.properties)
         if index == 0:
             self.keep_alive_minutes_el.set_adjustment(Gtk.Adjustment(
                 value=int(self.instance.properties.get('keep_alive', 60) / 60),
@@ -312,6 +336,49 @@ class InstancePreferencesDialog(Adw.Dialog):
     def open_link(self, button):
         Gio.AppInfo.launch_default_for_uri(button.get_tooltip_text())
 
+def update_performance_list(group:Adw.PreferencesGroup, listbox:Gtk.ListBox, instance_listbox:Gtk.ListBox) -> None:
+    def fill(performance:list):
+        listbox.remove_all()
+        instance_names = {row.instance.instance_id: row.instance.properties.get('name') for row in list(instance_listbox)}
+        for entry in [e for e in performance if e.get('instance_id') in instance_names]:
+            summary = []
+            if entry.get('ttft') is not None:
+                summary.append(_('{:.2f}s to first token').format(entry.get('ttft')))
+            if entry.get('tokens_per_second'):
+                summary.append(_('{:.1f} tokens/s').format(entry.get('tokens_per_second')))
+
+            details = []
+            if entry.get('itl_p50') is not None:
+                details.append(_('Inter-token latency: {:.0f} ms median, {:.0f} ms p90').format(entry.get('itl_p50') * 1000, (entry.get('itl_p90') or 0) * 1000))
+            if entry.get('load_duration'):
+                details.append(_('Load: {:.2f}s').format(entry.get('load_duration')))
+            if entry.get('prompt_tokens'):
+                details.append(_('Prompt: {:.0f} tokens').format(entry.get('prompt_tokens')))
+            if entry.get('completion_tokens'):
+                details.append(_('Response: {:.0f} tokens').format(entry.get('completion_tokens')))
+            if entry.get('load_saved'):
+                details.append(_('Loading saved by warm-ups: {:.1f}s').format(entry.get('load_saved')))
+            if entry.get('cache_hits') or entry.get('cache_misses'):
+                details.append(_('Cached responses: {} replayed, {} generated').format(entry.get('cache_hits'), entry.get('cache_misses')))
+
+            row = Adw.ActionRow(
+                title = prettify_model_name(entry.get('model')),
+                subtitle = _('{} · {} responses').format(instance_names.get(entry.get('instance_id')), entry.get('requests')),
+                tooltip_text = '\n'.join(details),
+                use_markup = False
+            )
+            row.add_suffix(Gtk.Label(
+                label = ' · '.join(summary),
+                css_classes = ['dim-label'],
+                wrap = True,
+                justify = 1
+            ))
+            listbox.append(row)
+        group.set_visible(len(list(listbox)) > 0)
+
+    # Reads the telemetry table off the main thread
+    threading.Thread(target=lambda: GLib.idle_add(fill, telemetry.get_model_performance()), daemon=True).start()
+
 # Fallback for when there are no instances
 class Empty:
     instance_id = ''
@@ -377,6 +444,9 @@ class InstanceRow(Adw.ActionRow):
             )
             self.add_suffix(remove_button)
 
+        if self.instance.instance_id:
+            engine.get_scheduler(self.instance.instance_id).on_change = lambda status: GLib.idle_add(self.update_queue_status, status)
+
         if not isinstance(self.instance, Empty):
             edit_button = Gtk.Button(
                 tooltip_text=_('Edit Instance'),
@@ -390,6 +460,17 @@ class InstanceRow(Adw.ActionRow):
     def show_edit(self):
         InstancePreferencesDialog(self.instance).present(self.get_root())
 
+    def update_queue_status(self, status:dict):
+        subtitle = self.instance.instance_type_display
+        if status.get('running') or status.get('queued'):
+            subtitle = _('{} · {} running, {} queued, {:.1f}s average wait').format(
+                subtitle,
+                status.get('running'),
+                status.get('queued'),
+                status.get('average_wait')
+            )
+        self.set_subtitle(subtitle)
+
     def remove(self):
         SQL.delete_instance(self.instance.instance_id)
         if len(list(self.get_root().instance_listbox)) > 1:
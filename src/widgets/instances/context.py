@@ -0,0 +1,98 @@
+# context.py
+"""
+Fits the conversation into the context window of the model.
+Tokens are estimated from characters with a ratio calibrated per instance and model
+against the prompt_eval_count reported by the server.
+When the prompt doesn't fit, attachments and tool outputs of older turns are left out first,
+then the oldest turns are dropped. System messages and the newest turn are always kept.
+"""
+
+import logging, threading
+from . import prompt
+
+logger = logging.getLogger(__name__)
+
+IMAGE_TOKENS = 768 # Rough cost of an image, it depends on the model
+MESSAGE_TOKENS = 4 # Role and template tokens around every message
+RESPONSE_RESERVE = 0.25 # Part of the window left for the response
+CALIBRATION_WEIGHT = 0.3
+MIN_CALIBRATION_CHARACTERS = 400
+
+ratios = {} # (instance_id, model) -> characters per token
+lock = threading.Lock()
+
+def get_ratio(instance_id:str, model:str) -> float:
+    with lock:
+        return ratios.get((instance_id, model), prompt.CHARACTERS_PER_TOKEN)
+
+def calibrate(instance_id:str, model:str, characters:int, tokens:int) -> None:
+    # Short prompts are mostly template tokens, they would skew the ratio
+    if not tokens or characters < MIN_CALIBRATION_CHARACTERS:
+        return
+    sample = min(10, max(1, characters / tokens))
+    with lock:
+        previous = ratios.get((instance_id, model))
+        ratios[(instance_id, model)] = sample if previous is None else previous + CALIBRATION_WEIGHT * (sample - previous)
+        logger.debug('{} characters per token for {}'.format(round(ratios.get((instance_id, model)), 2), model))
+
+def estimate_tokens(messages:list, ratio:float) -> int:
+    tokens = 0
+    for message in messages:
+        images = len(message.get('images', []))
+        if isinstance(message.get('content'), list):
+            images += len([part for part in message.get('content') if part.get('type') == 'image_url'])
+        tokens += prompt.get_text_length(message) / ratio + images * IMAGE_TOKENS + MESSAGE_TOKENS
+    return int(tokens)
+
+def get_budget(num_ctx:int) -> int:
+    return int(num_ctx * (1 - RESPONSE_RESERVE))
+
+def get_turns(messages:list) -> list:
+    # Indexes of the messages of every turn, a turn starts with each user message
+    turns = []
+    for i, message in enumerate(messages):
+        if message.get('role') == 'system':
+            continue
+        if not turns or message.get('role') == 'user':
+            turns.append([])
+        turns[-1].append(i)
+    return turns
+
+def select_turns(messages:list, turns:list) -> list:
+    kept = set(i for turn in turns for i in turn)
+    return [m for i, m in enumerate(messages) if m.get('role') == 'system' or i in kept]
+
+def fit(build, num_ctx:int=0, max_turns:int=0, ratio:float=prompt.CHARACTERS_PER_TOKEN, reserved:int=0, trim:bool=True) -> tuple:
+    """
+    build(compact_before) returns the messages of the chat with the attachments
+    of the first `compact_before` messages left out.
+    num_ctx is the context window in tokens (0 = unknown), messages are only left out
+    to fit it if trim is set, max_turns (0 = all) always applies.
+    reserved are tokens taken by messages added later (model system prompt).
+    Returns the messages that fit and the usage shown in the chat.
+    """
+    budget = get_budget(num_ctx) if num_ctx and trim else 0
+    messages = build(0)
+    turns = get_turns(messages)
+    dropped = max(0, len(turns) - int(max_turns)) if max_turns else 0
+    fitted = select_turns(messages, turns[dropped:])
+    compacted = False
+
+    if budget and estimate_tokens(fitted, ratio) + reserved > budget and len(turns) > 1:
+        messages = build(turns[-1][0])
+        compacted = True
+        fitted = select_turns(messages, turns[dropped:])
+
+    while budget and estimate_tokens(fitted, ratio) + reserved > budget and dropped < len(turns) - 1:
+        dropped += 1
+        fitted = select_turns(messages, turns[dropped:])
+
+    usage = {
+        'tokens': estimate_tokens(fitted, ratio) + reserved,
+        'limit': int(num_ctx),
+        'dropped': len(messages) - len(fitted),
+        'compacted': compacted
+    }
+    if compacted or usage.get('dropped'):
+        logger.info('Context fitted to ~{tokens}/{limit} tokens, {dropped} older messages left out'.format(**usage))
+    return fitted, usage
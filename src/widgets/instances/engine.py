@@ -0,0 +1,277 @@
+# engine.py
+"""
+Generation engine shared by every instance.
+Responses are streamed as tasks on a single asyncio loop so any number of chats
+can generate at the same time without a thread each.
+"""
+
+import asyncio, threading, logging, collections, contextlib, time
+
+logger = logging.getLogger(__name__)
+
+## States ##
+QUEUED = 'queued'
+PREPARING = 'preparing'
+STREAMING = 'streaming'
+RUNNING_TOOLS = 'running-tools'
+FINISHED = 'finished'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+
+TRANSITIONS = {
+    QUEUED: (PREPARING, CANCELLED, FAILED),
+    PREPARING: (STREAMING, CANCELLED, FAILED),
+    STREAMING: (RUNNING_TOOLS, FINISHED, CANCELLED, FAILED),
+    RUNNING_TOOLS: (STREAMING, FINISHED, CANCELLED, FAILED)
+}
+
+loop = None
+loop_lock = threading.Lock()
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global loop
+    with loop_lock:
+        if not loop:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='GenerationEngine', daemon=True).start()
+        return loop
+
+class CancellationToken:
+    """
+    Cancelling the token cancels the task it is bound to, the exception is raised
+    where the stream is awaited so the HTTP response is closed right away instead
+    of waiting for the next chunk.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.future = None
+
+    def bind(self, future) -> None:
+        with self.lock:
+            self.future = future
+            cancelled = self.cancelled
+        if cancelled:
+            future.cancel()
+
+    def cancel(self) -> None:
+        with self.lock:
+            self.cancelled = True
+            future = self.future
+        if future:
+            future.cancel()
+
+    def is_cancelled(self) -> bool:
+        return self.cancelled
+
+class Generation:
+    def __init__(self, bot_message, chat_element):
+        self.bot_message = bot_message
+        self.chat = chat_element
+        self.token = CancellationToken()
+        self.state = QUEUED
+        self.state_lock = threading.Lock()
+        self.response_metadata = None
+        self.started = False
+        self.finalized = False
+
+    def set_state(self, state:str) -> bool:
+        with self.state_lock:
+            if state not in TRANSITIONS.get(self.state, ()):
+                logger.debug('Ignored generation transition {} -> {}'.format(self.state, state))
+                return False
+            self.state = state
+            return True
+
+    def is_active(self) -> bool:
+        return self.state in TRANSITIONS
+
+    def cancel(self) -> None:
+        self.token.cancel()
+
+def finalize(generation:Generation) -> None:
+    with generation.state_lock:
+        if generation.finalized:
+            return
+        generation.finalized = True
+    if generation.chat and generation.chat.generation is generation:
+        generation.chat.generation = None
+    generation.bot_message.finish_generation(generation.response_metadata)
+
+async def run(generation:Generation, coroutine) -> None:
+    generation.started = True
+    try:
+        await coroutine
+        generation.set_state(FINISHED)
+    except asyncio.CancelledError:
+        generation.set_state(CANCELLED)
+    except Exception as e:
+        generation.set_state(FAILED)
+        logger.exception(e)
+    finally:
+        finalize(generation)
+
+def on_future_done(generation:Generation, future) -> None:
+    # A task cancelled before its first step never runs its finally block
+    if future.cancelled() and not generation.started:
+        generation.set_state(CANCELLED)
+        finalize(generation)
+
+def submit(generation:Generation, coroutine) -> Generation:
+    """
+    Schedules a generation coroutine on the engine loop, it can be called from any thread.
+    The coroutine should set the state as it goes, the terminal state and
+    finish_generation are handled here.
+    """
+    if generation.chat:
+        previous_generation = generation.chat.generation
+        if previous_generation and previous_generation.is_active():
+            previous_generation.cancel()
+        generation.chat.generation = generation
+    future = asyncio.run_coroutine_threadsafe(run(generation, coroutine), get_loop())
+    future.add_done_callback(lambda f: on_future_done(generation, f))
+    generation.token.bind(future)
+    return generation
+
+def run_blocking(function, *args):
+    # Blocking work (SQL, tools) runs in the default executor so the loop keeps streaming other chats
+    return asyncio.to_thread(function, *args)
+
+## Scheduler ##
+INTERACTIVE = 0
+TOOL = 1
+TITLE = 2
+BATCH = 3
+PRIORITIES = (INTERACTIVE, TOOL, TITLE, BATCH)
+
+class Ticket:
+    def __init__(self, priority:int, key:str, label:str):
+        self.priority = priority
+        self.key = key
+        self.label = label
+        self.enqueued = time.monotonic()
+        self.granted = None
+        self.event = threading.Event()
+        self.future = None
+        self.loop = None
+
+    def grant(self) -> None:
+        self.granted = time.monotonic()
+        if self.future:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(True))
+        else:
+            self.event.set()
+
+class Scheduler:
+    """
+    Request queue of a single instance.
+    At most `limit` requests run at once, higher priorities are served first and
+    chats with the same priority take turns so one chat can't starve the others.
+    """
+
+    def __init__(self, limit:int=1):
+        self.lock = threading.Lock()
+        self.limit = max(1, int(limit))
+        self.running = []
+        self.queues = {priority: collections.OrderedDict() for priority in PRIORITIES}
+        self.wait_times = collections.deque(maxlen=50)
+        self.on_change = None
+
+    def set_limit(self, limit:int) -> None:
+        with self.lock:
+            if self.limit == max(1, int(limit)):
+                return
+            self.limit = max(1, int(limit))
+            self.dispatch()
+        self.notify()
+
+    def dispatch(self) -> None:
+        # Must be called with the lock held
+        while len(self.running) < self.limit:
+            ticket = self.next_ticket()
+            if not ticket:
+                return
+            self.running.append(ticket)
+            self.wait_times.append(time.monotonic() - ticket.enqueued)
+            ticket.grant()
+
+    def next_ticket(self) -> Ticket:
+        for priority in PRIORITIES:
+            queue = self.queues.get(priority)
+            if queue:
+                key, tickets = next(iter(queue.items()))
+                ticket = tickets.popleft()
+                if tickets:
+                    queue.move_to_end(key)
+                else:
+                    del queue[key]
+                return ticket
+
+    def enqueue(self, ticket:Ticket) -> None:
+        with self.lock:
+            self.queues.get(ticket.priority).setdefault(ticket.key, collections.deque()).append(ticket)
+            self.dispatch()
+        self.notify()
+
+    def release(self, ticket:Ticket) -> None:
+        with self.lock:
+            if ticket in self.running:
+                self.running.remove(ticket)
+            else:
+                tickets = self.queues.get(ticket.priority).get(ticket.key)
+                if tickets and ticket in tickets:
+                    tickets.remove(ticket)
+                    if not tickets:
+                        del self.queues.get(ticket.priority)[ticket.key]
+            self.dispatch()
+        if ticket.granted and ticket.granted - ticket.enqueued > 1:
+            logger.info('{} waited {:.1f}s for a slot'.format(ticket.label, ticket.granted - ticket.enqueued))
+        self.notify()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority:int, key:str, label:str):
+        ticket = Ticket(priority, key, label)
+        ticket.loop = asyncio.get_running_loop()
+        ticket.future = ticket.loop.create_future()
+        self.enqueue(ticket)
+        try:
+            await ticket.future
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @contextlib.contextmanager
+    def blocking_slot(self, priority:int, key:str, label:str):
+        # For callers running on their own thread, never use it from the GTK main loop
+        ticket = Ticket(priority, key, label)
+        self.enqueue(ticket)
+        try:
+            ticket.event.wait()
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def get_status(self) -> dict:
+        with self.lock:
+            wait_times = list(self.wait_times)
+            return {
+                'limit': self.limit,
+                'running': len(self.running),
+                'queued': sum(len(tickets) for queue in self.queues.values() for tickets in queue.values()),
+                'average_wait': sum(wait_times) / len(wait_times) if wait_times else 0,
+                'max_wait': max(wait_times, default=0)
+            }
+
+    def notify(self) -> None:
+        if self.on_change:
+            self.on_change(self.get_status())
+
+schedulers = {}
+schedulers_lock = threading.Lock()
+
+def get_scheduler(instance_id:str) -> Scheduler:
+    with schedulers_lock:
+        if instance_id not in schedulers:
+            schedulers[instance_id] = Scheduler()
+        return schedulers.get(instance_id)
@@ -0,0 +1,99 @@
+# keep_alive_policy.py
+"""
+Adaptive keep alive for Ollama instances.
+The timer set in the instance preferences is the base, models used often enough that the
+gap between requests goes past it are kept longer, rarely used ones are unloaded sooner and
+everything shrinks when the system runs low on memory (local instances only).
+"""
+
+import threading, logging, time, collections
+from urllib.parse import urlparse
+from ...sql_manager import Instance as SQL
+
+logger = logging.getLogger(__name__)
+
+USAGE_WINDOW = 24 * 60 * 60 # seconds of history used to measure how often a model is used
+MAX_FACTOR = 6 # Longest keep alive, in multiples of the base
+MIN_KEEP_ALIVE = 60 # seconds
+LOW_MEMORY = 0.3 # Fraction of RAM available, below it keep alive is capped to the base
+CRITICAL_MEMORY = 0.15 # Below it models are unloaded right after the minimum
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '0.0.0.0', '::1')
+
+uses = {} # (instance_id, model) -> deque of timestamps
+seeded = set() # instance_ids loaded from the telemetry table
+decisions = {} # (instance_id, model) -> seconds
+lock = threading.Lock()
+
+def seed(instance_id:str) -> None:
+    # Previous sessions are in the telemetry table
+    entries = [e for e in SQL.get_telemetry('response', 1000) if e.get('instance_id') == instance_id]
+    with lock:
+        if instance_id in seeded:
+            return
+        seeded.add(instance_id)
+        for entry in reversed(entries):
+            if time.time() - entry.get('started_at') < USAGE_WINDOW:
+                uses.setdefault((instance_id, entry.get('model')), collections.deque(maxlen=20)).append(entry.get('started_at'))
+
+def record_use(instance, model:str) -> None:
+    with lock:
+        uses.setdefault((instance.instance_id, model), collections.deque(maxlen=20)).append(time.time())
+
+def get_available_memory() -> float:
+    # Fraction of RAM available, None if it can't be read
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            meminfo = {line.split(':')[0]: int(line.split()[1]) for line in f if ':' in line}
+        return meminfo.get('MemAvailable') / meminfo.get('MemTotal')
+    except Exception:
+        return None
+
+def is_local(instance) -> bool:
+    return instance.instance_type == 'ollama:managed' or urlparse(instance.properties.get('url', '')).hostname in LOCAL_HOSTS
+
+def get_keep_alive(instance, model:str) -> int:
+    """
+    Seconds to keep the model loaded after a request, 'Keep Alive Forever' (-1) and
+    'Unload After Use' (0) are respected as they are.
+    """
+    base = instance.properties.get('keep_alive', 300)
+    if not instance.properties.get('adaptive_keep_alive') or base <= 0:
+        return base
+    if instance.instance_id not in seeded:
+        seed(instance.instance_id)
+
+    with lock:
+        timestamps = [t for t in uses.get((instance.instance_id, model), []) if time.time() - t < USAGE_WINDOW]
+    gaps = sorted(b - a for a, b in zip(timestamps, timestamps[1:]))
+    typical_gap = gaps[int(len(gaps) * 0.75)] if len(gaps) >= 2 else None
+
+    if typical_gap is None:
+        keep_alive, reason = max(MIN_KEEP_ALIVE, base / 2), 'rarely used'
+    elif typical_gap * 1.5 <= base:
+        keep_alive, reason = base, 'used often'
+    elif typical_gap * 1.5 <= base * MAX_FACTOR:
+        keep_alive, reason = typical_gap * 1.5, 'covering the usual gap between requests'
+    else:
+        keep_alive, reason = max(MIN_KEEP_ALIVE, base / 2), 'requests too far apart'
+
+    available_memory = get_available_memory() if is_local(instance) else None
+    if available_memory is not None and available_memory < CRITICAL_MEMORY:
+        keep_alive, reason = MIN_KEEP_ALIVE, 'memory critically low'
+    elif available_memory is not None and available_memory < LOW_MEMORY and keep_alive > base:
+        keep_alive, reason = base, 'memory low'
+    keep_alive = int(keep_alive)
+
+    with lock:
+        changed = decisions.get((instance.instance_id, model)) != keep_alive
+        decisions[(instance.instance_id, model)] = keep_alive
+    if changed:
+        logger.info('Keep alive of {} set to {}s, {} ({} uses in 24h, typical gap {}, {} memory available, base {}s)'.format(
+            model,
+            keep_alive,
+            reason,
+            len(timestamps),
+            '{:.0f}s'.format(typical_gap) if typical_gap is not None else 'unknown',
+            '{:.0%}'.format(available_memory) if available_memory is not None else 'unknown',
+            base
+        ))
+    return keep_alive
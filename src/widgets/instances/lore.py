@@ -0,0 +1,86 @@
+# lore.py
+"""
+Lorebook matching shared by every instance.
+The keys of a character book are compiled once into a single regex, it's kept until
+the character is saved again. Each chat only scans the messages it hasn't seen yet
+within the scan depth of the book.
+"""
+
+import re, threading, logging
+from . import prompt
+
+logger = logging.getLogger(__name__)
+
+class Matcher:
+    def __init__(self, lorebook:dict):
+        self.entries = []
+        keys = set()
+        for entry in lorebook.get('entries', []):
+            entry_keys = [key.strip() for key in entry.get('keys', []) if key.strip()]
+            self.entries.append((entry_keys, entry.get('content', '')))
+            keys.update(key.lower() for key in entry_keys)
+        self.keys = sorted(keys, key=len, reverse=True)
+        self.scan_depth = lorebook.get('scan_depth', 100)
+        # Zero width so keys overlapping each other are all found, longest first at the same position
+        self.pattern = re.compile(r'(?=\b({})\b)'.format('|'.join(re.escape(key) for key in self.keys)), flags=re.IGNORECASE) if self.keys else None
+        self.key_patterns = {}
+
+    def get_key_pattern(self, key:str) -> re.Pattern:
+        if key not in self.key_patterns:
+            self.key_patterns[key] = re.compile(rf'\b{re.escape(key)}\b', flags=re.IGNORECASE)
+        return self.key_patterns.get(key)
+
+    def match(self, text:str) -> frozenset:
+        if not self.pattern:
+            return frozenset()
+        found = set(m.group(1).lower() for m in self.pattern.finditer(text))
+        # Shorter keys starting where a longer one matched are hidden behind it
+        for key in self.keys:
+            if key not in found and any(key in longer for longer in found) and self.get_key_pattern(key).search(text):
+                found.add(key)
+        return frozenset(found)
+
+    def get_active_lore(self, found:set) -> str:
+        active_lore_content = []
+        for entry_keys, content in self.entries:
+            key = next((k for k in entry_keys if k.lower() in found), None)
+            if key:
+                content = '# {}\n\n{}'.format(key.title(), content)
+                if content not in active_lore_content:
+                    active_lore_content.append(content)
+        return '\n\n---\n\n'.join(active_lore_content)
+
+matchers = {} # model_id -> Matcher
+scans = {} # (model_id, chat_id) -> {message text: keys found}
+lock = threading.Lock()
+
+def get_matcher(model_id:str, lorebook:dict) -> Matcher:
+    with lock:
+        if model_id not in matchers:
+            matchers[model_id] = Matcher(lorebook)
+        return matchers.get(model_id)
+
+def invalidate(model_id:str) -> None:
+    # Call it whenever the character of a model is saved or removed
+    with lock:
+        matchers.pop(model_id, None)
+        for key in [k for k in scans if k[0] == model_id]:
+            del scans[key]
+
+def get_active_lore(model_id:str, chat_id:str, messages:list, lorebook:dict) -> str:
+    if len(lorebook.get('entries', [])) == 0:
+        return ''
+    matcher = get_matcher(model_id, lorebook)
+    texts = [prompt.get_text(m) for m in messages[-matcher.scan_depth:] if m.get('role') != 'system']
+
+    with lock:
+        previous_scan = scans.get((model_id, chat_id), {})
+    # Messages that left the scan depth are forgotten
+    scan = {text: previous_scan[text] if text in previous_scan else matcher.match(text) for text in texts}
+    with lock:
+        if matchers.get(model_id) is matcher:
+            scans[(model_id, chat_id)] = scan
+
+    if len(scan) > len(previous_scan):
+        logger.debug('Lore scan: {} new messages out of {}'.format(len(set(scan) - set(previous_scan)), len(scan)))
+    return matcher.get_active_lore(frozenset().union(*scan.values()))
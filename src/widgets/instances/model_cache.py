@@ -0,0 +1,142 @@
+# model_cache.py
+"""
+Caches the local model list of every instance and the metadata (capabilities, details,
+modelfile) of its models per instance, model and digest.
+Metadata lives in memory and SQLite, stale entries are served while they refresh in the background.
+"""
+
+from gi.repository import GLib
+
+import threading, logging, time
+from ...sql_manager import Instance as SQL
+
+logger = logging.getLogger(__name__)
+
+METADATA_TTL = 24 * 60 * 60 # seconds
+MODEL_LIST_REFRESH = 5 * 60 # seconds
+
+## Metadata ##
+
+metadata = {} # (instance_id, model) -> {'digest', 'data', 'fetched_at'}
+refreshing = set()
+lock = threading.Lock()
+
+def get_entry(instance_id:str, model_name:str) -> dict:
+    with lock:
+        if (instance_id, model_name) in metadata:
+            return metadata.get((instance_id, model_name))
+    entry = SQL.get_model_metadata(instance_id, model_name)
+    with lock:
+        metadata[(instance_id, model_name)] = entry
+    return entry
+
+def store(instance, model_name:str, digest:str, data:dict) -> None:
+    entry = {
+        'digest': digest,
+        'data': data,
+        'fetched_at': time.time()
+    }
+    with lock:
+        metadata[(instance.instance_id, model_name)] = entry
+    SQL.insert_or_update_model_metadata(instance.instance_id, model_name, entry)
+
+def fetch(instance, model_name:str) -> dict:
+    digest = instance.get_model_digest(model_name)
+    data = instance.fetch_model_info(model_name)
+    if data: # Failed lookups are not cached so they are retried
+        store(instance, model_name, digest, data)
+    return data
+
+def refresh(instance, model_names:list) -> None:
+    for model_name in model_names:
+        try:
+            fetch(instance, model_name)
+        except Exception as e:
+            logger.error(e)
+        finally:
+            with lock:
+                refreshing.discard((instance.instance_id, model_name))
+
+def refresh_in_background(instance, model_names:list) -> None:
+    with lock:
+        model_names = [m for m in model_names if (instance.instance_id, m) not in refreshing]
+        refreshing.update((instance.instance_id, m) for m in model_names)
+    if len(model_names) > 0:
+        threading.Thread(target=refresh, args=(instance, model_names), daemon=True).start()
+
+def is_current(instance, model_name:str, entry:dict) -> bool:
+    # An unknown digest (online instances, list not loaded yet) matches any entry
+    digest = instance.get_model_digest(model_name)
+    return bool(entry) and (not digest or entry.get('digest') == digest)
+
+def get_model_info(instance, model_name:str) -> dict:
+    if not instance.instance_id or not model_name:
+        return instance.fetch_model_info(model_name)
+    entry = get_entry(instance.instance_id, model_name)
+    if not is_current(instance, model_name, entry):
+        return fetch(instance, model_name)
+    if time.time() - entry.get('fetched_at') > METADATA_TTL:
+        refresh_in_background(instance, [model_name])
+    return entry.get('data')
+
+def prefetch(instance, model_names:list) -> None:
+    # Fills the cache for models that are missing or changed so the first request doesn't wait for it
+    if instance.instance_id:
+        refresh_in_background(instance, [m for m in model_names if not is_current(instance, m, get_entry(instance.instance_id, m))])
+
+def invalidate(instance, model_name:str=None) -> None:
+    with lock:
+        for key in [k for k in metadata if k[0] == instance.instance_id and (not model_name or k[1] == model_name)]:
+            del metadata[key]
+    SQL.remove_model_metadata(instance.instance_id, model_name)
+
+## Local model list ##
+model_lists = {} # instance_id -> {'instance', 'models'}
+refresh_source = None
+
+def get_local_models(instance) -> list:
+    with lock:
+        if instance.instance_id in model_lists:
+            return model_lists.get(instance.instance_id).get('models')
+    models = instance.fetch_local_models()
+    if models is None: # The instance couldn't be reached, try again next time
+        return []
+    with lock:
+        model_lists[instance.instance_id] = {
+            'instance': instance,
+            'models': models
+        }
+    start_periodic_refresh()
+    return models
+
+def invalidate_local_models(instance) -> None:
+    with lock:
+        model_lists.pop(instance.instance_id, None)
+
+def refresh_local_models() -> None:
+    with lock:
+        # Stopped instances are skipped, they are refetched when started and used again
+        instances = [entry.get('instance') for entry in model_lists.values() if entry.get('instance').client]
+    for instance in instances:
+        models = instance.fetch_local_models(quiet=True)
+        if models is None:
+            continue
+        with lock:
+            previous_entry = model_lists.get(instance.instance_id)
+            model_lists[instance.instance_id] = {
+                'instance': instance,
+                'models': models
+            }
+        if previous_entry and [m.get('name') for m in previous_entry.get('models')] != [m.get('name') for m in models]:
+            logger.info('Model list of {} changed outside of Alpaca'.format(instance.properties.get('name')))
+            root = instance.row.get_root() if instance.row else None
+            if root and root.get_current_instance() is instance:
+                GLib.idle_add(root.model_manager.update_added_model_list)
+
+def start_periodic_refresh() -> None:
+    global refresh_source
+    if not refresh_source:
+        refresh_source = GLib.timeout_add_seconds(
+            MODEL_LIST_REFRESH,
+            lambda: threading.Thread(target=refresh_local_models, daemon=True).start() or True
+        )
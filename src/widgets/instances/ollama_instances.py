@@ -2,11 +2,12 @@
 
 from gi.repository import Adw, Gtk, GLib
 
-import json, logging, os, shutil, subprocess, threading, re, signal, pwd, getpass, datetime, time, ollama
+import json, logging, os, shutil, subprocess, threading, re, signal, pwd, getpass, datetime, time, contextlib, ollama
+from . import engine, model_cache, prompt, titles, context, summaries, lore, telemetry, warmup, keep_alive_policy, response_cache
 from .ollama_manager import OllamaManager, get_latest_ollama_tag
 from .. import dialog, tools, chat
 from ...ollama_models import OLLAMA_MODELS
-from ...constants import data_dir, cache_dir, TITLE_GENERATION_PROMPT_OLLAMA, OLLAMA_BINARY_PATH, CAN_SELF_MANAGE_OLLAMA, is_ollama_installed
+from ...constants import data_dir, cache_dir, TITLE_GENERATION_PROMPT_OLLAMA, SUMMARY_GENERATION_PROMPT, OLLAMA_BINARY_PATH, CAN_SELF_MANAGE_OLLAMA, is_ollama_installed
 from ...sql_manager import generate_uuid, dict_to_metadata_string, Instance as SQL
 
 logger = logging.getLogger(__name__)
@@ -15,26 +16,8 @@ logger = logging.getLogger(__name__)
 class BaseInstance:
     description = None
     process = None
-
-    def get_active_lore(self, messages:list, lorebook:dict) -> str:
-        if len(lorebook.get('entries', [])) == 0:
-            return
-        messages_to_scan = messages[-lorebook.get('scan_depth', 100):]
-        messages_str = '\n'.join([m.get('content') for m in messages_to_scan if m.get('role') != 'system'])
-        active_lore_content = []
-
-        for entry in lorebook.get('entries'):
-            for key in entry.get('keys', []):
-                clean_key = key.strip()
-                if clean_key:
-                    pattern = rf"\b{re.escape(clean_key)}\b"
-                    if re.search(pattern, messages_str, flags=re.IGNORECASE):
-                        content = '# {}\n\n{}'.format(clean_key.title(), entry.get('content', ''))
-                        if content not in active_lore_content:
-                            active_lore_content.append(content)
-                        break
-
-        return '\n\n---\n\n'.join(active_lore_content)
+    async_client = None
+    model_digests = {}
 
     def prepare_chat(self, bot_message, model:str):
         chat_element = bot_message.get_ancestor(chat.Chat)
@@ -49,7 +32,17 @@ class BaseInstance:
             chat_element.busy = True
             GLib.idle_add(chat_element.set_visible_child_name, 'content')
 
-        messages = chat_element.convert_to_ollama()[:list(chat_element.container).index(bot_message)]
+        index = chat_element.get_messages().index(bot_message)
+        ratio = context.get_ratio(self.instance_id, model)
+        system_prompt = (self.get_model_info(model) or {}).get('system') or ''
+        messages, chat_element.context_usage = context.fit(
+            summaries.with_summary(lambda compact_before: chat_element.convert_to_ollama(compact_before)[:index], chat_element),
+            num_ctx = self.properties.get('num_ctx', 0) if self.properties.get('override_parameters') else 0,
+            max_turns = self.properties.get('context_turns', 0),
+            ratio = ratio,
+            reserved = int(len(system_prompt) / ratio),
+            trim = self.properties.get('fit_context', False)
+        )
 
         character_dict = SQL.get_model_preferences(model).get('character', {})
         if character_dict.get('data', {}).get('extensions', {}).get('com.jeffser.Alpaca', {}).get('enabled', False):
@@ -57,51 +50,46 @@ class BaseInstance:
             if len(character_book.get('entries', [])) > 0:
                 lore_message = {
                     'role': 'system',
-                    'content': self.get_active_lore(messages, character_book)
+                    'content': lore.get_active_lore(model, chat_element.chat_id, messages, character_book)
                 }
                 if lore_message.get('content'):
-                    index = 0
-                    for msg in messages:
-                        if msg.get('role') == 'system':
-                            index += 1
-                        else:
-                            break
-                    messages.insert(index, lore_message)
+                    # Lore changes between turns, keeping it out of the prefix lets the server reuse its cache
+                    prompt.insert_volatile(messages, lore_message)
+                    chat_element.context_usage['tokens'] += context.estimate_tokens([lore_message], ratio)
 
+        GLib.idle_add(chat_element.show_context_usage)
         return chat_element, messages
 
     def generate_message(self, bot_message, model:str):
-        chat, messages = self.prepare_chat(bot_message, model)
-
-        if chat.chat_id and chat.get_name().startswith(_("New Chat")):
-            threading.Thread(
-                target=self.generate_chat_title,
-                args=(
-                    chat,
-                    messages[-1].get('content'),
-                    model
-                ),
-                daemon=True
-            ).start()
-        self.generate_response(bot_message, chat, messages, model)
+        generation = engine.Generation(bot_message, bot_message.get_ancestor(chat.Chat))
+        engine.submit(generation, self.run_generation(generation, model))
 
     def use_tools(self, bot_message, model:str, available_tools:dict):
-        chat, messages = self.prepare_chat(bot_message, model)
-
-        if chat.chat_id and chat.get_name().startswith(_("New Chat")):
-            threading.Thread(
-                target=self.generate_chat_title,
-                args=(
-                    chat,
-                    messages[-1].get('content'),
-                    model
-                ),
-                daemon=True
-            ).start()
-
-        self.generate_response(bot_message, chat, messages, model, available_tools=available_tools)
-
-    def generate_response(self, bot_message, chat, messages:list, model:str, available_tools:dict={}):
+        generation = engine.Generation(bot_message, bot_message.get_ancestor(chat.Chat))
+        engine.submit(generation, self.run_generation(generation, model, available_tools))
+
+    async def run_generation(self, generation, model:str, available_tools:dict={}):
+        generation.set_state(engine.PREPARING)
+        chat, messages = await engine.run_blocking(self.prepare_chat, generation.bot_message, model)
+
+        title_prompt = messages[-1].get('content')
+        needs_title = chat.chat_id and chat.get_name().startswith(_("New Chat"))
+        if needs_title:
+            GLib.idle_add(titles.set_placeholder, chat, title_prompt)
+
+        try:
+            await self.generate_response(generation, chat, messages, model, available_tools=available_tools)
+        finally:
+            # The title waits for the response so both don't compete for the model
+            if needs_title:
+                titles.request_title(self, chat, title_prompt, model)
+        if not needs_title and generation.state != engine.FAILED:
+            titles.flush_pending(self)
+        if generation.state != engine.FAILED:
+            summaries.request_summary(self, chat, model)
+
+    async def generate_response(self, generation, chat, messages:list, model:str, available_tools:dict={}):
+        bot_message = generation.bot_message
         if self.properties.get('share_name', 0) > 0:
             user_display_name = None
             if self.properties.get('share_name') == 1:
@@ -117,7 +105,7 @@ class BaseInstance:
                     'content': 'The user is called {}'.format(user_display_name)
                 })
 
-        model_info = self.get_model_info(model)
+        model_info = await engine.run_blocking(self.get_model_info, model)
         if model_info:
             if model_info.get('system'):
                 messages.insert(0, {
@@ -125,11 +113,13 @@ class BaseInstance:
                     'content': model_info.get('system')
                 })
 
+        keep_alive_policy.record_use(self, model)
+        keep_alive = await engine.run_blocking(keep_alive_policy.get_keep_alive, self, model)
         params = {
             "model": model,
             "stream": True,
-            "think": self.properties.get('think', False) and 'thinking' in model_info.get('capabilities', []),
-            "keep_alive": self.properties.get('keep_alive', 300),
+            "think": self.properties.get('think', False) and 'thinking' in (model_info.get('capabilities') or []),
+            "keep_alive": keep_alive,
             "tools": [v.get_metadata() for v in available_tools.values()]
         }
 
@@ -140,47 +130,96 @@ class BaseInstance:
             if self.properties.get('seed', 0) != 0:
                 params["options"]["seed"] = self.properties.get('seed')
 
-        metadata_string = ""
         thought = ""
         content = ""
         try:
             bot_message.block_container.clear()
-            while chat.busy:
+            load_saved = warmup.claim(self, model)
+            priority = engine.INTERACTIVE
+            while True:
                 tool_calls = []
                 params['messages'] = messages
-                response = self.client.chat(**params)
-                for chunk in response:
-                    if chunk.message.thinking:
-                        bot_message.update_thinking(chunk.message.thinking)
-                        thought += chunk.message.thinking
-                    if chunk.message.content:
-                        bot_message.update_message(chunk.message.content)
-                        content += chunk.message.content
-                    if chunk.message.tool_calls:
-                        tool_calls.extend(chunk.message.tool_calls)
-
-                    if chunk.done or not chat.busy:
-                        data = {
-                            'total_duration': chunk.total_duration,
-                            'load_duration': chunk.load_duration,
-                            'prompt_eval_count': chunk.prompt_eval_count,
-                            'prompt_eval_duration': chunk.prompt_eval_duration,
-                            'eval_count': chunk.eval_count,
-                            'eval_duration': chunk.eval_duration
-                        }
-                        metadata_string = dict_to_metadata_string(data)
+                cache_key = None
+                if priority == engine.INTERACTIVE and response_cache.is_enabled(self):
+                    # Only the first request, the ones after tool calls depend on what the tools returned
+                    cache_key = response_cache.get_key(self, model, self.get_model_digest(model), {k: v for k, v in params.items() if k not in ('stream', 'keep_alive')})
+                    cached = await engine.run_blocking(response_cache.lookup, cache_key)
+                    if cached:
+                        try:
+                            await response_cache.replay(self, generation, model, cached)
+                        finally:
+                            GLib.idle_add(bot_message.remove_and_attach_thought)
                         break
-
-                GLib.idle_add(bot_message.remove_and_attach_thought)
-
-                if not tool_calls or not chat.busy:
+                prefix_stats = prompt.measure_shared_prefix(self.instance_id, chat.chat_id, messages)
+                recorder = None
+                try:
+                    # Tools run outside of the slot, the follow up request queues behind other chats
+                    async with self.get_scheduler().slot(priority, chat.chat_id, 'Response in {}'.format(chat.get_name())) as ticket:
+                        recorder = telemetry.Recorder(self, model, ticket=ticket)
+                        if cache_key:
+                            recorder.add_details(cache='miss')
+                        generation.set_state(engine.STREAMING)
+                        async with contextlib.aclosing(await self.get_async_client().chat(**params)) as response:
+                            async for chunk in response:
+                                if chunk.message.thinking or chunk.message.content or chunk.message.tool_calls:
+                                    recorder.chunk()
+                                if chunk.message.thinking:
+                                    bot_message.update_thinking(chunk.message.thinking)
+                                    thought += chunk.message.thinking
+                                if chunk.message.content:
+                                    bot_message.update_message(chunk.message.content)
+                                    content += chunk.message.content
+                                if chunk.message.tool_calls:
+                                    tool_calls.extend(chunk.message.tool_calls)
+
+                                if chunk.done:
+                                    if not prefix_stats.get('shared_messages') and not any(m.get('images') for m in messages):
+                                        # Without a reused prefix the whole prompt was evaluated
+                                        context.calibrate(self.instance_id, model, prefix_stats.get('total_characters'), chunk.prompt_eval_count)
+                                    shared_prefix = prefix_stats.get('shared_characters') / max(1, prefix_stats.get('total_characters'))
+                                    prompt_eval_saved = prompt.estimate_prompt_eval_saved(prefix_stats, chunk.prompt_eval_count, chunk.prompt_eval_duration, context.get_ratio(self.instance_id, model))
+                                    recorder.set_ollama_stats(chunk)
+                                    recorder.add_details(shared_prefix=shared_prefix, prompt_eval_saved=prompt_eval_saved / 10**9, keep_alive=keep_alive)
+                                    if load_saved:
+                                        recorder.add_details(load_saved=load_saved)
+                                        load_saved = 0
+                                    if self.properties.get('show_response_metadata'):
+                                        generation.response_metadata = dict_to_metadata_string({
+                                            'total_duration': chunk.total_duration,
+                                            'load_duration': chunk.load_duration,
+                                            'prompt_eval_count': chunk.prompt_eval_count,
+                                            'prompt_eval_duration': chunk.prompt_eval_duration,
+                                            'eval_count': chunk.eval_count,
+                                            'eval_duration': chunk.eval_duration,
+                                            'shared_prefix': shared_prefix,
+                                            'prompt_eval_saved': prompt_eval_saved
+                                        })
+                                    break
+                    recorder.finish(engine.FINISHED)
+                except BaseException:
+                    if recorder:
+                        recorder.finish(engine.CANCELLED if generation.token.is_cancelled() else engine.FAILED)
+                    raise
+                finally:
+                    GLib.idle_add(bot_message.remove_and_attach_thought)
+
+                if not tool_calls:
+                    if cache_key:
+                        response_cache.store(self, cache_key, {
+                            'thinking': thought,
+                            'content': content,
+                            'completion_tokens': recorder.values.get('completion_tokens')
+                        })
                     break
 
+                priority = engine.TOOL
+                generation.set_state(engine.RUNNING_TOOLS)
                 messages.append({'role': 'assistant', 'thinking': thought, 'content': content, 'tool_calls': tool_calls})
 
                 for call in tool_calls:
                     selected_tool = available_tools.get(call.function.name)
-                    tool_response = selected_tool.run(
+                    tool_response = await engine.run_blocking(
+                        selected_tool.run,
                         call.function.arguments,
                         messages,
                         bot_message
@@ -212,11 +251,12 @@ class BaseInstance:
                     GLib.idle_add(add_attachment)
 
         except ollama.ResponseError as e:
+            generation.set_state(engine.FAILED)
             logger.error(e)
             if e.status_code == 401:
                 if self.instance_type == 'ollama:managed':
                     with open(os.path.join(data_dir, '.ollama', 'id_ed25519'), 'rb') as f:
-                        signin_url = self.signin_request()
+                        signin_url = await engine.run_blocking(self.signin_request)
                         attachment = bot_message.add_attachment(
                             file_id = generate_uuid(),
                             name = 'Ollama Login',
@@ -236,6 +276,7 @@ class BaseInstance:
                     )
                     bot_message.update_message("🦙 Just a quick heads-up! To access the Ollama cloud models, you'll need to log into your Ollama account first from the server.")
         except Exception as e:
+            generation.set_state(engine.FAILED)
             if self.instance_type != 'ollama:managed' or is_ollama_installed():
                 dialog.simple_error(
                     parent = bot_message.get_root(),
@@ -247,19 +288,41 @@ class BaseInstance:
             if self.row:
                 GLib.idle_add(self.row.get_parent().unselect_all)
 
-        if not self.properties.get('show_response_metadata'):
-            metadata_string = None
-        bot_message.finish_generation(metadata_string)
-
-    def generate_chat_title(self, chat, prompt:str, fallback_model:str):
-        if not chat.row or not chat.row.get_parent():
-            return
-        model = self.get_title_model()
+    async def warm_up(self, model:str) -> float:
+        # Loads the model with an empty chat, returns the seconds it took or None if it was already loaded
+        client = self.get_async_client()
+        if model in [m.model for m in (await client.ps()).models]:
+            return None
+        started = time.monotonic()
+        keep_alive = await engine.run_blocking(keep_alive_policy.get_keep_alive, self, model)
+        response = await client.chat(model=model, messages=[], keep_alive=keep_alive)
+        return response.load_duration / 10**9 if response.load_duration else time.monotonic() - started
+
+    def get_title_plan(self, chat_model:str) -> tuple:
+        # Returns the model and keep_alive for a title without unloading or swapping out the chat model
+        title_model = self.get_title_model() or chat_model
+        if 'keep_alive' not in self.properties:
+            return title_model, None
+        if title_model == chat_model:
+            return title_model, keep_alive_policy.get_keep_alive(self, title_model)
+        try:
+            loaded_models = [m.model for m in self.client.ps().models]
+        except Exception as e:
+            logger.error(e)
+            loaded_models = []
+        if title_model in loaded_models:
+            return title_model, keep_alive_policy.get_keep_alive(self, title_model)
+        if chat_model in loaded_models:
+            return chat_model, keep_alive_policy.get_keep_alive(self, chat_model)
+        return title_model, 0
+
+    def generate_chat_title(self, chat, prompt:str, fallback_model:str, priority:int=engine.TITLE) -> str:
+        model, keep_alive = self.get_title_plan(fallback_model)
         params = {
             "options": {
                 "temperature": 0.2
             },
-            "model": model or fallback_model,
+            "model": model,
             "stream": False,
             "messages": [
                 {
@@ -279,25 +342,50 @@ class BaseInstance:
                 ]
             },
             'think': False,
-            "keep_alive": 0
+            "keep_alive": keep_alive
         }
         if self.properties.get("override_parameters"):
             params["options"]["num_ctx"] = self.properties.get('num_ctx', 16384)
-        try:
+        with self.get_scheduler().blocking_slot(priority, chat.chat_id, 'Title for {}'.format(chat.get_name())) as ticket:
+            recorder = telemetry.Recorder(self, model, 'title', ticket)
             response = self.client.chat(**params)
-            data = json.loads(response.message.content or '{"title": "New Chat"}')
-            generated_title = data.get('title').replace('\n', '').strip()
-
-            if len(generated_title) > 30:
-                generated_title = generated_title[:30].strip() + '...'
+        recorder.set_ollama_stats(response)
+        recorder.finish(engine.FINISHED)
+        try:
+            return json.loads(response.message.content or '{}').get('title', '')
+        except (ValueError, AttributeError):
+            # Models that ignore the format answer with the title itself
+            return response.message.content
 
-            GLib.idle_add(
-                chat.row.edit,
-                generated_title,
-                chat.is_template
-            )
-        except Exception as e:
-            logger.exception(e)
+    def generate_summary(self, chat, prompt:str, fallback_model:str, priority:int=engine.BATCH) -> str:
+        model, keep_alive = self.get_title_plan(fallback_model)
+        params = {
+            "options": {
+                "temperature": 0.2
+            },
+            "model": model,
+            "stream": False,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": SUMMARY_GENERATION_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            'think': False,
+            "keep_alive": keep_alive
+        }
+        if self.properties.get("override_parameters"):
+            params["options"]["num_ctx"] = self.properties.get('num_ctx', 16384)
+        with self.get_scheduler().blocking_slot(priority, chat.chat_id, 'Summary of {}'.format(chat.get_name())) as ticket:
+            recorder = telemetry.Recorder(self, model, 'summary', ticket)
+            response = self.client.chat(**params)
+        recorder.set_ollama_stats(response)
+        recorder.finish(engine.FINISHED)
+        return response.message.content or ''
 
     def get_default_model(self):
         local_models = self.get_local_models()
@@ -315,6 +403,7 @@ class BaseInstance:
 
     def stop(self):
         self.client = None
+        self.async_client = None
 
     def start(self):
         if not self.client:
@@ -326,7 +415,27 @@ class BaseInstance:
                 verify=not self.properties.get('allow_self_signed_ssl', False)
             )
 
+    def get_scheduler(self) -> engine.Scheduler:
+        scheduler = engine.get_scheduler(self.instance_id)
+        scheduler.set_limit(self.properties.get('num_parallel', 1))
+        return scheduler
+
+    def get_async_client(self) -> ollama.AsyncClient:
+        # Only used from the generation engine loop, its connections belong to that loop
+        if not self.async_client:
+            self.async_client = ollama.AsyncClient(
+                host=self.properties.get('url'),
+                headers={
+                    'Authorization': 'Bearer {}'.format(self.properties.get('api'))
+                },
+                verify=not self.properties.get('allow_self_signed_ssl', False)
+            )
+        return self.async_client
+
     def get_local_models(self) -> list:
+        return model_cache.get_local_models(self)
+
+    def fetch_local_models(self, quiet:bool=False) -> list:
         try:
             model_list = []
 
@@ -339,20 +448,24 @@ class BaseInstance:
                     'details': m.details
                 })
 
+            self.model_digests = {m.get('name'): m.get('digest') for m in model_list}
+            model_cache.prefetch(self, list(self.model_digests))
             return model_list
 
         except Exception as e:
-            if self.instance_type != 'ollama:managed' or is_ollama_installed():
-                dialog.simple_error(
-                    parent = self.row.get_root() if self.row else None,
-                    title = _('Instance Error'),
-                    body = _('Could not retrieve added models'),
-                    error_log = str(e)
-                )
-                logger.exception(e)
-            if self.row:
-                GLib.idle_add(self.row.get_parent().unselect_all)
-        return []
+            if quiet:
+                logger.error(e)
+            else:
+                if self.instance_type != 'ollama:managed' or is_ollama_installed():
+                    dialog.simple_error(
+                        parent = self.row.get_root() if self.row else None,
+                        title = _('Instance Error'),
+                        body = _('Could not retrieve added models'),
+                        error_log = str(e)
+                    )
+                    logger.exception(e)
+                if self.row:
+                    GLib.idle_add(self.row.get_parent().unselect_all)
 
     def get_available_models(self) -> dict:
         try:
@@ -368,10 +481,16 @@ class BaseInstance:
                 logger.exception(e)
         return {}
 
+    def get_model_digest(self, model_name:str) -> str:
+        return self.model_digests.get(model_name, '')
+
     def get_model_info(self, model_name:str) -> dict:
+        return model_cache.get_model_info(self, model_name)
+
+    def fetch_model_info(self, model_name:str) -> dict:
         try:
             response = self.client.show(model_name)
-            return response
+            return response.model_dump(mode='json')
         except Exception as e:
             logger.error(e)
         return {}
@@ -390,6 +509,8 @@ class BaseInstance:
                 if chunk.total and chunk.completed:
                     model.update_progressbar(chunk.completed / chunk.total)
                 if chunk.status == 'success':
+                    model_cache.invalidate(self, model.get_name())
+                    model_cache.invalidate_local_models(self)
                     model.update_progressbar(-1)
                     break
         except Exception as e:
@@ -423,6 +544,8 @@ class BaseInstance:
                 if chunk.total and chunk.completed:
                     model.update_progressbar(chunk.completed / chunk.total)
                 if chunk.status == 'success':
+                    model_cache.invalidate(self, model.get_name())
+                    model_cache.invalidate_local_models(self)
                     model.update_progressbar(-1)
                     break
         except Exception as e:
@@ -432,6 +555,8 @@ class BaseInstance:
     def delete_model(self, model_name:str):
         try:
             response = self.client.delete(model_name)
+            model_cache.invalidate(self, model_name)
+            model_cache.invalidate_local_models(self)
             return response.status == 'success'
         except Exception as e:
             logger.error(e)
@@ -448,8 +573,10 @@ class OllamaManaged(BaseInstance):
         'override_parameters': True,
         'temperature': 0.7,
         'seed': 0,
+        'cache_responses': False,
         'num_ctx': 16384,
         'keep_alive': 300,
+        'adaptive_keep_alive': False,
         'model_directory': os.path.join(data_dir, '.ollama', 'models'),
         'default_model': None,
         'title_model': None,
@@ -463,7 +590,11 @@ class OllamaManaged(BaseInstance):
         'think': False,
         'expose': False,
         'share_name': 0,
-        'show_response_metadata': False
+        'show_response_metadata': False,
+        'num_parallel': 1,
+        'fit_context': True,
+        'context_turns': 0,
+        'summarize_context': False
     }
 
     def __init__(self, instance_id:str, properties:dict):
@@ -561,6 +692,7 @@ class OllamaManaged(BaseInstance):
                 self.log_raw += '\nOllama stopped by Alpaca\n'
                 logger.info("Stopped Alpaca's Ollama instance")
         self.client = None
+        self.async_client = None
 
     def start(self):
         if not self.process:
@@ -570,6 +702,7 @@ class OllamaManaged(BaseInstance):
                 params["HOME"] = data_dir
                 params["OLLAMA_HOST"] = self.properties.get('url')
                 params["OLLAMA_MODELS"] = self.properties.get('model_directory')
+                params["OLLAMA_NUM_PARALLEL"] = str(int(self.properties.get('num_parallel', 1)))
                 if self.properties.get("expose"):
                     params["OLLAMA_ORIGINS"] = "chrome-extension://*,moz-extension://*,safari-web-extension://*,http://0.0.0.0,http://127.0.0.1"
                 else:
@@ -632,14 +765,20 @@ class Ollama(BaseInstance):
         'override_parameters': True,
         'temperature': 0.7,
         'seed': 0,
+        'cache_responses': False,
         'num_ctx': 16384,
         'keep_alive': 300,
+        'adaptive_keep_alive': False,
         'default_model': None,
         'title_model': None,
         'think': False,
         'share_name': 0,
         'show_response_metadata': False,
-        'allow_self_signed_ssl': False
+        'allow_self_signed_ssl': False,
+        'num_parallel': 1,
+        'fit_context': True,
+        'context_turns': 0,
+        'summarize_context': False
     }
 
     def __init__(self, instance_id:str, properties:dict):
@@ -655,6 +794,7 @@ class OllamaCloud(BaseInstance):
     instance_type = 'ollama:cloud'
     instance_type_display = _('Ollama (Cloud)')
     description = _('Online instance directly managed by Ollama (Experimental)')
+    warm_up = None # Cloud models are always loaded
 
     default_properties = {
         'name': _('Instance'),
@@ -663,12 +803,17 @@ class OllamaCloud(BaseInstance):
         'override_parameters': True,
         'temperature': 0.7,
         'seed': 0,
+        'cache_responses': False,
         'num_ctx': 16384,
         'default_model': None,
         'title_model': None,
         'think': False,
         'share_name': 0,
-        'show_response_metadata': False
+        'show_response_metadata': False,
+        'num_parallel': 4,
+        'fit_context': True,
+        'context_turns': 0,
+        'summarize_context': False
     }
 
     def __init__(self, instance_id:str, properties:dict):
@@ -682,13 +827,17 @@ class OllamaCloud(BaseInstance):
 
     def pull_model(self, model):
         SQL.append_online_instance_model_list(self.instance_id, model.get_name())
+        model_cache.invalidate(self, model.get_name())
+        model_cache.invalidate_local_models(self)
         GLib.timeout_add(5000, lambda: model.update_progressbar(-1) and False)
 
     def delete_model(self, model_name:str) -> bool:
         SQL.remove_online_instance_model_list(self.instance_id, model_name)
+        model_cache.invalidate(self, model_name)
+        model_cache.invalidate_local_models(self)
         return True
 
-    def get_local_models(self) -> list:
+    def fetch_local_models(self, quiet:bool=False) -> list:
         local_models = []
         for model in SQL.get_online_instance_model_list(self.instance_id):
             local_models.append({'name': model})
@@ -2,12 +2,13 @@
 
 from gi.repository import Adw, GLib
 
-import openai, requests, json, logging, threading, re
+import openai, requests, json, logging, asyncio
 from pydantic import BaseModel
 
+from . import engine, model_cache, prompt, titles, context, summaries, lore, telemetry, response_cache
 from .. import dialog, tools, chat
 from ...sql_manager import generate_uuid, Instance as SQL
-from ...constants import MAX_TOKENS_TITLE_GENERATION, TITLE_GENERATION_PROMPT_OPENAI
+from ...constants import MAX_TOKENS_TITLE_GENERATION, TITLE_GENERATION_PROMPT_OPENAI, SUMMARY_GENERATION_PROMPT
 
 logger = logging.getLogger(__name__)
 
@@ -24,8 +25,12 @@ class BaseInstance:
         'override_parameters': True,
         'temperature': 0.7,
         'seed': 0,
+        'cache_responses': False,
         'default_model': None,
-        'title_model': None
+        'title_model': None,
+        'num_parallel': 4,
+        'context_turns': 0,
+        'summarize_context': False
     }
 
     def __init__(self, instance_id:str, properties:dict):
@@ -40,39 +45,35 @@ class BaseInstance:
         self.properties['url'] = self.instance_url
 
         self.client = None
+        self.async_client = None
+        self.stream_usage = True # Turned off for servers that reject stream_options
 
     def stop(self):
         self.client = None
+        self.async_client = None
+
+    def get_client_arguments(self) -> dict:
+        arguments = {
+            'api_key': self.properties.get('api')
+        }
+        if self.instance_type != 'chatgpt':
+            arguments['base_url'] = self.properties.get('url').strip()
+        return arguments
 
     def start(self):
         if not self.client:
-            arguments = {
-                'api_key': self.properties.get('api')
-            }
-            if self.instance_type != 'chatgpt':
-                arguments['base_url'] = self.properties.get('url').strip()
-
-            self.client = openai.OpenAI(**arguments)
-
-    def get_active_lore(self, messages:list, lorebook:dict) -> str:
-        if len(lorebook.get('entries', [])) == 0:
-            return
-        messages_to_scan = messages[-lorebook.get('scan_depth', 100):]
-        messages_str = '\n'.join([m.get('content') for m in messages_to_scan if m.get('role') != 'system'])
-        active_lore_content = []
-
-        for entry in lorebook.get('entries'):
-            for key in entry.get('keys', []):
-                clean_key = key.strip()
-                if clean_key:
-                    pattern = rf"\b{re.escape(clean_key)}\b"
-                    if re.search(pattern, messages_str, flags=re.IGNORECASE):
-                        content = '# {}\n\n{}'.format(clean_key.title(), entry.get('content', ''))
-                        if content not in active_lore_content:
-                            active_lore_content.append(content)
-                        break
-
-        return '\n\n---\n\n'.join(active_lore_content)
+            self.client = openai.OpenAI(**self.get_client_arguments())
+
+    def get_scheduler(self) -> engine.Scheduler:
+        scheduler = engine.get_scheduler(self.instance_id)
+        scheduler.set_limit(self.properties.get('num_parallel', 4))
+        return scheduler
+
+    def get_async_client(self) -> openai.AsyncOpenAI:
+        # Only used from the generation engine loop, its connections belong to that loop
+        if not self.async_client:
+            self.async_client = openai.AsyncOpenAI(**self.get_client_arguments())
+        return self.async_client
 
     def prepare_chat(self, bot_message, model:str):
         chat_element = bot_message.get_ancestor(chat.Chat)
@@ -87,7 +88,14 @@ class BaseInstance:
             chat_element.busy = True
             GLib.idle_add(chat_element.set_visible_child_name, 'content')
 
-        messages = chat_element.convert_to_json()[:list(chat_element.container).index(bot_message)]
+        index = chat_element.get_messages().index(bot_message)
+        ratio = context.get_ratio(self.instance_id, model)
+        # The context window of online models isn't known, only the number of turns is limited
+        messages, chat_element.context_usage = context.fit(
+            summaries.with_summary(lambda compact_before: chat_element.convert_to_json(compact_before=compact_before)[:index], chat_element),
+            max_turns = self.properties.get('context_turns', 0),
+            ratio = ratio
+        )
 
         character_dict = SQL.get_model_preferences(model).get('character', {})
         if character_dict.get('data', {}).get('extensions', {}).get('com.jeffser.Alpaca', {}).get('enabled', False):
@@ -95,63 +103,69 @@ class BaseInstance:
             if len(character_book.get('entries', [])) > 0:
                 lore_message = {
                     'role': 'system',
-                    'content': self.get_active_lore(messages, character_book)
+                    'content': lore.get_active_lore(model, chat_element.chat_id, messages, character_book)
                 }
                 if lore_message.get('content'):
-                    index = 0
-                    for msg in messages:
-                        if msg.get('role') == 'system':
-                            index += 1
-                        else:
-                            break
-                    messages.insert(index, lore_message)
+                    # Lore changes between turns, keeping it out of the prefix lets the server reuse its cache
+                    prompt.insert_volatile(messages, lore_message)
+                    chat_element.context_usage['tokens'] += context.estimate_tokens([lore_message], ratio)
 
+        GLib.idle_add(chat_element.show_context_usage)
         return chat_element, messages
 
     def generate_message(self, bot_message, model:str):
-        chat, messages = self.prepare_chat(bot_message, model)
+        generation = engine.Generation(bot_message, bot_message.get_ancestor(chat.Chat))
+        engine.submit(generation, self.run_generation(generation, model))
 
-        if chat.chat_id and chat.get_name().startswith(_("New Chat")):
-            threading.Thread(
-                target=self.generate_chat_title,
-                args=(
-                    chat,
-                    messages[-1].get('content'),
-                    model
-                ),
-                daemon=True
-            ).start()
+    def use_tools(self, bot_message, model:str, available_tools:dict):
+        generation = engine.Generation(bot_message, bot_message.get_ancestor(chat.Chat))
+        engine.submit(generation, self.run_generation(generation, model, available_tools))
 
-        self.generate_response(bot_message, chat, messages, model)
+    async def run_generation(self, generation, model:str, available_tools:dict={}):
+        generation.set_state(engine.PREPARING)
+        chat, messages = await engine.run_blocking(self.prepare_chat, generation.bot_message, model)
 
-    def use_tools(self, bot_message, model:str, available_tools:dict):
-        chat, messages = self.prepare_chat(bot_message, model)
-
-        if chat.chat_id and chat.get_name().startswith(_("New Chat")):
-            threading.Thread(
-                target=self.generate_chat_title,
-                args=(
-                    chat,
-                    messages[-1].get('content'),
-                    model
-                ),
-                daemon=True
-            ).start()
+        title_prompt = prompt.get_text(messages[-1])
+        needs_title = chat.chat_id and chat.get_name().startswith(_("New Chat"))
+        if needs_title:
+            GLib.idle_add(titles.set_placeholder, chat, title_prompt)
 
         try:
-            completion = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                tools=[v.get_metadata() for v in available_tools.values()]
-            )
+            if len(available_tools) > 0:
+                await self.run_tools(generation, chat, messages, model, available_tools)
+            # Tools were asked for, the response depends on what they returned
+            await self.generate_response(generation, chat, messages, model, cacheable=len(available_tools) == 0)
+        finally:
+            # The title waits for the response so both don't compete for the model
+            if needs_title:
+                titles.request_title(self, chat, title_prompt, model)
+        if not needs_title and generation.state != engine.FAILED:
+            titles.flush_pending(self)
+        if generation.state != engine.FAILED:
+            summaries.request_summary(self, chat, model)
+
+    async def run_tools(self, generation, chat, messages:list, model:str, available_tools:dict):
+        bot_message = generation.bot_message
+        try:
+            async with self.get_scheduler().slot(engine.TOOL, chat.chat_id, 'Tool call in {}'.format(chat.get_name())) as ticket:
+                generation.set_state(engine.STREAMING)
+                recorder = telemetry.Recorder(self, model, 'tools', ticket)
+                completion = await self.get_async_client().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    tools=[v.get_metadata() for v in available_tools.values()]
+                )
+            recorder.set_openai_usage(completion.usage)
+            recorder.finish(engine.FINISHED)
             if completion.choices[0] and completion.choices[0].message:
                 if completion.choices[0].message.tool_calls:
+                    generation.set_state(engine.RUNNING_TOOLS)
                     for call in completion.choices[0].message.tool_calls:
                         # Parse arguments once
                         arguments = json.loads(call.function.arguments)
                         
                         if available_tools.get(call.function.name):
-                            tool_response = available_tools.get(call.function.name).run(arguments, messages, bot_message)
+                            tool_response = await engine.run_blocking(available_tools.get(call.function.name).run, arguments, messages, bot_message)
 
                             attachment_content = []
 
@@ -193,9 +207,8 @@ class BaseInstance:
             )
             logger.exception(e)
 
-        self.generate_response(bot_message, chat, messages, model)
-
-    def generate_response(self, bot_message, chat, messages:list, model:str):
+    async def generate_response(self, generation, chat, messages:list, model:str, cacheable:bool=True):
+        bot_message = generation.bot_message
         if 'no-system-messages' in self.limitations:
             for i in range(len(messages)):
                 if messages[i].get('role') == 'system':
@@ -210,6 +223,10 @@ class BaseInstance:
             "messages": messages,
             "stream": True
         }
+        if self.stream_usage:
+            params["stream_options"] = {
+                "include_usage": True
+            }
 
         if self.properties.get('max_tokens', 0) > 0:
             if 'use_max_completion_tokens' in self.limitations:
@@ -222,30 +239,70 @@ class BaseInstance:
             if self.properties.get('seed', 0) != 0:
                 params["seed"] = self.properties.get('seed')
 
-        if chat.busy:
-            try:
+        cache_key = None
+        if cacheable and 'tools' not in params and response_cache.is_enabled(self):
+            cache_key = response_cache.get_key(self, model, None, {k: v for k, v in params.items() if k not in ('stream', 'stream_options')})
+            cached = await engine.run_blocking(response_cache.lookup, cache_key)
+            if cached:
                 bot_message.block_container.clear()
-                response = self.client.chat.completions.create(**params)
-                for chunk in response:
-                    if chunk.choices and chunk.choices[0].delta:
-                        delta = chunk.choices[0].delta
-                        if delta.content:
-                            bot_message.update_message(delta.content)
-                    if not chat.busy:
-                        break
-            except Exception as e:
-                dialog.simple_error(
-                    parent = bot_message.get_root(),
-                    title = _('Instance Error'),
-                    body = _('Message generation failed'),
-                    error_log = str(e)
-                )
-                logger.exception(e)
-                if self.row:
-                    GLib.idle_add(self.row.get_parent().unselect_all)
-        bot_message.finish_generation()
+                await response_cache.replay(self, generation, model, cached)
+                return
+
+        prompt.measure_shared_prefix(self.instance_id, chat.chat_id, messages)
+        recorder = None
+        content = ""
+        try:
+            async with self.get_scheduler().slot(engine.INTERACTIVE, chat.chat_id, 'Response in {}'.format(chat.get_name())) as ticket:
+                generation.set_state(engine.STREAMING)
+                recorder = telemetry.Recorder(self, model, ticket=ticket)
+                if cache_key:
+                    recorder.add_details(cache='miss')
+                bot_message.block_container.clear()
+                try:
+                    stream = await self.get_async_client().chat.completions.create(**params)
+                except openai.BadRequestError:
+                    if 'stream_options' not in params:
+                        raise
+                    # Usage is only for telemetry, servers that don't know the field still answer without it
+                    logger.info('Retrying without stream_options')
+                    self.stream_usage = False
+                    del params['stream_options']
+                    stream = await self.get_async_client().chat.completions.create(**params)
+                async with stream as response:
+                    async for chunk in response:
+                        if chunk.choices and chunk.choices[0].delta:
+                            delta = chunk.choices[0].delta
+                            if delta.content:
+                                recorder.chunk()
+                                bot_message.update_message(delta.content)
+                                content += delta.content
+                        # Sent as a last chunk without choices
+                        recorder.set_openai_usage(chunk.usage)
+            recorder.finish(engine.FINISHED)
+            if cache_key:
+                response_cache.store(self, cache_key, {
+                    'content': content,
+                    'completion_tokens': recorder.values.get('completion_tokens')
+                })
+        except asyncio.CancelledError:
+            if recorder:
+                recorder.finish(engine.CANCELLED)
+            raise
+        except Exception as e:
+            if recorder:
+                recorder.finish(engine.FAILED)
+            generation.set_state(engine.FAILED)
+            dialog.simple_error(
+                parent = bot_message.get_root(),
+                title = _('Instance Error'),
+                body = _('Message generation failed'),
+                error_log = str(e)
+            )
+            logger.exception(e)
+            if self.row:
+                GLib.idle_add(self.row.get_parent().unselect_all)
 
-    def generate_chat_title(self, chat, prompt:str, fallback_model:str):
+    def generate_chat_title(self, chat, prompt:str, fallback_model:str, priority:int=engine.TITLE) -> str:
         class ChatTitle(BaseModel): # Pydantic
             title: str
             emoji: str = ""
@@ -261,31 +318,40 @@ class BaseInstance:
             "messages": messages,
             "max_tokens": MAX_TOKENS_TITLE_GENERATION
         }
-        new_chat_title = chat.get_name()
-
-        try:
-            completion = self.client.chat.completions.parse(**params, response_format=ChatTitle)
-            response = completion.choices[0].message
-            if response.parsed:
-                emoji = response.parsed.emoji if len(response.parsed.emoji) == 1 else ''
-                new_chat_title = '{} {}'.format(emoji, response.parsed.title)
-        except Exception as e:
+        with self.get_scheduler().blocking_slot(priority, chat.chat_id, 'Title for {}'.format(chat.get_name())) as ticket:
+            recorder = telemetry.Recorder(self, params.get('model'), 'title', ticket)
             try:
-                response = self.client.chat.completions.create(**params)
-                new_chat_title = str(response.choices[0].message.content)
+                completion = self.client.chat.completions.parse(**params, response_format=ChatTitle)
+                recorder.set_openai_usage(completion.usage)
+                recorder.finish(engine.FINISHED)
+                response = completion.choices[0].message
+                if response.parsed:
+                    emoji = response.parsed.emoji if len(response.parsed.emoji) == 1 else ''
+                    return '{} {}'.format(emoji, response.parsed.title).strip()
             except Exception as e:
-                logger.error(e)
-        
-        new_chat_title = re.sub(r'<think>.*?</think>', '', new_chat_title).strip()
-
-        if len(new_chat_title) > 30:
-            new_chat_title = new_chat_title[:30].strip() + '...'
+                # Providers without structured output, errors from this one are raised
+                response = self.client.chat.completions.create(**params)
+                recorder.set_openai_usage(response.usage)
+                recorder.finish(engine.FINISHED)
+                return str(response.choices[0].message.content)
+        return ''
 
-        GLib.idle_add(
-            chat.row.edit,
-            new_chat_title,
-            chat.is_template
-        )
+    def generate_summary(self, chat, prompt:str, fallback_model:str, priority:int=engine.BATCH) -> str:
+        model = self.get_title_model()
+        params = {
+            "temperature": 0.2,
+            "model": model if model else fallback_model,
+            "messages": [
+                {"role": "user" if 'no-system-messages' in self.limitations else "system", "content": SUMMARY_GENERATION_PROMPT},
+                {"role": "user", "content": prompt}
+            ]
+        }
+        with self.get_scheduler().blocking_slot(priority, chat.chat_id, 'Summary of {}'.format(chat.get_name())) as ticket:
+            recorder = telemetry.Recorder(self, params.get('model'), 'summary', ticket)
+            response = self.client.chat.completions.create(**params)
+        recorder.set_openai_usage(response.usage)
+        recorder.finish(engine.FINISHED)
+        return str(response.choices[0].message.content or '')
 
     def get_default_model(self):
         local_models = self.get_local_models()
@@ -323,9 +389,14 @@ class BaseInstance:
 
     def pull_model(self, model):
         SQL.append_online_instance_model_list(self.instance_id, model.get_name())
+        model_cache.invalidate(self, model.get_name())
+        model_cache.invalidate_local_models(self)
         GLib.timeout_add(5000, lambda: model.update_progressbar(-1) and False)
 
     def get_local_models(self) -> list:
+        return model_cache.get_local_models(self)
+
+    def fetch_local_models(self, quiet:bool=False) -> list:
         local_models = []
         for model in SQL.get_online_instance_model_list(self.instance_id):
             local_models.append({'name': model})
@@ -333,9 +404,17 @@ class BaseInstance:
 
     def delete_model(self, model_name:str) -> bool:
         SQL.remove_online_instance_model_list(self.instance_id, model_name)
+        model_cache.invalidate(self, model_name)
+        model_cache.invalidate_local_models(self)
         return True
 
+    def get_model_digest(self, model_name:str) -> str:
+        return ''
+
     def get_model_info(self, model_name:str) -> dict:
+        return model_cache.get_model_info(self, model_name)
+
+    def fetch_model_info(self, model_name:str) -> dict:
         return {}
 
 
@@ -378,7 +457,7 @@ class Gemini(BaseInstance):
                 GLib.idle_add(self.row.get_parent().unselect_all)
         return {}
 
-    def get_model_info(self, model_name:str) -> dict:
+    def fetch_model_info(self, model_name:str) -> dict:
         try:
             response = requests.get('https://generativelanguage.googleapis.com/v1beta/models/{}?key={}'.format(model_name, self.properties.get('api')))
             data = response.json()
@@ -578,7 +657,7 @@ class Mistral(BaseInstance):
     instance_url = 'https://api.mistral.ai/v1/'
     description = _('Mistral AI large language models')
 
-    def get_model_info(self, model_name:str) -> dict:
+    def fetch_model_info(self, model_name:str) -> dict:
         try:
             response = requests.get(
                 f'{self.instance_url}/models',
@@ -677,13 +756,12 @@ class SarvamAI(BaseInstance):
     instance_url = 'https://api.sarvam.ai/'
     description = 'Sarvam AI'
 
-    def start(self):
-        if not self.client:
-            self.client = openai.OpenAI(
-                api_key=self.properties.get('api'),
-                base_url=self.properties.get('url').strip(),
-                default_headers={"api-subscription-key": self.properties.get('api')}
-            )
+    def get_client_arguments(self) -> dict:
+        return {
+            'api_key': self.properties.get('api'),
+            'base_url': self.properties.get('url').strip(),
+            'default_headers': {"api-subscription-key": self.properties.get('api')}
+        }
 
 class AtlasCloud(BaseInstance):
     instance_type = 'atlascloud'
@@ -697,22 +775,21 @@ class Cloudflare(BaseInstance):
     instance_url = ''
     description = _('Enter credentials in the API Key field as: Account_ID:API_Key')
 
-    def start(self):
-        if not self.client:
-            # Get the text from the API Key field
-            api_prop = self.properties.get('api', '')
-            account_id = "ACCOUNT_ID"
-            api_key = api_prop
-            
-            # Split the string at the first colon
-            if ':' in api_prop:
-                account_id, api_key = api_prop.split(':', 1)
-            
-            # Connect using the extracted account_id and api_key
-            self.client = openai.OpenAI(
-                api_key=api_key or "NOKEY",
-                base_url=f"https://api.cloudflare.com/client/v4/accounts/{account_id}/ai/v1"
-            )
+    def get_client_arguments(self) -> dict:
+        # Get the text from the API Key field
+        api_prop = self.properties.get('api', '')
+        account_id = "ACCOUNT_ID"
+        api_key = api_prop
+        
+        # Split the string at the first colon
+        if ':' in api_prop:
+            account_id, api_key = api_prop.split(':', 1)
+        
+        # Connect using the extracted account_id and api_key
+        return {
+            'api_key': api_key or "NOKEY",
+            'base_url': f"https://api.cloudflare.com/client/v4/accounts/{account_id}/ai/v1"
+        }
 
     def get_available_models(self) -> dict:
         try:
@@ -785,7 +862,7 @@ class LlamaCpp(BaseInstance):
         self.instance_url = properties.get('url', '')
         super().__init__(instance_id, properties)
 
-    def get_model_info(self, model_name:str) -> dict:
+    def fetch_model_info(self, model_name:str) -> dict:
         try:
             response = requests.get(
                 f'{self.instance_url}/models',
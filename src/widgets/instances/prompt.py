@@ -0,0 +1,78 @@
+# prompt.py
+"""
+Prompt assembly helpers shared by every instance.
+Stable messages (model system prompt, user name, the chat's own system messages) stay
+at the start of the prompt and volatile ones (active lore) go right before the newest
+turn, so servers can reuse the cached prefix of the previous request.
+"""
+
+import hashlib, json, logging, threading
+
+logger = logging.getLogger(__name__)
+
+CHARACTERS_PER_TOKEN = 4
+
+previous_prompts = {} # (instance_id, chat_id) -> [(message hash, characters)]
+lock = threading.Lock()
+
+def insert_volatile(messages:list, message:dict) -> None:
+    # Right before the last user message, or at the end if there is none
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].get('role') == 'user':
+            messages.insert(i, message)
+            return
+    messages.append(message)
+
+def get_text(message:dict) -> str:
+    # OpenAI messages have a list of parts instead of a string
+    content = message.get('content')
+    if isinstance(content, list):
+        return ''.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content or ''
+
+def get_text_length(message:dict) -> int:
+    # Images are hashed but not counted, they don't turn into text tokens
+    return len(get_text(message))
+
+def get_message_signature(message:dict) -> tuple:
+    serialized = json.dumps(message, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest(), get_text_length(message)
+
+def measure_shared_prefix(instance_id:str, chat_id:str, messages:list) -> dict:
+    """
+    Compares the prompt with the previous one sent for the same chat and instance,
+    returns how many messages and characters they share from the start.
+    """
+    signatures = [get_message_signature(m) for m in messages]
+    with lock:
+        previous_signatures = previous_prompts.get((instance_id, chat_id), [])
+        previous_prompts[(instance_id, chat_id)] = signatures
+
+    shared_messages = 0
+    for previous, current in zip(previous_signatures, signatures):
+        if previous[0] != current[0]:
+            break
+        shared_messages += 1
+
+    stats = {
+        'shared_messages': shared_messages,
+        'total_messages': len(signatures),
+        'shared_characters': sum(s[1] for s in signatures[:shared_messages]),
+        'total_characters': sum(s[1] for s in signatures)
+    }
+    if previous_signatures:
+        logger.debug('Prompt shares {shared_messages}/{total_messages} messages ({shared_characters}/{total_characters} characters) with the previous request'.format(**stats))
+    return stats
+
+def estimate_prompt_eval_saved(stats:dict, prompt_eval_count:int, prompt_eval_duration:int, characters_per_token:float=CHARACTERS_PER_TOKEN) -> int:
+    """
+    Estimates the nanoseconds of prompt evaluation skipped thanks to the shared prefix,
+    using the speed the server reported for the tokens it did evaluate.
+    """
+    if not stats.get('shared_characters') or not prompt_eval_count or not prompt_eval_duration:
+        return 0
+    estimated_tokens = stats.get('total_characters') / characters_per_token
+    skipped_tokens = max(0, estimated_tokens - prompt_eval_count)
+    saved = int(skipped_tokens * prompt_eval_duration / prompt_eval_count)
+    logger.info('Prompt prefix reuse: {} of ~{} tokens evaluated, ~{:.2f}s saved'.format(prompt_eval_count, int(estimated_tokens), saved / 10**9))
+    return saved
@@ -0,0 +1,72 @@
+# response_cache.py
+"""
+Opt-in cache of deterministic responses.
+With a seed and temperature 0 the same request gives the same response, so regenerating
+or comparing replays the stored one instead of generating it again.
+Entries are keyed on a hash of everything that reaches the model and kept in the
+response_cache table, the least recently used ones are removed past its size limit.
+"""
+
+import asyncio, threading, logging, hashlib, json
+from . import engine, telemetry
+from ...sql_manager import Instance as SQL
+
+logger = logging.getLogger(__name__)
+
+REPLAY_CHUNK = 24 # characters per simulated chunk
+
+def is_enabled(instance) -> bool:
+    properties = instance.properties
+    return bool(
+        properties.get('cache_responses')
+        and properties.get('override_parameters')
+        and properties.get('temperature') == 0
+        and properties.get('seed', 0) != 0
+    )
+
+def get_key(instance, model:str, digest:str, request:dict) -> str:
+    # request holds the messages, options and tools exactly as they are sent
+    canonical = json.dumps({
+        'instance_id': instance.instance_id,
+        'model': model,
+        'digest': digest or '',
+        'request': request
+    }, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def lookup(key:str) -> dict:
+    try:
+        return SQL.get_response_cache(key)
+    except Exception as e:
+        logger.error(e)
+
+def store(instance, key:str, entry:dict) -> None:
+    # Responses cut short aren't worth replaying
+    if not entry.get('content'):
+        return
+    def run():
+        try:
+            SQL.insert_response_cache(key, instance.instance_id, entry)
+        except Exception as e:
+            logger.error(e)
+    threading.Thread(target=run, daemon=True).start()
+
+async def replay(instance, generation, model:str, entry:dict) -> None:
+    # Same calls a streamed response makes, the message can't tell the difference
+    bot_message = generation.bot_message
+    recorder = telemetry.Recorder(instance, model)
+    recorder.add_details(cache='hit')
+    generation.set_state(engine.STREAMING)
+    try:
+        for text, update in ((entry.get('thinking'), bot_message.update_thinking), (entry.get('content'), bot_message.update_message)):
+            text = text or ''
+            for i in range(0, len(text), REPLAY_CHUNK):
+                recorder.chunk()
+                update(text[i:i + REPLAY_CHUNK])
+                await asyncio.sleep(0)
+    except BaseException:
+        recorder.finish(engine.CANCELLED)
+        raise
+    recorder.set(completion_tokens=entry.get('completion_tokens'))
+    recorder.finish(engine.FINISHED)
+    logger.info('Replayed a cached response of {}'.format(model))
@@ -0,0 +1,135 @@
+# summaries.py
+"""
+Rolling summaries of long chats.
+Older turns are summarized in the background with the title model and batch priority,
+the summary is stored with the chat and sent in place of the turns it covers.
+It's only refreshed once enough new turns piled up behind the ones always sent as they are.
+"""
+
+import threading, logging, time
+from . import engine, context, prompt
+from ...sql_manager import Instance as SQL
+
+logger = logging.getLogger(__name__)
+
+RECENT_TURNS = 6 # Always sent as they are
+SUMMARY_STEP = 4 # New turns needed to refresh the summary
+
+summaries = {} # chat_id -> summary
+running = set()
+lock = threading.Lock()
+
+def get_summary(chat) -> dict:
+    with lock:
+        if chat.chat_id in summaries:
+            return summaries.get(chat.chat_id)
+    summary = SQL.get_chat_summary(chat.chat_id)
+    with lock:
+        summaries[chat.chat_id] = summary
+    return summary
+
+def store(chat, summary:dict) -> None:
+    with lock:
+        summaries[chat.chat_id] = summary
+    SQL.insert_or_update_chat_summary(chat.chat_id, summary)
+
+def get_sent_messages(chat) -> list:
+    # One entry per converted message, same filter as the chat converters
+    return [m for m in chat.get_messages() if m.get_content() and m.dt]
+
+def get_covered_count(chat, summary:dict) -> int:
+    # A summary is dropped once a message it covers was deleted
+    if not summary:
+        return 0
+    message_ids = [m.message_id for m in get_sent_messages(chat)]
+    if summary.get('last_message_id') not in message_ids:
+        return 0
+    covered = message_ids.index(summary.get('last_message_id')) + 1
+    return covered if covered == summary.get('message_count') else 0
+
+def get_summary_message(summary:dict) -> dict:
+    return {
+        'role': 'system',
+        'content': 'Summary of the earlier conversation:\n\n{}'.format(summary.get('content'))
+    }
+
+def with_summary(build, chat):
+    """
+    Wraps the build function given to context.fit so the messages covered by the summary
+    of the chat are replaced by it, the system messages among them are kept.
+    """
+    summary = get_summary(chat) if chat.chat_id else None
+    covered = get_covered_count(chat, summary)
+    if not covered:
+        return build
+
+    def build_with_summary(compact_before:int) -> list:
+        messages = build(0)
+        if covered >= len(messages):
+            # Regenerating a message the summary already covers, it would leak later turns
+            return build(compact_before) if compact_before else messages
+        system_messages = [m for m in messages[:covered] if m.get('role') == 'system']
+        if compact_before:
+            # compact_before counts the kept system messages and the summary
+            messages = build(max(0, compact_before - len(system_messages) - 1 + covered))
+        return system_messages + [get_summary_message(summary)] + messages[covered:]
+    return build_with_summary
+
+def get_transcript(messages:list) -> str:
+    roles = {'user': 'User', 'assistant': 'Assistant', 'system': 'System'}
+    return '\n\n'.join('{}: {}'.format(roles.get(m.get('role'), m.get('role')), prompt.get_text(m)) for m in messages)
+
+def needs_summary(chat) -> bool:
+    # Only once the conversation stopped fitting the context window
+    usage = chat.context_usage or {}
+    return bool(usage.get('dropped') or usage.get('compacted'))
+
+def summarize(instance, chat, model:str) -> None:
+    # Attachments are left out, the summary is about the conversation itself
+    sent_messages = get_sent_messages(chat)
+    messages = chat.convert_to_ollama(compact_before=len(sent_messages))
+    if len(messages) != len(sent_messages) or not needs_summary(chat):
+        return
+    summary = get_summary(chat)
+    covered = get_covered_count(chat, summary)
+    pending_turns = [turn for turn in context.get_turns(messages)[:-RECENT_TURNS] if turn[0] >= covered]
+    if len(pending_turns) < SUMMARY_STEP:
+        return
+
+    end = pending_turns[-1][-1] + 1
+    new_messages = [m for m in messages[covered:end] if m.get('role') != 'system']
+    summary_prompt = '## Current summary\n\n{}\n\n## New messages\n\n{}'.format(
+        summary.get('content') if covered else '-',
+        get_transcript(new_messages)
+    )
+    content = instance.generate_summary(chat, summary_prompt, model, engine.BATCH).strip()
+    if not content:
+        return
+    store(chat, {
+        'last_message_id': sent_messages[end - 1].message_id,
+        'message_count': end,
+        'content': content,
+        'updated_at': time.time()
+    })
+    logger.info('Summary of {} covers {} messages'.format(chat.get_name(), end))
+
+def run(instance, chat, model:str) -> None:
+    with lock:
+        if chat.chat_id in running:
+            return
+        running.add(chat.chat_id)
+    try:
+        summarize(instance, chat, model)
+    except Exception as e:
+        logger.warning('Summary postponed: {}'.format(e))
+    finally:
+        with lock:
+            running.discard(chat.chat_id)
+
+def request_summary(instance, chat, model:str) -> None:
+    """
+    Call it after the response is done, the summary is only generated when the chat
+    is long enough and it waits behind every other request of the instance.
+    """
+    if chat.chat_id and not chat.is_template and instance.properties.get('summarize_context'):
+        threading.Thread(target=run, args=(instance, chat, model), daemon=True).start()
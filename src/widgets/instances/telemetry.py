@@ -0,0 +1,139 @@
+# telemetry.py
+"""
+Per request metrics for every instance, stored in the telemetry table.
+Durations are in seconds, token counts come from the server when it reports them.
+"""
+
+import threading, logging, time, statistics
+from ...sql_manager import Instance as SQL
+
+logger = logging.getLogger(__name__)
+
+PERFORMANCE_SAMPLE = 2000 # Latest requests used by the performance view
+
+def get_percentile(values:list, percentile:float) -> float:
+    # Nearest rank
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(percentile / 100 * len(values)) - 1))]
+
+class Recorder:
+    def __init__(self, instance, model:str, kind:str='response', ticket=None):
+        self.instance_id = instance.instance_id
+        self.instance_type = instance.instance_type
+        self.model = model
+        self.kind = kind
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self.chunk_times = []
+        self.values = {}
+        self.details = {}
+        if ticket and ticket.granted:
+            self.values['queue_wait'] = ticket.granted - ticket.enqueued
+
+    def chunk(self) -> None:
+        # Call it for every chunk that carries output (text, thinking or tool calls)
+        self.chunk_times.append(time.monotonic())
+
+    def set(self, **values) -> None:
+        self.values.update({k: v for k, v in values.items() if v is not None})
+
+    def add_details(self, **details) -> None:
+        self.details.update(details)
+
+    def set_ollama_stats(self, response) -> None:
+        # Final chunk (or whole response) of an Ollama request, durations are in nanoseconds
+        def to_seconds(ns:int) -> float:
+            return ns / 10**9 if ns else None
+        self.set(
+            total_duration = to_seconds(response.total_duration),
+            load_duration = to_seconds(response.load_duration),
+            prompt_eval_duration = to_seconds(response.prompt_eval_duration),
+            prompt_tokens = response.prompt_eval_count,
+            completion_tokens = response.eval_count
+        )
+        if response.eval_count and response.eval_duration:
+            self.set(tokens_per_second = response.eval_count / to_seconds(response.eval_duration))
+
+    def set_openai_usage(self, usage) -> None:
+        if usage:
+            self.set(
+                prompt_tokens = usage.prompt_tokens,
+                completion_tokens = usage.completion_tokens
+            )
+
+    def get_metrics(self, state:str) -> dict:
+        metrics = {
+            'instance_id': self.instance_id,
+            'instance_type': self.instance_type,
+            'model': self.model,
+            'kind': self.kind,
+            'state': state,
+            'started_at': self.started_at,
+            'total_duration': time.monotonic() - self.started
+        }
+        if self.chunk_times:
+            gaps = [b - a for a, b in zip(self.chunk_times, self.chunk_times[1:])]
+            metrics['ttft'] = self.chunk_times[0] - self.started
+            metrics['itl_p50'] = get_percentile(gaps, 50)
+            metrics['itl_p90'] = get_percentile(gaps, 90)
+            metrics['itl_p99'] = get_percentile(gaps, 99)
+            span = self.chunk_times[-1] - self.chunk_times[0]
+            if span > 0: # Chunks arriving in the same clock tick (buffered or replayed) have no rate
+                # Chunks stand in for tokens when the server doesn't count them, the first one starts the clock
+                tokens = self.values.get('completion_tokens') or len(self.chunk_times)
+                metrics['tokens_per_second'] = max(1, tokens - 1) / span
+        metrics.update(self.values)
+        metrics['details'] = self.details
+        return metrics
+
+    def finish(self, state:str) -> dict:
+        metrics = self.get_metrics(state)
+        threading.Thread(target=store, args=(metrics,), daemon=True).start()
+        return metrics
+
+def store(metrics:dict) -> None:
+    try:
+        SQL.insert_telemetry(metrics)
+    except Exception as e:
+        logger.error(e)
+
+def get_model_performance() -> list:
+    """
+    Medians of the latest finished responses per instance and model,
+    sorted from the fastest generation to the slowest.
+    """
+    groups = {}
+    cache_hits = {}
+    for entry in SQL.get_telemetry('response', PERFORMANCE_SAMPLE):
+        if entry.get('state') == 'finished':
+            key = (entry.get('instance_id'), entry.get('model'))
+            # Replayed responses say nothing about the model's speed
+            if entry.get('details').get('cache') == 'hit':
+                cache_hits[key] = cache_hits.get(key, 0) + 1
+            else:
+                groups.setdefault(key, []).append(entry)
+
+    def median(entries:list, key:str) -> float:
+        values = [e.get(key) for e in entries if e.get(key) is not None]
+        return statistics.median(values) if values else None
+
+    performance = []
+    for (instance_id, model), entries in groups.items():
+        performance.append({
+            'instance_id': instance_id,
+            'model': model,
+            'requests': len(entries),
+            'ttft': median(entries, 'ttft'),
+            'itl_p50': median(entries, 'itl_p50'),
+            'itl_p90': median(entries, 'itl_p90'),
+            'tokens_per_second': median(entries, 'tokens_per_second'),
+            'load_duration': median(entries, 'load_duration'),
+            'prompt_tokens': median(entries, 'prompt_tokens'),
+            'completion_tokens': median(entries, 'completion_tokens'),
+            'load_saved': sum(e.get('details').get('load_saved', 0) for e in entries),
+            'cache_hits': cache_hits.get((instance_id, model), 0),
+            'cache_misses': len([e for e in entries if e.get('details').get('cache') == 'miss'])
+        })
+    return sorted(performance, key=lambda p: p.get('tokens_per_second') or 0, reverse=True)
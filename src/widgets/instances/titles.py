@@ -0,0 +1,95 @@
+# titles.py
+"""
+Chat titles are generated after the response is done so they never compete with it.
+A heuristic title is shown right away and titles that couldn't be generated
+(instance offline) are retried together once the instance answers again.
+"""
+
+from gi.repository import GLib
+
+import threading, logging, re, httpx, openai
+from . import engine
+
+logger = logging.getLogger(__name__)
+
+HEURISTIC_TITLE_LENGTH = 30
+# Only these are retried once the instance answers again
+CONNECTION_ERRORS = (ConnectionError, TimeoutError, httpx.TransportError, openai.APIConnectionError)
+
+placeholders = {} # chat_id -> name given by the heuristic
+pending = {} # instance_id -> {chat_id: (chat, prompt, model)}
+lock = threading.Lock()
+
+def get_heuristic_title(prompt:str) -> str:
+    line = next((l.strip() for l in prompt.splitlines() if l.strip() and not l.strip().startswith('```')), '')
+    line = re.sub(r'\[([^\]]*)\]\([^)]*\)', r'\1', line)
+    line = re.sub(r'[#>*_`~|\[\]]+', '', line).strip()
+    if len(line) > HEURISTIC_TITLE_LENGTH:
+        line = line[:HEURISTIC_TITLE_LENGTH].rsplit(' ', 1)[0].strip() + '...'
+    return line
+
+def clean_title(title:str) -> str:
+    title = re.sub(r'<think>.*?</think>', '', title, flags=re.DOTALL).replace('\n', ' ').strip()
+    if len(title) > HEURISTIC_TITLE_LENGTH:
+        title = title[:HEURISTIC_TITLE_LENGTH].strip() + '...'
+    return title
+
+def set_placeholder(chat, prompt:str) -> None:
+    # Runs in the main loop
+    title = get_heuristic_title(prompt)
+    if title and chat.row and chat.row.get_parent():
+        chat.row.edit(title, chat.is_template)
+        placeholders[chat.chat_id] = chat.row.get_name()
+
+def set_title(chat, title:str) -> None:
+    # Runs in the main loop, a chat renamed by the user in the meantime is left alone
+    if not chat.row or not chat.row.get_parent():
+        return
+    if chat.row.get_name() == placeholders.pop(chat.chat_id, chat.row.get_name()):
+        chat.row.edit(title, chat.is_template)
+
+def generate(instance, requests:list, priority:int=engine.TITLE) -> bool:
+    generated = False
+    for chat, prompt, model in requests:
+        if not chat.row or not chat.row.get_parent(): # Deleted
+            continue
+        try:
+            title = clean_title(instance.generate_chat_title(chat, prompt, model, priority))
+        except CONNECTION_ERRORS as e:
+            logger.warning('Title generation postponed: {}'.format(e))
+            with lock:
+                pending.setdefault(instance.instance_id, {})[chat.chat_id] = (chat, prompt, model)
+            continue
+        except Exception as e:
+            # The heuristic title stays
+            logger.error('Title generation failed: {}'.format(e))
+            continue
+        generated = True
+        if title:
+            GLib.idle_add(set_title, chat, title)
+    return generated
+
+def generate_pending(instance) -> None:
+    with lock:
+        postponed = list(pending.pop(instance.instance_id, {}).values())
+    if postponed:
+        logger.info('Generating {} postponed titles'.format(len(postponed)))
+        generate(instance, postponed, engine.BATCH)
+
+def flush_pending(instance) -> None:
+    # Call it when the instance answered, titles of chats created while it was offline are generated in one go
+    with lock:
+        has_pending = bool(pending.get(instance.instance_id))
+    if has_pending:
+        threading.Thread(target=generate_pending, args=(instance,), daemon=True).start()
+
+def run(instance, chat, prompt:str, model:str) -> None:
+    if generate(instance, [(chat, prompt, model)]):
+        generate_pending(instance)
+
+def request_title(instance, chat, prompt:str, model:str) -> None:
+    """
+    Call it after the response is done, the title is generated on its own thread
+    and waits for a title slot of the instance.
+    """
+    threading.Thread(target=run, args=(instance, chat, prompt, model), daemon=True).start()
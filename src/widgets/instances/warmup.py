@@ -0,0 +1,97 @@
+# warmup.py
+"""
+Predictive model loading.
+Picking a model or focusing the message box loads the model in the background so the
+first response doesn't pay for it. Requests are debounced, skipped while the instance
+has anything running or queued and cancelled when a response for another model starts.
+"""
+
+from gi.repository import GLib
+
+import asyncio, threading, logging, time
+from . import engine, telemetry, keep_alive_policy
+
+logger = logging.getLogger(__name__)
+
+DEBOUNCE = 700 # milliseconds
+RECENT = 60 # seconds, a model warmed up this recently isn't requested again
+
+timers = {} # instance_id -> GLib source, only touched from the main loop
+warmups = {} # instance_id -> {'model', 'future', 'started', 'finished', 'load_duration', 'claimed'}
+lock = threading.Lock()
+
+def request(instance, model_name:str) -> None:
+    # Main loop only, instances without warm_up (online services) are skipped
+    if not getattr(instance, 'warm_up', None) or not instance.client or not model_name:
+        return
+    if instance.instance_id in timers:
+        GLib.source_remove(timers.pop(instance.instance_id))
+    timers[instance.instance_id] = GLib.timeout_add(DEBOUNCE, start, instance, model_name)
+
+def start(instance, model_name:str) -> bool:
+    timers.pop(instance.instance_id, None)
+    status = engine.get_scheduler(instance.instance_id).get_status()
+    if status.get('running') or status.get('queued'):
+        # Loading a model now could evict the one a response is using
+        return False
+    with lock:
+        warmup = warmups.get(instance.instance_id)
+        if warmup and warmup.get('model') == model_name and (not warmup.get('finished') or time.monotonic() - warmup.get('finished') < RECENT):
+            return False
+        if warmup and not warmup.get('finished'):
+            warmup.get('future').cancel()
+        warmup = {
+            'model': model_name,
+            'started': time.monotonic(),
+            'finished': None,
+            'load_duration': 0,
+            'claimed': False
+        }
+        warmup['future'] = asyncio.run_coroutine_threadsafe(run(instance, warmup), engine.get_loop())
+        warmups[instance.instance_id] = warmup
+    return False
+
+async def run(instance, warmup:dict) -> None:
+    recorder = telemetry.Recorder(instance, warmup.get('model'), 'warmup')
+    try:
+        load_duration = await instance.warm_up(warmup.get('model'))
+    except asyncio.CancelledError:
+        recorder.finish(engine.CANCELLED)
+        raise
+    except Exception as e:
+        logger.warning('Warm-up of {} failed: {}'.format(warmup.get('model'), e))
+        recorder.finish(engine.FAILED)
+        with lock:
+            if warmups.get(instance.instance_id) is warmup:
+                del warmups[instance.instance_id]
+        return
+    with lock:
+        warmup['finished'] = time.monotonic()
+        warmup['load_duration'] = load_duration or 0
+    if load_duration: # None when the model was already loaded
+        logger.info('Loaded {} ahead of time in {:.1f}s'.format(warmup.get('model'), load_duration))
+        recorder.set(load_duration=load_duration)
+        recorder.finish(engine.FINISHED)
+
+def claim(instance, model_name:str) -> float:
+    """
+    Call it when a response starts, returns the seconds of loading the warm-up saved it.
+    A warm-up of another model is cancelled so it doesn't compete with the response.
+    """
+    with lock:
+        warmup = warmups.get(instance.instance_id)
+        if not warmup or warmup.get('claimed'):
+            return 0
+        if warmup.get('model') != model_name:
+            if not warmup.get('finished'):
+                warmup.get('future').cancel()
+                del warmups[instance.instance_id]
+            return 0
+        warmup['claimed'] = True
+        if not warmup.get('finished'):
+            # Still loading, the response waits for what's left
+            return time.monotonic() - warmup.get('started')
+        keep_alive = keep_alive_policy.get_keep_alive(instance, model_name)
+        if keep_alive >= 0 and time.monotonic() - warmup.get('finished') > keep_alive:
+            return 0
+        return warmup.get('load_duration')
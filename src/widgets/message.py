@@ -7,7 +7,9 @@ import gi
 from gi.repository import Gtk, Gio, Adw, GLib, Gdk, GtkSource, Spelling
 import os, datetime, threading, sys, base64, logging, re, tempfile
 from ..sql_manager import prettify_model_name, generate_uuid, format_datetime, Instance as SQL
+from ..constants import YOUTUBE_URL_REGEX, URL_REGEX
 from . import attachments, blocks, dialog, voice, tools, models, chat, activities
+from .instances import warmup
 
 
 logger = logging.getLogger(__name__)
@@ -48,6 +50,8 @@ class OptionPopup(Gtk.Popover):
         chat_element = self.get_ancestor(chat.Chat)
         SQL.delete_message(message_element)
         message_element.unparent()
+        if len(list(chat_element.container)) == 0:
+            chat_element.load_older_messages()
         if len(list(chat_element.container)) == 0:
             chat_element.set_visible_child_name('welcome-screen')
         elif chat_element:
@@ -97,24 +101,18 @@ class OptionPopup(Gtk.Popover):
                 tools = {t.name: t for t in list(self.get_root().global_footer.tool_selector.get_model()) if t.runnable}
 
             if len(tools) > 0:
-                GLib.idle_add(threading.Thread(
-                    target=self.get_root().get_current_instance().use_tools,
-                    args=(
-                        message_element,
-                        current_model,
-                        tools
-                    ),
-                    daemon=True
-                ).start)
+                GLib.idle_add(
+                    self.get_root().get_current_instance().use_tools,
+                    message_element,
+                    current_model,
+                    tools
+                )
             else:
-                GLib.idle_add(threading.Thread(
-                    target=self.get_root().get_current_instance().generate_message,
-                    args=(
-                        message_element,
-                        current_model
-                    ),
-                    daemon=True
-                ).start)
+                GLib.idle_add(
+                    self.get_root().get_current_instance().generate_message,
+                    message_element,
+                    current_model
+                )
 
             message_element.main_stack.set_visible_child_name('loading')
         else:
@@ -148,11 +146,15 @@ class BlockContainer(Gtk.Box):
             if child != self.generating_block:
                 self.remove(child)
 
-    def set_content(self, content:str) -> None:
+    def set_content(self, content:str, parsed:list=None) -> None:
+        """
+        Text and code blocks past the size limits in blocks.parser are built
+        collapsed to a preview and filled a chunk per idle cycle
+        """
         self.clear()
         message = self.get_ancestor(Message)
 
-        for block in blocks.text_to_block_list(content):
+        for block in blocks.text_to_block_list(content, parsed):
             GLib.idle_add(self.append, block)
         GLib.idle_add(message.main_stack.set_visible_child_name, 'content')
 
@@ -173,7 +175,8 @@ class BlockContainer(Gtk.Box):
             if len(list(self)) <= 1:
                 GLib.idle_add(self.prepend, block)
             else:
-                if isinstance(list(self)[-2], blocks.Text) and isinstance(block, blocks.Text):
+                # Text stops being merged once the label would get too large to lay out
+                if isinstance(list(self)[-2], blocks.Text) and isinstance(block, blocks.Text) and not blocks.is_large_block(list(self)[-2].get_content() + block.get_content()):
                     if not list(self)[-2].get_content().endswith('\n') or block.get_content().startswith('\n'):
                         GLib.idle_add(list(self)[-2].append_content, '\n{}'.format(block.get_content()))
                     else:
@@ -217,6 +220,10 @@ class Message(Gtk.Box):
         self.dt = dt
         self.option_button = None
         self.message_id = message_id
+        # Streamed output held back while the chat can't be seen
+        self.pending_content = ""
+        self.pending_thinking = ""
+        self.pending_lock = threading.Lock()
 
         super().__init__()
         self.popup = OptionPopup()
@@ -237,6 +244,9 @@ class Message(Gtk.Box):
     def get_content_for_dictation(self) -> str:
         return '\n'.join([c.get_content_for_dictation().strip() for c in list(self.block_container) if c is not None])
 
+    def get_attachments(self) -> list:
+        return self.image_attachment_container.get_content() + self.attachment_container.get_content()
+
     def get_model(self) -> str or None:
         """
         Get the model name if the author is a model
@@ -327,29 +337,49 @@ class Message(Gtk.Box):
                 self.block_container.remove(self.block_container.thinking_block)
             self.block_container.thinking_block = None
 
-    def update_message(self, content:str):
+    def is_rendering_visible(self) -> bool:
+        # False when the window is hidden or the chat isn't the one being shown
+        chat_element = self.get_ancestor(chat.Chat)
+        return not chat_element or chat_element.rendering_visible
+
+    def render_pending(self):
+        """
+        Renders everything held back while the chat couldn't be seen in a single catch up
+        """
+        with self.pending_lock:
+            content, self.pending_content = self.pending_content, ""
+            thinking, self.pending_thinking = self.pending_thinking, ""
+        if not content and not thinking:
+            return
+
+        if thinking:
+            self.block_container.add_thinking(thinking)
         if content:
             GLib.idle_add(self.block_container.generating_block.append_content, content)
-            GLib.idle_add(self.main_stack.set_visible_child_name, 'content')
+        GLib.idle_add(self.main_stack.set_visible_child_name, 'content')
 
-            chat_element = self.get_ancestor(chat.Chat)
-            if chat_element:
-                vadjustment = chat_element.scrolledwindow.get_vadjustment()
-                if vadjustment.get_value() + 150 >= vadjustment.get_upper() - vadjustment.get_page_size():
-                    GLib.idle_add(vadjustment.set_value, vadjustment.get_upper() - vadjustment.get_page_size())
+        chat_element = self.get_ancestor(chat.Chat)
+        if chat_element:
+            vadjustment = chat_element.scrolledwindow.get_vadjustment()
+            if vadjustment.get_value() + 150 >= vadjustment.get_upper() - vadjustment.get_page_size():
+                GLib.idle_add(vadjustment.set_value, vadjustment.get_upper() - vadjustment.get_page_size())
 
+        if content:
             GLib.idle_add(self.remove_and_attach_thought)
 
-    def update_thinking(self, content):
+    def update_message(self, content:str):
         if content:
-            self.block_container.add_thinking(content)
-            GLib.idle_add(self.main_stack.set_visible_child_name, 'content')
+            with self.pending_lock:
+                self.pending_content += content
+            if self.is_rendering_visible():
+                self.render_pending()
 
-            chat_element = self.get_ancestor(chat.Chat)
-            if chat_element:
-                vadjustment = chat_element.scrolledwindow.get_vadjustment()
-                if vadjustment.get_value() + 150 >= vadjustment.get_upper() - vadjustment.get_page_size():
-                    GLib.idle_add(vadjustment.set_value, vadjustment.get_upper() - vadjustment.get_page_size())
+    def update_thinking(self, content):
+        if content:
+            with self.pending_lock:
+                self.pending_thinking += content
+            if self.is_rendering_visible():
+                self.render_pending()
 
     def finish_generation(self, response_metadata:str=None):
         chat_element = self.get_ancestor(chat.Chat)
@@ -377,8 +407,13 @@ class Message(Gtk.Box):
         if chat_element and root:
             chat_element.stop_message()
         self.dt = datetime.datetime.now()
+        with self.pending_lock:
+            pending_content, self.pending_content = self.pending_content, ""
+            pending_thinking, self.pending_thinking = self.pending_thinking, ""
+        if pending_thinking:
+            self.block_container.add_thinking(pending_thinking)
         buffer = self.block_container.generating_block.buffer
-        final_text = buffer.get_text(buffer.get_start_iter(), buffer.get_end_iter(), False)
+        final_text = buffer.get_text(buffer.get_start_iter(), buffer.get_end_iter(), False) + pending_content
         GLib.idle_add(self.block_container.add_content, final_text)
         GLib.idle_add(self.block_container.remove_generating_block)
         GLib.idle_add(self.update_profile_picture)
@@ -426,24 +461,14 @@ class GlobalMessageTextView(GtkSource.View):
         try:
             text = clipboard.read_text_finish(result)
             #Check if text is a Youtube URL
-            youtube_regex = re.compile(
-                r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/'
-                r'(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})')
-            url_regex = re.compile(
-                r'http[s]?://'
-                r'(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|'
-                r'(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-                r'(?:\\:[0-9]{1,5})?'
-                r'(?:/[^\\s]*)?'
-            )
-            if youtube_regex.match(text):
+            if YOUTUBE_URL_REGEX.match(text):
                 dialog.simple(
                     parent = self.get_root(),
                     heading = _('Attach YouTube Video?'),
                     body = _('Note that YouTube might block access to captions, please check output'),
                     callback = lambda url=text: threading.Thread(target=self.get_ancestor(GlobalFooter).attachment_container.attach_youtube, args=(url,), daemon=True).start()
                 )
-            elif url_regex.match(text):
+            elif URL_REGEX.match(text):
                 dialog.simple(
                     parent = self.get_root(),
                     heading = _('Attach Website? (Experimental)'),
@@ -548,6 +573,7 @@ class GlobalFooter(Gtk.Box):
     model_selector = Gtk.Template.Child()
     tool_selector = Gtk.Template.Child()
     wrap_box = Gtk.Template.Child()
+    context_label = Gtk.Template.Child()
 
     def __init__(self):
         self.send_callback = None
@@ -563,6 +589,11 @@ class GlobalFooter(Gtk.Box):
         settings.bind('show-model-manager-shortcut', self.model_manager_shortcut, 'visible', Gio.SettingsBindFlags.DEFAULT)
 
         self.model_selector.selector.connect('notify::selected', lambda dropdown, gparam: self.tool_selector.model_changed(dropdown))
+        # The user is about to send a message, the model can start loading
+        self.model_selector.selector.connect('notify::selected', lambda dropdown, gparam: self.request_warmup())
+        focus_controller = Gtk.EventControllerFocus()
+        focus_controller.connect('enter', lambda controller: self.request_warmup())
+        self.message_text_view.add_controller(focus_controller)
         self.action_stack.set_sensitive(len(models.text.model_selector_model) > 0)
         models.text.model_selector_model.connect('notify::n-items', lambda m, p: self.action_stack.set_sensitive(len(m) > 0))
         GLib.idle_add(self.set_send_callback)
@@ -579,9 +610,33 @@ class GlobalFooter(Gtk.Box):
         for file in files:
             self.attachment_container.on_attachment(file)
 
+    def request_warmup(self):
+        root = self.get_root()
+        selected_item = self.model_selector.get_selected_item()
+        if selected_item and getattr(root, 'get_current_instance', None):
+            warmup.request(root.get_current_instance(), selected_item.model.get_name())
+
     def toggle_action_button(self, state:bool):
         self.action_stack.set_visible_child_name('send' if state else 'stop')
 
+    def set_context_usage(self, usage:dict=None):
+        # Estimated tokens of the last prompt sent in the current chat
+        self.context_label.set_visible(bool(usage))
+        if not usage:
+            return
+        def format_tokens(tokens:int) -> str:
+            return '{:.1f}k'.format(tokens / 1000) if tokens >= 1000 else str(tokens)
+        if usage.get('limit'):
+            self.context_label.set_label(_('{} / {} tokens').format(format_tokens(usage.get('tokens')), format_tokens(usage.get('limit'))))
+        else:
+            self.context_label.set_label(_('{} tokens').format(format_tokens(usage.get('tokens'))))
+        tooltip = [_('Estimated context used by the last message')]
+        if usage.get('dropped'):
+            tooltip.append(_('{} older messages were left out').format(usage.get('dropped')))
+        if usage.get('compacted'):
+            tooltip.append(_('Attachments of older messages were left out'))
+        self.context_label.set_tooltip_text('\n'.join(tooltip))
+
     def get_buffer(self):
         return self.message_text_view.get_buffer()
 
@@ -291,13 +291,13 @@ class BasicModelButton(Gtk.Button):
         if 'capabilities' not in self.data and self.instance:
             self.data = self.instance.get_model_info(self.get_name())
 
-        return 'vision' in self.data.get('capabilities', [])
+        return 'vision' in (self.data.get('capabilities') or [])
 
     def can_use_tools(self) -> bool:
         if 'capabilities' not in self.data and self.instance:
             self.data = self.instance.get_model_info(self.get_name())
 
-        return 'tools' in self.data.get('capabilities', [])
+        return 'tools' in (self.data.get('capabilities') or [])
 
     def update_profile_picture(self):
         self.set_image_data(SQL.get_model_preferences(self.get_name()).get('picture'))
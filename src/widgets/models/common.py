@@ -5,6 +5,7 @@ import os, threading, importlib.util
 from .. import dialog
 from ...constants import data_dir, cache_dir, MODEL_CATEGORIES_METADATA
 from ...sql_manager import Instance as SQL
+from ..instances import lore
 
 available_models_data = {}
 
@@ -108,6 +109,7 @@ def remove_text_model(model):
         from .text import delete_from_model_selector
         delete_from_model_selector(model.get_name())
         SQL.remove_model_preferences(model.get_name())
+        lore.invalidate(model.get_name())
         threading.Thread(target=window.chat_bin.get_child().row.update_profile_pictures, daemon=True).start()
 
 def remove_stt_model(model):
@@ -4,6 +4,7 @@ from gi.repository import Gtk, Gio, Adw
 import logging, os, re, threading
 from ...sql_manager import prettify_model_name, Instance as SQL
 from .. import attachments
+from ..instances import lore
 from .text import TextModelRow, list_from_selector, get_model
 
 logger = logging.getLogger(__name__)
@@ -150,6 +151,7 @@ class ModelCreatorDialog(Adw.Dialog):
             SQL.insert_or_update_model_picture(model_name, base_model_preferences.get('picture'))
             SQL.insert_or_update_model_voice(model_name, base_model_preferences.get('voice'))
             SQL.insert_or_update_model_character(model_name, base_model_preferences.get('character'))
+            lore.invalidate(model_name)
 
         system_message = []
         for attachment in self.context_attachment_container.get_content():
@@ -2,6 +2,7 @@
 
 from gi.repository import Gtk, Adw, GLib
 from . import text, basic, common
+from ..instances import model_cache
 
 import os, importlib.util, re
 from ...constants import data_dir, STT_MODELS, TTS_VOICES, REMBG_MODELS, MODEL_CATEGORIES_METADATA
@@ -130,7 +131,7 @@ class ModelManager(Adw.NavigationPage):
         instance = self.get_root().get_current_instance()
 
         # Normal Models
-        instance.local_models = None # Reset cache
+        model_cache.invalidate_local_models(instance)
         local_models = instance.get_local_models()
         for model in local_models:
             self.create_text_model(
@@ -19,6 +19,7 @@ class PreferencesDialog(Adw.PreferencesDialog):
     zoom_spin = Gtk.Template.Child()
     regenerate_after_edit = Gtk.Template.Child()
     image_size_spin = Gtk.Template.Child()
+    max_loaded_chats_spin = Gtk.Template.Child()
 
     #AUDIO
     mic_group = Gtk.Template.Child()
@@ -117,6 +118,7 @@ class PreferencesDialog(Adw.PreferencesDialog):
             self.background_switch.set_visible(False)
 
         self.settings.bind('max-image-size', self.image_size_spin, 'value', Gio.SettingsBindFlags.DEFAULT)
+        self.settings.bind('max-loaded-chats', self.max_loaded_chats_spin, 'value', Gio.SettingsBindFlags.DEFAULT)
 
         # AUDIO
         for model, size in STT_MODELS.items():
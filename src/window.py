@@ -63,6 +63,8 @@ class AlpacaWindow(Adw.ApplicationWindow):
 
     instance_preferences_page = Gtk.Template.Child()
     instance_listbox = Gtk.Template.Child()
+    performance_group = Gtk.Template.Child()
+    performance_listbox = Gtk.Template.Child()
     last_selected_instance_row = None
 
     chat_split_view_overlay = Gtk.Template.Child()
@@ -120,6 +122,10 @@ class AlpacaWindow(Adw.ApplicationWindow):
             items = options.keys()
         )
 
+    @Gtk.Template.Callback()
+    def instance_manager_showing(self, page):
+        Widgets.instances.update_performance_list(self.performance_group, self.performance_listbox, self.instance_listbox)
+
     @Gtk.Template.Callback()
     def instance_changed(self, listbox, row):
         def change_instance():
@@ -181,7 +187,7 @@ class AlpacaWindow(Adw.ApplicationWindow):
             logger.info("Hiding app...")
         else:
             logger.info("Closing app...")
-            is_chat_busy = any([chat_row.chat.busy for chat_row in list(self.get_chat_list_page().chat_list_box)])
+            is_chat_busy = any([chat_row.loaded_chat.busy for chat_row in list(self.get_chat_list_page().chat_list_box) if chat_row.loaded_chat])
             is_model_downloading = any([el for el in list(self.model_manager.added_model_flowbox) if el.get_child().progressbar.get_visible()])
             if is_chat_busy or is_model_downloading:
                 options = {
@@ -207,6 +213,14 @@ class AlpacaWindow(Adw.ApplicationWindow):
     def message_search_changed(self, entry, current_chat=None):
         self.chat_bin.get_child().on_search(entry.get_text())
 
+    @Gtk.Template.Callback()
+    def message_search_next(self, widget=None):
+        self.chat_bin.get_child().navigate_search(1)
+
+    @Gtk.Template.Callback()
+    def message_search_previous(self, widget=None):
+        self.chat_bin.get_child().navigate_search(-1)
+
     def send_message(self, mode:int=0, available_tools:dict={}): #mode 0=user 1=system
         buffer = self.global_footer.get_buffer()
 
@@ -266,9 +280,9 @@ class AlpacaWindow(Adw.ApplicationWindow):
             current_chat.add_message(m_element_bot)
             GLib.idle_add(m_element_bot.save)
             if len(available_tools) > 0:
-                GLib.idle_add(threading.Thread(target=self.get_current_instance().use_tools, args=(m_element_bot, current_model, available_tools), daemon=True).start)
+                GLib.idle_add(self.get_current_instance().use_tools, m_element_bot, current_model, available_tools)
             else:
-                GLib.idle_add(threading.Thread(target=self.get_current_instance().generate_message, args=(m_element_bot, current_model), daemon=True).start)
+                GLib.idle_add(self.get_current_instance().generate_message, m_element_bot, current_model)
         elif mode==1:
             current_chat.set_visible_child_name('content')
 
@@ -290,7 +304,7 @@ class AlpacaWindow(Adw.ApplicationWindow):
             if os.path.isfile(os.path.join(cache_dir, 'import.db')):
                 os.remove(os.path.join(cache_dir, 'import.db'))
             file.copy(Gio.File.new_for_path(os.path.join(cache_dir, 'import.db')), Gio.FileCopyFlags.OVERWRITE, None, None, None, None)
-            chat_names = [tab.chat.get_name() for tab in list(self.get_chat_list_page().chat_list_box)]
+            chat_names = [tab.get_name() for tab in list(self.get_chat_list_page().chat_list_box)]
             for chat in SQL.import_chat(os.path.join(cache_dir, 'import.db'), chat_names, self.get_chat_list_page().folder_id):
                 self.get_chat_list_page().add_chat(
                     chat_name=chat[1],
@@ -358,6 +372,7 @@ class AlpacaWindow(Adw.ApplicationWindow):
         popover.set_has_arrow(True)
         popover.set_halign(0)
         self.new_chat_splitbutton.set_popover(popover)
+        self.message_searchbar.connect_entry(self.searchentry_messages)
 
         self.set_focus(self.global_footer.message_text_view)
 
@@ -0,0 +1,100 @@
+# test_image_cache.py
+"""
+Tests the online image disk cache against a local HTTP server.
+Only needs requests, the module is loaded straight from its file so no widget is imported.
+
+    python3 -m unittest discover tests
+"""
+
+import importlib.util, http.server, json, os, tempfile, threading, unittest
+
+source_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+spec = importlib.util.spec_from_file_location('alpaca_image_cache', os.path.join(source_dir, 'widgets', 'image_cache.py'))
+image_cache = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(image_cache)
+
+IMAGE = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 8
+ETAG = '"alpaca-test"'
+
+class ImageHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if server.fail:
+            self.send_response(500)
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(server.body)))
+        self.send_header('ETag', ETAG)
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, *args):
+        pass
+
+class ImageCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+        self.server.requests = []
+        self.server.fail = False
+        self.server.body = IMAGE
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/image.png'.format(self.server.server_address[1])
+        self.cache_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def metadata_path(self) -> str:
+        return [os.path.join(self.cache_directory, f) for f in os.listdir(self.cache_directory) if f.endswith('.json')][0]
+
+    def test_download_is_stored_by_content(self):
+        path = image_cache.download_online_image(self.url, self.cache_directory)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), IMAGE)
+        with open(self.metadata_path(), 'r') as f:
+            self.assertEqual(json.load(f).get('etag'), ETAG)
+
+    def test_cached_copy_is_revalidated(self):
+        first_path = image_cache.download_online_image(self.url, self.cache_directory)
+        second_path = image_cache.download_online_image(self.url, self.cache_directory)
+        self.assertEqual(first_path, second_path)
+        self.assertNotIn('If-None-Match', self.server.requests[0])
+        self.assertEqual(self.server.requests[1].get('If-None-Match'), ETAG)
+
+    def test_cached_copy_is_used_when_the_server_fails(self):
+        path = image_cache.download_online_image(self.url, self.cache_directory)
+        self.server.fail = True
+        self.assertEqual(image_cache.download_online_image(self.url, self.cache_directory), path)
+
+    def test_torn_metadata_is_a_cache_miss(self):
+        image_cache.download_online_image(self.url, self.cache_directory)
+        with open(self.metadata_path(), 'w') as f:
+            f.write('{"content": "')
+        path = image_cache.download_online_image(self.url, self.cache_directory)
+        self.assertNotIn('If-None-Match', self.server.requests[1])
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), IMAGE)
+        with open(self.metadata_path(), 'r') as f:
+            self.assertEqual(json.load(f).get('etag'), ETAG)
+
+    def test_oversized_image_is_rejected(self):
+        self.server.body = b'x' * (image_cache.MAX_IMAGE_BYTES + 1)
+        with self.assertRaises(ValueError):
+            image_cache.download_online_image(self.url, self.cache_directory)
+        self.assertEqual([f for f in os.listdir(self.cache_directory) if not f.endswith('.json')], [])
+
+    def test_failure_without_cache_raises(self):
+        self.server.fail = True
+        with self.assertRaises(Exception):
+            image_cache.download_online_image(self.url, self.cache_directory)
+
+if __name__ == '__main__':
+    unittest.main()